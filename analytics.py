@@ -0,0 +1,334 @@
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+from sqlalchemy import func, insert, literal_column, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Appointment, AppointmentDaily, AppointmentDailySync, CashFlow, Insurance, Professional, ScheduleChange
+from partitions import source
+from database import on_primary, use_primary
+from cache import TTLCache
+from changes import ID_LOOKBACK, get_change_feed
+from availability import weekly_templates
+
+# Indicadores da clínica sobre os fatos diários de appointment_daily. Os comandos registram cada dia
+# alterado em schedule_changes; antes de cada leitura só os dias alterados desde a última são recalculados.
+
+ATTENDED = "encerrado"
+NO_SHOW = "faltou"
+CANCELLED = "cancelado"
+PARTICULAR = 0
+SYNC_ID = 1
+REFRESH_CHUNK_SIZE = 500
+DASHBOARD_TTL = 600  # a grade de horários (capacidade) não passa pelo log de mudanças
+
+ProfessionalStats = namedtuple("ProfessionalStats", [
+    "professional_id", "name", "specialty", "capacity", "booked", "occupancy",
+    "attended", "no_shows", "no_show_rate", "cancelled", "cancellation_rate", "revenue"
+])
+SpecialtyRevenue = namedtuple("SpecialtyRevenue", ["specialty", "attended", "revenue", "received"])
+InsuranceShare = namedtuple("InsuranceShare", ["insurance_id", "insurance", "appointments", "share", "revenue"])
+MonthlyTrend = namedtuple("MonthlyTrend", ["month", "booked", "attended", "no_shows", "cancelled", "revenue"])
+Dashboard = namedtuple("Dashboard", ["start", "end", "totals", "professionals", "specialties", "insurances", "months"])
+
+dashboard_cache = TTLCache(ttl=DASHBOARD_TTL, maxsize=64)
+
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(AppointmentDaily)
+    if dialect == "sqlite":
+        return sqlite.insert(AppointmentDaily)
+    return None
+
+
+def apply_cancellation(db: Session, appointment: Appointment):
+    # Chamado por cancel_appointment antes de apagar a consulta, na mesma transação (sem commit)
+    key = (appointment.date, appointment.professional_id, appointment.insurance_id or PARTICULAR, CANCELLED)
+    stmt = _upsert(db)
+    if stmt is None:
+        row = db.get(AppointmentDaily, key)
+        if row is None:
+            db.add(AppointmentDaily(
+                date=key[0], professional_id=key[1], insurance_id=key[2], status=CANCELLED,
+                appointments=1, amount=0.0, received=0.0
+            ))
+        else:
+            row.appointments += 1
+        return
+    stmt = stmt.values(
+        date=key[0], professional_id=key[1], insurance_id=key[2], status=CANCELLED,
+        appointments=1, amount=0.0, received=0.0
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[
+            AppointmentDaily.date, AppointmentDaily.professional_id,
+            AppointmentDaily.insurance_id, AppointmentDaily.status
+        ],
+        set_={"appointments": AppointmentDaily.appointments + stmt.excluded.appointments},
+    ))
+
+
+def _facts_query(db: Session, start_date: date = None, end_date: date = None):
+    # Consultas agrupadas por dia, profissional, convênio e status, com o caixa já pago de cada uma
+    appointment = source(db, Appointment, start_date, end_date)
+    cash_flow = source(db, CashFlow, start_date, end_date)
+    received = (
+        db.query(cash_flow.appointment_id.label("appointment_id"), func.sum(cash_flow.amount).label("amount"))
+        .filter(cash_flow.paid == True, cash_flow.appointment_id.isnot(None))
+    )
+    if start_date:
+        received = received.filter(cash_flow.date >= start_date)
+    if end_date:
+        received = received.filter(cash_flow.date <= end_date)
+    received = received.group_by(cash_flow.appointment_id).subquery()
+    insurance_id = func.coalesce(appointment.insurance_id, literal_column(str(PARTICULAR)))
+    status = func.coalesce(appointment.status, literal_column("'agendado'"))
+    query = (
+        db.query(
+            appointment.date,
+            appointment.professional_id,
+            insurance_id,
+            status,
+            func.count(appointment.id),
+            func.coalesce(func.sum(func.coalesce(appointment.amount, Insurance.fee, 0.0)), 0.0),
+            func.coalesce(func.sum(received.c.amount), 0.0),
+        )
+        .outerjoin(Insurance, Insurance.id == appointment.insurance_id)
+        .outerjoin(received, received.c.appointment_id == appointment.id)
+        .filter(appointment.date.isnot(None), appointment.professional_id.isnot(None))
+    )
+    if start_date:
+        query = query.filter(appointment.date >= start_date)
+    if end_date:
+        query = query.filter(appointment.date <= end_date)
+    return query.group_by(appointment.date, appointment.professional_id, insurance_id, status), appointment
+
+
+def _insert_facts(db: Session, query):
+    db.execute(insert(AppointmentDaily).from_select(
+        ["date", "professional_id", "insurance_id", "status", "appointments", "amount", "received"], query
+    ))
+
+
+def _recompute_days(db: Session, days):
+    # days: [(profissional, data)]; os cancelamentos não estão mais em appointments e são preservados
+    for i in range(0, len(days), REFRESH_CHUNK_SIZE):
+        chunk = days[i:i + REFRESH_CHUNK_SIZE]
+        dates = [day for _, day in chunk]
+        (
+            db.query(AppointmentDaily)
+            .filter(tuple_(AppointmentDaily.professional_id, AppointmentDaily.date).in_(chunk))
+            .filter(AppointmentDaily.status != CANCELLED)
+            .delete(synchronize_session=False)
+        )
+        query, appointment = _facts_query(db, min(dates), max(dates))
+        _insert_facts(db, query.filter(tuple_(appointment.professional_id, appointment.date).in_(chunk)))
+
+
+@on_primary
+def rebuild_appointment_facts(db: Session):
+    # Carga inicial ou correção: recalcula todos os dias a partir das consultas (incluindo o arquivo)
+    last_change_id = db.query(func.coalesce(func.max(ScheduleChange.id), 0)).scalar()
+    db.query(AppointmentDaily).filter(AppointmentDaily.status != CANCELLED).delete(synchronize_session=False)
+    _insert_facts(db, _facts_query(db)[0])
+    sync = db.get(AppointmentDailySync, SYNC_ID)
+    if sync is None:
+        sync = AppointmentDailySync(id=SYNC_ID)
+        db.add(sync)
+    sync.last_change_id = last_change_id
+    sync.refreshed_at = datetime.now()
+    db.commit()
+    dashboard_cache.invalidate()
+    return db.query(func.count()).select_from(AppointmentDaily).scalar()
+
+
+@on_primary
+def refresh_appointment_facts(db: Session):
+    # Recalcula os dias alterados desde a última atualização; a linha de controle serializa processos
+    sync = db.query(AppointmentDailySync).filter(AppointmentDailySync.id == SYNC_ID).with_for_update().first()
+    if sync is None:
+        rebuild_appointment_facts(db)
+        return None
+    # prune_changes apaga o log depois de alguns dias: se mudanças posteriores à última atualização
+    # já saíram (ou os ids recomeçaram), os dias alterados não são mais conhecidos
+    first_id, last_id = db.query(func.min(ScheduleChange.id), func.max(ScheduleChange.id)).one()
+    if first_id is None:
+        pruned = sync.last_change_id > 0
+    else:
+        pruned = first_id > sync.last_change_id + 1 or last_id < sync.last_change_id
+    if pruned:
+        rebuild_appointment_facts(db)
+        return None
+    # Ids de transações que terminaram depois de ids maiores: relê a janela, recalcular de novo é inofensivo
+    changes = (
+        db.query(ScheduleChange.id, ScheduleChange.professional_id, ScheduleChange.date)
+        .filter(ScheduleChange.id > sync.last_change_id - ID_LOOKBACK)
+        .all()
+    )
+    days = sorted({(c.professional_id, c.date) for c in changes if c.professional_id is not None and c.date})
+    if days:
+        _recompute_days(db, days)
+        sync.last_change_id = max(sync.last_change_id, max(c.id for c in changes))
+        sync.refreshed_at = datetime.now()
+    db.commit()
+    return len(days)
+
+
+def _rate(part, whole):
+    return part / whole if whole else 0.0
+
+
+def _weekday_counts(start_date: date, end_date: date):
+    counts = [0] * 7
+    days = (end_date - start_date).days + 1
+    for weekday in range(7):
+        first = (weekday - start_date.weekday()) % 7
+        counts[weekday] = max((days - first + 6) // 7, 0)
+    return counts
+
+
+def _month_bucket(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("month", AppointmentDaily.date)
+    return func.strftime("%Y-%m-01", AppointmentDaily.date)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def dashboard(db: Session, start_date: date, end_date: date):
+    in_period = (AppointmentDaily.date >= start_date) & (AppointmentDaily.date <= end_date)
+    revenue = func.sum(AppointmentDaily.amount).filter(AppointmentDaily.status == ATTENDED)
+
+    # Por profissional e status, com a capacidade da grade semanal de cada um
+    by_professional = defaultdict(lambda: defaultdict(int))
+    revenue_by_professional = defaultdict(float)
+    rows = (
+        db.query(AppointmentDaily.professional_id, AppointmentDaily.status, func.sum(AppointmentDaily.appointments),
+                 func.coalesce(revenue, 0.0))
+        .filter(in_period)
+        .group_by(AppointmentDaily.professional_id, AppointmentDaily.status)
+    )
+    for professional_id, status, appointments, amount in rows:
+        by_professional[professional_id][status] += appointments
+        revenue_by_professional[professional_id] += amount
+    weekdays = _weekday_counts(start_date, end_date)
+    templates = weekly_templates(db)
+    names = {
+        row.id: row
+        for row in db.query(Professional.id, Professional.name, Professional.specialty)
+        .filter((Professional.active == True) | Professional.id.in_(list(by_professional)))
+    }
+    professionals = []
+    for professional_id, professional in names.items():
+        counts = by_professional.get(professional_id, {})
+        capacity = sum(len(times) * weekdays[weekday] for weekday, times in templates.get(professional_id, {}).items())
+        cancelled = counts.get(CANCELLED, 0)
+        booked = sum(counts.values()) - cancelled
+        attended, no_shows = counts.get(ATTENDED, 0), counts.get(NO_SHOW, 0)
+        professionals.append(ProfessionalStats(
+            professional_id, professional.name, professional.specialty, capacity, booked, _rate(booked, capacity),
+            attended, no_shows, _rate(no_shows, attended + no_shows), cancelled, _rate(cancelled, booked + cancelled),
+            revenue_by_professional.get(professional_id, 0.0),
+        ))
+    professionals.sort(key=lambda row: row.name or "")
+
+    specialties = [
+        SpecialtyRevenue(specialty or "Sem especialidade", attended or 0, revenue, received)
+        for specialty, attended, revenue, received in (
+            db.query(
+                Professional.specialty,
+                func.sum(AppointmentDaily.appointments).filter(AppointmentDaily.status == ATTENDED),
+                func.coalesce(revenue, 0.0),
+                func.coalesce(func.sum(AppointmentDaily.received), 0.0),
+            )
+            .join(Professional, Professional.id == AppointmentDaily.professional_id)
+            .filter(in_period)
+            .group_by(Professional.specialty)
+            .order_by(func.coalesce(revenue, 0.0).desc())
+        )
+    ]
+
+    # Participação de cada convênio nas consultas marcadas (canceladas fora)
+    mix = (
+        db.query(
+            AppointmentDaily.insurance_id, Insurance.name,
+            func.sum(AppointmentDaily.appointments), func.coalesce(revenue, 0.0),
+        )
+        .outerjoin(Insurance, Insurance.id == AppointmentDaily.insurance_id)
+        .filter(in_period, AppointmentDaily.status != CANCELLED)
+        .group_by(AppointmentDaily.insurance_id, Insurance.name)
+        .order_by(func.sum(AppointmentDaily.appointments).desc())
+        .all()
+    )
+    total_booked = sum(row[2] for row in mix)
+    insurances = [
+        InsuranceShare(insurance_id, "Particular" if insurance_id == PARTICULAR else name, appointments,
+                       _rate(appointments, total_booked), amount)
+        for insurance_id, name, appointments, amount in mix
+    ]
+
+    bucket = _month_bucket(db).label("month")
+    months = defaultdict(lambda: [0, 0, 0, 0, 0.0])
+    for month, status, appointments, amount in (
+        db.query(bucket, AppointmentDaily.status, func.sum(AppointmentDaily.appointments), func.coalesce(revenue, 0.0))
+        .filter(in_period)
+        .group_by(bucket, AppointmentDaily.status)
+    ):
+        item = months[_as_date(month)]
+        if status == CANCELLED:
+            item[3] += appointments
+        else:
+            item[0] += appointments
+        item[1] += appointments if status == ATTENDED else 0
+        item[2] += appointments if status == NO_SHOW else 0
+        item[4] += amount
+    trend = [MonthlyTrend(month, *values) for month, values in sorted(months.items())]
+
+    capacity = sum(row.capacity for row in professionals)
+    booked = sum(row.booked for row in professionals)
+    attended = sum(row.attended for row in professionals)
+    no_shows = sum(row.no_shows for row in professionals)
+    cancelled = sum(row.cancelled for row in professionals)
+    totals = {
+        "capacity": capacity,
+        "booked": booked,
+        "occupancy": _rate(booked, capacity),
+        "no_show_rate": _rate(no_shows, attended + no_shows),
+        "cancellation_rate": _rate(cancelled, booked + cancelled),
+        "revenue": sum(row.revenue for row in specialties),
+        "received": sum(row.received for row in specialties),
+    }
+    return Dashboard(start_date, end_date, totals, professionals, specialties, insurances, trend)
+
+
+def load_dashboard(db: Session, start_date: date, end_date: date):
+    # Em cache até uma mudança da agenda (deste ou de outro processo, via change feed) cair no período
+    feed = get_change_feed()
+    seq = feed.sync(db)
+    key = ("dashboard", start_date, end_date)
+    cached = dashboard_cache.get(key)
+    if cached is not None:
+        cached_seq, value = cached
+        changes = feed.changes_since(cached_seq)
+        if changes is not None and not any(start_date <= c.date <= end_date for c in changes if c.date):
+            if changes:
+                dashboard_cache.set(key, (seq, value))
+            return value
+    with use_primary(db):
+        refresh_appointment_facts(db)
+        value = dashboard(db, start_date, end_date)
+    dashboard_cache.set(key, (seq, value))
+    return value
+
+
+def default_period(today: date = None):
+    # Últimos 12 meses, contando o mês atual
+    today = today or date.today()
+    return date(today.year - (today.month < 12), today.month % 12 + 1, 1), today
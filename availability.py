@@ -0,0 +1,131 @@
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from sqlalchemy.orm import Session
+from models import Appointment
+from cache import WorkingHoursRef, load_professionals, load_working_hours
+from queries import list_professionals, list_working_hours
+
+FreeSlot = namedtuple("FreeSlot", ["date", "time", "professional_id", "professional_name", "specialty"])
+
+# Grade usada para quem ainda não tem horário cadastrado (a antiga grade fixa de 18 horários)
+DEFAULT_WORKING_HOURS = tuple(
+    WorkingHoursRef(None, weekday, time(8, 0), time(18, 0), 30, time(12, 30), time(13, 30))
+    for weekday in range(5)
+)
+
+SEARCH_HORIZON_DAYS = 90
+
+
+def slot_times(rule: WorkingHoursRef):
+    step = timedelta(minutes=rule.slot_minutes or 30)
+    current = datetime.combine(date.min, rule.start_time)
+    end = datetime.combine(date.min, rule.end_time)
+    times = []
+    while current + step <= end:
+        slot = current.time()
+        in_break = rule.break_start and rule.break_end and rule.break_start <= slot < rule.break_end
+        if not in_break:
+            times.append(slot)
+        current += step
+    return times
+
+
+def _reference(db: Session, cached: bool):
+    # cached=False lê direto do banco: o cache do processo só é limpo pelas escritas do próprio processo
+    if cached:
+        return load_professionals(db), load_working_hours(db)
+    return list_professionals(db), list_working_hours(db)
+
+
+def weekly_templates(db: Session, cached: bool = True):
+    # {profissional: {dia da semana: [horários]}} a partir das regras de horário
+    professionals, working_hours = _reference(db, cached)
+    rules = defaultdict(list)
+    for rule in working_hours:
+        rules[rule.professional_id].append(rule)
+    templates = {}
+    for professional in professionals:
+        weekdays = defaultdict(set)
+        for rule in rules.get(professional.id, DEFAULT_WORKING_HOURS):
+            weekdays[rule.weekday].update(slot_times(rule))
+        templates[professional.id] = {weekday: sorted(times) for weekday, times in weekdays.items()}
+    return templates
+
+
+def day_slots(db: Session, professional_id: int, day: date):
+    return weekly_templates(db).get(professional_id, {}).get(day.weekday(), [])
+
+
+def booked_slots(db: Session, professional_ids, start_date: date, end_date: date):
+    # Uma consulta para todo o intervalo e todos os profissionais
+    rows = (
+        db.query(Appointment.professional_id, Appointment.date, Appointment.time)
+        .filter(Appointment.professional_id.in_(professional_ids))
+        .filter(Appointment.date >= start_date)
+        .filter(Appointment.date <= end_date)
+        .all()
+    )
+    return {tuple(row) for row in rows}
+
+
+def _professionals(db: Session, specialty: str = None, professional_ids=None, cached: bool = True):
+    professionals = load_professionals(db) if cached else list_professionals(db)
+    if specialty:
+        professionals = [p for p in professionals if (p.specialty or "").lower() == specialty.lower()]
+    if professional_ids:
+        wanted = set(professional_ids)
+        professionals = [p for p in professionals if p.id in wanted]
+    return professionals
+
+
+def iter_free_slots(db: Session, start: datetime, end_date: date, specialty: str = None, professional_ids=None,
+                    cached: bool = True):
+    # Horários livres em ordem cronológica: grade semanal menos as consultas marcadas
+    professionals = _professionals(db, specialty, professional_ids, cached)
+    if not professionals:
+        return
+    templates = weekly_templates(db, cached)
+    booked = booked_slots(db, [p.id for p in professionals], start.date(), end_date)
+
+    day = start.date()
+    while day <= end_date:
+        candidates = []
+        for professional in professionals:
+            for slot in templates[professional.id].get(day.weekday(), []):
+                if day == start.date() and slot < start.time():
+                    continue
+                if (professional.id, day, slot) not in booked:
+                    candidates.append(FreeSlot(day, slot, professional.id, professional.name, professional.specialty))
+        candidates.sort(key=lambda s: (s.time, s.professional_name))
+        yield from candidates
+        day += timedelta(days=1)
+
+
+def free_slots(db: Session, start_date: date, end_date: date, specialty: str = None, professional_ids=None):
+    start = datetime.combine(start_date, time.min)
+    return list(iter_free_slots(db, start, end_date, specialty, professional_ids))
+
+
+def next_free_slots(
+    db: Session,
+    count: int = 10,
+    specialty: str = None,
+    professional_ids=None,
+    after: datetime = None,
+    horizon_days: int = SEARCH_HORIZON_DAYS,
+    cached: bool = True,
+):
+    after = after or datetime.now()
+    horizon_end = after.date() + timedelta(days=horizon_days)
+    result = []
+    # Janelas crescentes: normalmente a primeira semana já basta e evita ler 90 dias de agenda
+    window_start, window_days = after, 7
+    while window_start.date() <= horizon_end and len(result) < count:
+        window_end = min(window_start.date() + timedelta(days=window_days - 1), horizon_end)
+        for slot in iter_free_slots(db, window_start, window_end, specialty, professional_ids, cached):
+            result.append(slot)
+            if len(result) >= count:
+                break
+        window_start = datetime.combine(window_end + timedelta(days=1), time.min)
+        window_days *= 2
+    return result
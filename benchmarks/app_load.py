@@ -0,0 +1,314 @@
+"""Teste de carga da interface Streamlit (main.py) com várias sessões simultâneas, sem navegador.
+
+Uso:
+    python -m benchmarks.app_load --database-url postgresql://localhost/bench --sessions 20 --steps 30
+    DB_POOL_SIZE=5 DB_MAX_OVERFLOW=5 python -m benchmarks.app_load --database-url sqlite:////tmp/bench.db
+
+Cada sessão é um AppTest próprio (session_state separado) rodando numa thread, como as sessões de um
+servidor Streamlit: todas compartilham o processo, o engine e o pool de conexões. As sessões repetem o
+trabalho da recepção (trocar a data da agenda, abrir um horário, agendar, buscar paciente, abrir o caixa)
+e o teste mede a latência de cada rerun (p50/p95/p99), as instruções SQL por rerun e a ocupação do pool.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from unittest.mock import MagicMock
+from sqlalchemy import event, func
+
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+
+from database import configure_engine, current_client, get_engine, init_db, pool_status, session_scope
+from models import Appointment, Professional
+from benchmarks.generator import ClinicSizes, generate
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+SEARCH_TERMS = ["silva", "maria", "conceicao", "jose s", "99", "ana", "gonç"]
+# Peso de cada ação na mistura; "agendar" custa três reruns (data, horário e gravação)
+MIX = {"data": 30, "horario": 25, "agendar": 10, "busca": 20, "caixa": 15}
+POOL_SAMPLE_SECONDS = 0.05
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def _latency(values):
+    return {
+        "n": len(values),
+        "p50_ms": round(_percentile(values, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(values, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(values, 0.99) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def _queries(values):
+    return {
+        "mean": round(statistics.fmean(values), 1) if values else 0.0,
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "max": max(values) if values else 0,
+    }
+
+
+def share_runtime():
+    # O AppTest cria um Runtime falso a cada rerun e o apaga ao terminar (atributo de classe): com sessões
+    # em paralelo um rerun apagaria o do outro. Como num servidor real, fica um Runtime para o processo.
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    try:
+        from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+        runtime.dataframe_source_mgr = DataframeSourceManager()
+    except ImportError:
+        pass
+    try:
+        from streamlit.components.v2.component_manager import BidiComponentManager
+        runtime.bidi_component_registry = BidiComponentManager()
+        runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    except ImportError:
+        pass
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    # Cada rerun liga e restaura esta opção; ligada desde o início, as restaurações não se cruzam
+    config.set_option("global.appTest", True)
+
+
+class QueryCounter:
+    # Instruções por sessão: main() identifica cada sessão com client_scope(db_client)
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def install(self, engine):
+        event.listen(engine, "after_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        client = current_client()
+        if client is not None:
+            with self.lock:
+                self.counts[client] += 1
+
+    def take(self, client):
+        with self.lock:
+            return self.counts.pop(client, 0)
+
+
+class PoolSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(POOL_SAMPLE_SECONDS):
+            status = pool_status()
+            if "checked_out" in status:
+                self.samples.append(status["checked_out"])
+
+    def report(self, before):
+        status = pool_status()
+        if "checked_out" not in status:
+            return status
+        capacity = status["size"] + status["max_overflow"]
+        report = {
+            "size": status["size"],
+            "max_overflow": status["max_overflow"],
+            "checked_out_max": max(self.samples, default=0),
+            "checked_out_p95": _percentile(self.samples, 0.95),
+            # Fração do tempo com o pool inteiro em uso: novos pedidos de conexão esperam
+            "saturated": round(sum(1 for n in self.samples if n >= capacity) / len(self.samples), 3)
+            if self.samples else 0.0,
+            "above_pool_size": round(sum(1 for n in self.samples if n > status["size"]) / len(self.samples), 3)
+            if self.samples else 0.0,
+        }
+        if "checkouts" in status:
+            checkouts = status["checkouts"] - before.get("checkouts", 0)
+            wait_total = status["wait_total_ms"] - before.get("wait_total_ms", 0)
+            report.update({
+                "checkouts": checkouts,
+                "wait_avg_ms": round(wait_total / checkouts, 3) if checkouts else 0.0,
+                "wait_max_ms": status["wait_max_ms"],
+            })
+        return report
+
+
+def prepare(appointments: int, seed: int):
+    init_db(migrate=True)
+    with session_scope() as db:
+        if db.query(Professional.id).first() is None:
+            print(generate(db, ClinicSizes(appointments), seed=seed), file=sys.stderr)
+        first_day, last_day = db.query(func.min(Appointment.date), func.max(Appointment.date)).one()
+    return first_day, last_day
+
+
+def _widget(elements, label):
+    return next((element for element in elements if element.label == label), None)
+
+
+class SimulatedSession:
+    def __init__(self, number, rng, counter, first_day, last_day, timeout):
+        self.client = f"carga-{number}"
+        self.rng = rng
+        self.counter = counter
+        self.first_day = first_day
+        self.days = max((last_day - first_day).days, 1)
+        # Agendamentos nos dias após a última consulta; disputas entre sessões viram conflito na tela
+        self.write_day = last_day + timedelta(days=1)
+        self.at = AppTest.from_file(MAIN_SCRIPT, default_timeout=timeout)
+        self.at.session_state["db_client"] = self.client
+        self.reruns = []  # (ação, segundos, instruções)
+        self.errors = []
+        self.outcomes = Counter()
+
+    def rerun(self, action, element=None):
+        started = time.perf_counter()
+        try:
+            (element or self.at).run()
+        except Exception as e:
+            self.errors.append((action, f"{type(e).__name__}: {e}"))
+            return False
+        self.reruns.append((action, time.perf_counter() - started, self.counter.take(self.client)))
+        if self.at.exception:
+            self.errors.append((action, self.at.exception[0].message))
+            return False
+        return True
+
+    def set_date(self, day, action="data"):
+        selector = next((d for d in self.at.date_input if d.key == "selected_date"), None)
+        return selector is not None and self.rerun(action, selector.set_value(day))
+
+    def open_slot(self, action="horario"):
+        slots = _widget(self.at.selectbox, "Selecione um horário")
+        if slots is None or not slots.options:
+            self.outcomes["sem_horarios"] += 1
+            return False
+        return self.rerun(action, slots.set_value(self.rng.choice(slots.options)))
+
+    def date(self):
+        self.set_date(self.first_day + timedelta(days=self.rng.randrange(self.days)))
+
+    def slot(self):
+        self.open_slot()
+
+    def book(self):
+        day = self.write_day + timedelta(days=self.rng.randrange(30))
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        if not self.set_date(day) or not self.open_slot():
+            return
+        if not any(h.value.startswith("Nova Consulta") for h in self.at.subheader):
+            self.outcomes["ocupado"] += 1
+            return
+        if self.rerun("agendar", _widget(self.at.button, "Salvar Consulta").click()):
+            conflict = any("Atualize a agenda" in e.value for e in self.at.error)
+            self.outcomes["conflito" if conflict else "agendado"] += 1
+
+    def search(self):
+        field = _widget(self.at.text_input, "Buscar Paciente")
+        self.rerun("busca", field.input(self.rng.choice(SEARCH_TERMS)))
+
+    def cash(self):
+        start = self.first_day + timedelta(days=self.rng.randrange(self.days))
+        _widget(self.at.date_input, "Data Final").set_value(start + timedelta(days=30))
+        self.rerun("caixa", _widget(self.at.date_input, "Data Inicial").set_value(start))
+
+    def play(self, steps, think):
+        actions = {"data": self.date, "horario": self.slot, "agendar": self.book, "busca": self.search,
+                   "caixa": self.cash}
+        if not self.rerun("abrir"):
+            return
+        for action in self.rng.choices(list(MIX), weights=list(MIX.values()), k=steps):
+            if think:
+                time.sleep(self.rng.uniform(0, 2 * think))
+            actions[action]()
+
+
+def run(args):
+    share_runtime()
+    os.environ["DATABASE_URL"] = args.database_url
+    configure_engine(args.database_url)
+    first_day, last_day = prepare(args.appointments, args.seed)
+    counter = QueryCounter()
+    counter.install(get_engine())
+
+    rng = random.Random(args.seed)
+    sessions = [
+        SimulatedSession(i, random.Random(rng.random()), counter, first_day, last_day, args.timeout)
+        for i in range(args.sessions)
+    ]
+    threads = [
+        threading.Thread(target=session.play, args=(args.steps, args.think), daemon=True) for session in sessions
+    ]
+    sampler = PoolSampler()
+    before = pool_status()
+    sampler.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+        # Sessões chegam aos poucos, como recepcionistas abrindo o navegador
+        time.sleep(args.ramp_up / max(len(threads), 1))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sampler.stopped.set()
+    sampler.join()
+
+    reruns = [rerun for session in sessions for rerun in session.reruns]
+    by_action = defaultdict(list)
+    for rerun in reruns:
+        by_action[rerun[0]].append(rerun)
+    errors = [error for session in sessions for error in session.errors]
+    return {
+        "sessions": args.sessions,
+        "steps": args.steps,
+        "seconds": round(elapsed, 2),
+        "reruns": len(reruns),
+        "reruns_per_s": round(len(reruns) / elapsed, 2),
+        "latency": {
+            "all": _latency([r[1] for r in reruns]),
+            "by_action": {action: _latency([r[1] for r in rows]) for action, rows in by_action.items()},
+        },
+        "queries_per_rerun": {
+            "all": _queries([r[2] for r in reruns]),
+            "by_action": {action: _queries([r[2] for r in rows]) for action, rows in by_action.items()},
+        },
+        "pool": sampler.report(before),
+        "bookings": dict(sum((session.outcomes for session in sessions), Counter())),
+        "errors": dict(Counter(action for action, _ in errors)),
+        "error_samples": sorted({message for _, message in errors})[:5],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--sessions", type=int, default=10, help="Sessões (recepcionistas) simultâneas")
+    parser.add_argument("--steps", type=int, default=20, help="Ações por sessão")
+    parser.add_argument("--think", type=float, default=0.5, help="Pausa média entre ações, em segundos")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Segundos até todas as sessões começarem")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Tempo máximo de um rerun")
+    parser.add_argument("--appointments", type=int, default=10000, help="Tamanho da carga se o banco estiver vazio")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    sys.exit(1 if result["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
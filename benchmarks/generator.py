@@ -0,0 +1,140 @@
+import random
+from datetime import date, timedelta
+from sqlalchemy.orm import Session
+from models import Professional, Patient, Insurance, Appointment, CashFlow
+from importer import allocate_ids, insert_rows
+from reports import rebuild_cash_flow_rollup
+from availability import DEFAULT_WORKING_HOURS, slot_times
+
+FIRST_NAMES = [
+    "Ana", "João", "Maria", "José", "Antônio", "Francisca", "Carlos", "Paulo", "Lúcia", "Luís",
+    "Márcia", "Pedro", "Juliana", "Fernanda", "Rafael", "Gabriel", "Letícia", "Bruno", "Cecília", "Conceição",
+]
+LAST_NAMES = [
+    "Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Ferreira", "Costa", "Rodrigues", "Almeida",
+    "Nascimento", "Araújo", "Gonçalves", "Ribeiro", "Carvalho", "Gomes", "Martins", "Rocha", "Sá", "Conceição",
+]
+SPECIALTIES = ["Cardiologia", "Dermatologia", "Fisioterapia", "Ortopedia", "Pediatria", "Psicologia", "Clínica Geral"]
+INSURANCES = ["Unimed", "Bradesco Saúde", "SulAmérica", "Amil", "Porto Seguro", "Hapvida", "NotreDame", "Cassi"]
+PAYMENT_METHODS = ["Dinheiro", "Cartão Débito", "Cartão Crédito", "PIX", "Transferência"]
+
+CHUNK_SIZE = 5000
+
+
+class ClinicSizes:
+    def __init__(self, appointments: int = 10000, patients: int = None, professionals: int = None,
+                 insurances: int = 8):
+        self.appointments = appointments
+        self.patients = patients or max(appointments // 5, 100)
+        self.professionals = professionals or max(20, appointments // 25000)
+        self.insurances = insurances
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def patient_rows(rng: random.Random, count: int):
+    for i in range(count):
+        yield {
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+            "phone": f"({rng.randint(11, 99)}) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+            "email": f"paciente{i}@exemplo.com.br" if rng.random() < 0.6 else None,
+            "birth_date": date(1940, 1, 1) + timedelta(days=rng.randint(0, 30000)),
+            "notes": rng.choice([None, None, "Alergia a dipirona", "Hipertenso", "Diabético", "Gestante"]),
+        }
+
+
+def appointment_rows(rng: random.Random, sizes: ClinicSizes, professional_ids, patient_ids, insurance_ids,
+                     today: date):
+    # Percorre os dias para trás a partir de um mês à frente, preenchendo ~70% da grade
+    # (professional, data, horário) nunca se repete, respeitando o índice único
+    day_slots = {rule.weekday: slot_times(rule) for rule in DEFAULT_WORKING_HOURS}
+    day = today + timedelta(days=30)
+    produced = 0
+    while produced < sizes.appointments:
+        for slot in day_slots.get(day.weekday(), []):
+            for professional_id in professional_ids:
+                if rng.random() > 0.7:
+                    continue
+                past = day < today
+                private = rng.random() < 0.4
+                yield {
+                    "date": day,
+                    "time": slot,
+                    "professional_id": professional_id,
+                    "patient_id": rng.choice(patient_ids),
+                    "insurance_id": None if private else rng.choice(insurance_ids),
+                    "status": rng.choice(["encerrado"] * 8 + ["faltou", "agendado"]) if past else "agendado",
+                    "payment_method": rng.choice(PAYMENT_METHODS) if private else None,
+                    "paid": past and rng.random() < 0.9,
+                    "amount": float(rng.choice([150, 200, 250, 300, 350])) if private else None,
+                    "notes": None,
+                }
+                produced += 1
+                if produced >= sizes.appointments:
+                    return
+        day -= timedelta(days=1)
+
+
+def generate(db: Session, sizes: ClinicSizes, seed: int = 42, today: date = None):
+    # Mesma semente e tamanhos geram sempre os mesmos dados
+    rng = random.Random(seed)
+    today = today or date.today()
+
+    professionals = [
+        {"name": f"Dr(a). {FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i * 7) % len(LAST_NAMES)]} {i}",
+         "specialty": SPECIALTIES[i % len(SPECIALTIES)], "active": True}
+        for i in range(sizes.professionals)
+    ]
+    insert_rows(db, Professional, professionals)
+    insurances = [
+        {"name": INSURANCES[i % len(INSURANCES)] + (f" {i}" if i >= len(INSURANCES) else ""), "active": True}
+        for i in range(sizes.insurances)
+    ]
+    insert_rows(db, Insurance, insurances)
+    for chunk in _chunks(patient_rows(rng, sizes.patients)):
+        insert_rows(db, Patient, chunk)
+    db.commit()
+
+    professional_ids = [row[0] for row in db.query(Professional.id).order_by(Professional.id)]
+    insurance_ids = [row[0] for row in db.query(Insurance.id).order_by(Insurance.id)]
+    patient_ids = [row[0] for row in db.query(Patient.id).order_by(Patient.id)]
+
+    rows = appointment_rows(rng, sizes, professional_ids, patient_ids, insurance_ids, today)
+    for chunk in _chunks(rows):
+        for row, appointment_id in zip(chunk, allocate_ids(db, Appointment, len(chunk))):
+            row["id"] = appointment_id
+        insert_rows(db, Appointment, chunk)
+        insert_rows(db, CashFlow, [
+            {
+                "date": row["date"],
+                "description": f"Consulta {row['patient_id']} - {row['time'].strftime('%H:%M')}",
+                "amount": row["amount"],
+                "payment_date": row["date"] if row["paid"] else None,
+                "paid": row["paid"],
+                "appointment_id": row["id"],
+                "type": "entrada",
+            }
+            for row in chunk if row["amount"]
+        ])
+        db.commit()
+
+    rebuild_cash_flow_rollup(db)
+    return {
+        "professionals": len(professional_ids),
+        "insurances": len(insurance_ids),
+        "patients": len(patient_ids),
+        "appointments": db.query(Appointment).count(),
+        "cash_flow": db.query(CashFlow).count(),
+    }
@@ -0,0 +1,82 @@
+"""Teste de carga do envio de lembretes (reminders.py) com um transporte simulado.
+
+Uso:
+    python -m benchmarks.reminder_load --database-url postgresql://localhost/bench --hours 720 --latency 0.2
+
+O transporte local espera --latency segundos por mensagem e falha em --failure-rate das tentativas,
+como um provedor real. Cada execução usa um tipo de lembrete novo, então o log de lembretes não
+impede repetir o teste; ao final verifica que cada consulta tem exatamente uma linha no log.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+from database import configure_engine, init_db, session_scope
+from models import Appointment, ReminderLog
+from reminders import FileTransport, ReminderDispatcher, send_reminders
+from benchmarks.generator import ClinicSizes, generate
+
+
+def prepare(appointments: int, seed: int):
+    with session_scope() as db:
+        if not db.query(func.count(Appointment.id)).scalar():
+            generate(db, ClinicSizes(appointments), seed=seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--hours", type=int, default=24 * 30, help="Janela de consultas a partir de agora")
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos por mensagem no transporte simulado")
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=1000, help="Mensagens por segundo em cada canal")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.2)
+    parser.add_argument("--appointments", type=int, default=50000, help="Tamanho da carga se o banco estiver vazio")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    configure_engine(args.database_url)
+    init_db(migrate=True)
+    prepare(args.appointments, args.seed)
+
+    transport = FileTransport(latency=args.latency, failure_rate=args.failure_rate)
+    transports = {"whatsapp": transport, "email": transport}
+    dispatcher = ReminderDispatcher(
+        transports, concurrency=args.concurrency, rate=args.rate, retries=args.retries, backoff=args.backoff
+    )
+    start = datetime.now()
+    kind = f"carga-{int(time.time())}"
+    with session_scope() as db:
+        report = send_reminders(db, transports, start, start + timedelta(hours=args.hours), kind,
+                                dispatcher=dispatcher)
+        logged = dict(
+            db.query(ReminderLog.status, func.count(ReminderLog.id)).filter(ReminderLog.kind == kind)
+            .group_by(ReminderLog.status).all()
+        )
+        duplicates = (
+            db.query(ReminderLog.appointment_id).filter(ReminderLog.kind == kind)
+            .group_by(ReminderLog.appointment_id).having(func.count(ReminderLog.id) > 1).count()
+        )
+
+    result = {
+        "due": report.due,
+        "sent": report.sent,
+        "failed": report.failed,
+        "skipped": report.skipped,
+        "seconds": round(report.elapsed, 1),
+        "per_second": round(report.per_second, 1),
+        "log": logged,
+        "duplicates": duplicates,
+    }
+    print(json.dumps(result, indent=2))
+    consistent = duplicates == 0 and sum(logged.values()) == report.sent + report.failed
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
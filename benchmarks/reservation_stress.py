@@ -0,0 +1,130 @@
+"""Teste de estresse da reserva de horários com várias threads.
+
+Uso:
+    python -m benchmarks.reservation_stress --database-url sqlite:////tmp/stress.db --threads 16
+
+Cada thread tenta reservar horários sorteados de um conjunto pequeno (alta
+disputa). Ao final verifica que nenhum horário ficou com duas consultas e
+que cada reserva bem-sucedida corresponde a exatamente uma linha no banco.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from sqlalchemy import func
+
+from database import configure_engine, init_db, session_scope, pool_status
+from commands import create_appointment, create_patient, create_professional
+from models import Appointment
+from reservations import SlotConflictError
+from utils import parse_time
+
+SLOT_TIMES = ["08:00", "08:30", "09:00", "09:30", "10:00", "10:30", "11:00", "11:30"]
+
+
+def prepare(professionals: int):
+    with session_scope() as db:
+        suffix = int(time.time() * 1000)
+        professional_ids = [
+            create_professional(db, f"Estresse {suffix}-{i}", "Teste").id for i in range(professionals)
+        ]
+        patient_id = create_patient(db, f"Paciente estresse {suffix}", "0").id
+    return professional_ids, patient_id
+
+
+def worker(seed, attempts, slots, patient_id, results, lock):
+    rng = random.Random(seed)
+    booked, conflicts, errors, latencies = [], 0, 0, []
+    with session_scope() as db:
+        for _ in range(attempts):
+            professional_id, day, slot_time = rng.choice(slots)
+            started = time.perf_counter()
+            try:
+                appointment = create_appointment(db, day, slot_time, professional_id, patient_id, amount=100.0)
+                booked.append(appointment.id)
+            except SlotConflictError:
+                conflicts += 1
+            except Exception:
+                db.rollback()
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    with lock:
+        results["booked"].extend(booked)
+        results["conflicts"] += conflicts
+        results["errors"] += errors
+        results["latencies"].extend(latencies)
+
+
+def run(threads: int, attempts: int, professionals: int, days: int, seed: int):
+    init_db(migrate=True)
+    professional_ids, patient_id = prepare(professionals)
+    start_day = date.today() + timedelta(days=3650)  # longe de dados reais
+    slots = [
+        (professional_id, start_day + timedelta(days=d), parse_time(t))
+        for professional_id in professional_ids for d in range(days) for t in SLOT_TIMES
+    ]
+
+    results = {"booked": [], "conflicts": 0, "errors": 0, "latencies": []}
+    lock = threading.Lock()
+    pool = [
+        threading.Thread(target=worker, args=(seed + i, attempts, slots, patient_id, results, lock))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with session_scope() as db:
+        rows = (
+            db.query(Appointment.professional_id, Appointment.date, Appointment.time, func.count())
+            .filter(Appointment.professional_id.in_(professional_ids))
+            .group_by(Appointment.professional_id, Appointment.date, Appointment.time)
+            .all()
+        )
+    double_booked = [row for row in rows if row[3] > 1]
+    stored = sum(row[3] for row in rows)
+    latencies = sorted(results["latencies"])
+    total = threads * attempts
+    return {
+        "threads": threads,
+        "attempts": total,
+        "slots": len(slots),
+        "booked": len(results["booked"]),
+        "conflicts": results["conflicts"],
+        "errors": results["errors"],
+        "stored_rows": stored,
+        "double_booked_slots": len(double_booked),
+        "elapsed_s": round(elapsed, 3),
+        "attempts_per_s": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0.0,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else 0.0,
+        "pool": pool_status(),
+        "ok": not double_booked and stored == len(results["booked"]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Banco de teste (padrão: configuração do .env)")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--attempts", type=int, default=50, help="Tentativas por thread")
+    parser.add_argument("--professionals", type=int, default=2)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        configure_engine(args.database_url, pool_size=args.threads, max_overflow=0)
+    result = run(args.threads, args.attempts, args.professionals, args.days, args.seed)
+    print(json.dumps(result, indent=2, default=str))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Benchmark dos principais caminhos de leitura e escrita.
+
+Uso:
+    python -m benchmarks.run --database-url sqlite:////tmp/bench.db --appointments 100000 --output bench.json
+    python -m benchmarks.run --database-url postgresql://localhost/bench --compare bench.json
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+
+from database import Base, configure_engine, init_db, session_scope
+from models import Appointment, Patient, Professional
+from queries import get_clinic_schedule, get_day_schedule, get_patients
+from search import patient_columns
+from reports import cash_flow_breakdown, cash_flow_totals
+from commands import create_appointment, mark_payment, update_appointment_status
+from availability import next_free_slots
+from benchmarks.generator import ClinicSizes, generate
+
+SEARCH_TERMS = ["silva", "maria", "conceicao", "jose s", "99", "ana", "gonç", "sa 1"]
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "min_ms": round(samples[0] * 1000, 3),
+        "median_ms": round(statistics.median(samples) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p95_ms": round(samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000, 3),
+    }
+
+
+def timed(fn, repeat, warmup=1):
+    # A primeira execução aquece caches e índices em memória e não entra na medição
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return _stats(samples)
+
+
+def run_cases(repeat: int, seed: int):
+    rng = random.Random(seed)
+    results = {}
+    with session_scope() as db:
+        professional_ids = [row[0] for row in db.query(Professional.id)]
+        patient_ids = [row[0] for row in db.query(Patient.id).limit(1000)]
+        first_day = db.query(func.min(Appointment.date)).scalar() or date.today()
+        days = max((date.today() - first_day).days, 1)
+
+        def random_day():
+            return first_day + timedelta(days=rng.randrange(days))
+
+        results["day_schedule"] = timed(
+            lambda i: get_day_schedule(db, random_day(), rng.choice(professional_ids)), repeat)
+        results["clinic_schedule"] = timed(lambda i: get_clinic_schedule(db, random_day()), repeat)
+        results["patient_search"] = timed(
+            lambda i: get_patients(db, SEARCH_TERMS[i % len(SEARCH_TERMS)], limit=20), repeat)
+        patient_pages = max(len(patient_ids) // 20, 1)
+        results["patient_list_page"] = timed(
+            lambda i: get_patients(db, None, limit=20, offset=20 * rng.randrange(patient_pages)), repeat)
+        year_start = date.today() - timedelta(days=365)
+        results["cash_flow_report_year"] = timed(
+            lambda i: (cash_flow_totals(db, year_start, date.today()),
+                       cash_flow_breakdown(db, year_start, date.today(), "month")), repeat)
+        results["next_free_slots"] = timed(lambda i: next_free_slots(db, 10), repeat)
+
+        # Escritas depois da última consulta existente para não colidir com os dados gerados
+        far_day = db.query(func.max(Appointment.date)).scalar() + timedelta(days=1)
+        created = []
+
+        def create(i):
+            appointment = create_appointment(
+                db, far_day + timedelta(days=i // 18), f"{8 + (i % 18) // 2:02d}:{30 * (i % 2):02d}",
+                rng.choice(professional_ids), rng.choice(patient_ids), amount=200.0)
+            created.append(appointment.id)
+
+        results["appointment_create"] = timed(create, repeat, warmup=0)
+        results["status_update"] = timed(
+            lambda i: update_appointment_status(db, created[i % len(created)], "aguardando"), repeat, warmup=0)
+        results["payment_update"] = timed(lambda i: mark_payment(db, created[i % len(created)], True), repeat, warmup=0)
+    return results
+
+
+def memory_cases(limit: int = 50000):
+    # Pico de memória e tempo para carregar uma lista grande de pacientes: ORM x modelo de leitura
+    loaders = {
+        "patients_orm": lambda db: db.query(Patient).order_by(Patient.name).limit(limit).all(),
+        "patients_columns": lambda db: db.query(*patient_columns()).order_by(Patient.name).limit(limit).all(),
+        "patients_read_model": lambda db: get_patients(db, None, limit=limit),
+    }
+    results = {}
+    for case, loader in loaders.items():
+        with session_scope() as db:
+            tracemalloc.start()
+            started = time.perf_counter()
+            rows = loader(db)
+            elapsed = time.perf_counter() - started
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[case] = {
+                "rows": len(rows),
+                "ms": round(elapsed * 1000, 3),
+                "retained_kb": round(retained / 1024, 1),
+                "peak_kb": round(peak / 1024, 1),
+            }
+            del rows
+    return results
+
+
+def _git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    print(f"{'caso':<24}{'base (ms)':>12}{'atual (ms)':>12}{'variação':>10}")
+    for case, stats in current["results"].items():
+        old = baseline.get("results", {}).get(case)
+        if not old:
+            continue
+        change = (stats["median_ms"] - old["median_ms"]) / old["median_ms"] * 100 if old["median_ms"] else 0.0
+        print(f"{case:<24}{old['median_ms']:>12.3f}{stats['median_ms']:>12.3f}{change:>+9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Banco do benchmark (padrão: configuração do .env)")
+    parser.add_argument("--appointments", type=int, default=10000)
+    parser.add_argument("--patients", type=int)
+    parser.add_argument("--professionals", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=30, help="Execuções por caso")
+    parser.add_argument("--reset", action="store_true", help="Apaga e recria todas as tabelas antes de gerar")
+    parser.add_argument("--output", help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparação")
+    args = parser.parse_args(argv)
+
+    engine = configure_engine(args.database_url) if args.database_url else None
+    if args.reset:
+        from database import get_engine
+        Base.metadata.drop_all(bind=engine or get_engine())
+    init_db(migrate=True)
+
+    sizes = ClinicSizes(args.appointments, args.patients, args.professionals)
+    load = None
+    with session_scope() as db:
+        if db.query(Professional.id).first() is None:
+            started = time.perf_counter()
+            counts = generate(db, sizes, seed=args.seed)
+            elapsed = time.perf_counter() - started
+            load = {"counts": counts, "seconds": round(elapsed, 2),
+                    "rows_per_s": round(sum(counts.values()) / elapsed, 1)}
+            print(f"Dados gerados em {elapsed:.1f}s: {counts}", file=sys.stderr)
+        dialect = db.get_bind().dialect.name
+
+    output = {
+        "meta": {
+            "version": _git_version(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "dialect": dialect,
+            "python": platform.python_version(),
+            "sizes": sizes.as_dict(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "load": load,
+        "results": run_cases(args.repeat, args.seed),
+        "memory": memory_cases(),
+    }
+
+    text = json.dumps(output, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Teste de carga da API de services.py.
+
+Sem --base-url a aplicação roda no próprio processo (httpx + ASGI, um único worker):
+    python -m benchmarks.service_load --database-url sqlite:////tmp/bench.db --concurrency 200 --requests 5000
+Contra um servidor já em execução (uvicorn services:app):
+    python -m benchmarks.service_load --base-url http://127.0.0.1:8000 --database-url postgresql://localhost/bench
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import func
+
+import httpx
+
+from database import configure_engine, init_db, session_scope
+from models import Appointment, Patient, Professional
+from benchmarks.generator import ClinicSizes, generate
+
+SEARCH_TERMS = ["silva", "maria", "conceicao", "jose s", "99", "ana", "gonç"]
+# Peso de cada tipo de requisição na mistura
+MIX = {"schedule": 30, "clinic_schedule": 10, "availability": 15, "patients": 20, "create": 15, "status": 5, "payment": 5}
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def prepare(appointments: int, seed: int):
+    init_db(migrate=True)
+    with session_scope() as db:
+        if db.query(Professional.id).first() is None:
+            print(generate(db, ClinicSizes(appointments), seed=seed), file=sys.stderr)
+        professional_ids = [row[0] for row in db.query(Professional.id)]
+        patient_ids = [row[0] for row in db.query(Patient.id).limit(1000)]
+        first_day, last_day = db.query(func.min(Appointment.date), func.max(Appointment.date)).one()
+    return professional_ids, patient_ids, first_day, last_day
+
+
+class LoadTest:
+    def __init__(self, client, rng, professional_ids, patient_ids, first_day, last_day):
+        self.client = client
+        self.rng = rng
+        self.professional_ids = professional_ids
+        self.patient_ids = patient_ids
+        self.first_day = first_day
+        self.days = max((last_day - first_day).days, 1)
+        # Escritas em dias após a última consulta; colisões entre clientes viram 409 e também contam
+        self.write_day = last_day + timedelta(days=1)
+        self.created = []
+        self.latencies = {kind: [] for kind in MIX}
+        self.statuses = Counter()
+
+    def _request(self, kind):
+        rng = self.rng
+        if kind == "schedule":
+            day = self.first_day + timedelta(days=rng.randrange(self.days))
+            return "GET", f"/schedule?date={day}&professional_id={rng.choice(self.professional_ids)}", None
+        if kind == "clinic_schedule":
+            return "GET", f"/schedule?date={self.first_day + timedelta(days=rng.randrange(self.days))}", None
+        if kind == "availability":
+            return "GET", f"/availability?count=10&professional_id={rng.choice(self.professional_ids)}", None
+        if kind == "patients":
+            return "GET", f"/patients?q={rng.choice(SEARCH_TERMS)}&limit=20", None
+        if kind in ("status", "payment") and self.created:
+            appointment_id = rng.choice(self.created)
+            if kind == "status":
+                return "PATCH", f"/appointments/{appointment_id}", {"status": "aguardando"}
+            return "POST", f"/appointments/{appointment_id}/payment", {"paid": True}
+        slot = rng.randrange(18)
+        return "POST", "/appointments", {
+            "date": str(self.write_day + timedelta(days=rng.randrange(30))),
+            "time": f"{8 + slot // 2:02d}:{30 * (slot % 2):02d}",
+            "professional_id": rng.choice(self.professional_ids),
+            "patient_id": rng.choice(self.patient_ids),
+            "amount": 200.0,
+        }
+
+    async def one(self, kind):
+        method, url, body = self._request(kind)
+        started = time.perf_counter()
+        response = await self.client.request(method, url, json=body)
+        self.latencies[kind].append(time.perf_counter() - started)
+        self.statuses[response.status_code] += 1
+        if method == "POST" and url == "/appointments" and response.status_code == 201:
+            self.created.append(response.json()["id"])
+
+    async def run(self, total: int, concurrency: int):
+        kinds = self.rng.choices(list(MIX), weights=list(MIX.values()), k=total)
+        queue = asyncio.Queue()
+        for kind in kinds:
+            queue.put_nowait(kind)
+
+        async def worker():
+            while not queue.empty():
+                await self.one(queue.get_nowait())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed, total, concurrency):
+        every = [value for values in self.latencies.values() for value in values]
+        stats = lambda values: {
+            "n": len(values),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+        }
+        return {
+            "requests": total,
+            "concurrency": concurrency,
+            "seconds": round(elapsed, 2),
+            "requests_per_s": round(total / elapsed, 1),
+            "status": dict(self.statuses),
+            "all": stats(every),
+            "by_kind": {kind: stats(values) for kind, values in self.latencies.items() if values},
+        }
+
+
+async def main_async(args):
+    configure_engine(args.database_url)
+    professional_ids, patient_ids, first_day, last_day = prepare(args.appointments, args.seed)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+            test = LoadTest(client, rng, professional_ids, patient_ids, first_day, last_day)
+            elapsed = await test.run(args.requests, args.concurrency)
+    else:
+        from services import create_app
+        app = create_app(args.database_url)
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://service", timeout=60) as client:
+                test = LoadTest(client, rng, professional_ids, patient_ids, first_day, last_day)
+                elapsed = await test.run(args.requests, args.concurrency)
+    return test.report(elapsed, args.requests, args.concurrency)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True, help="Banco usado pela API (e para preparar os dados)")
+    parser.add_argument("--base-url", help="URL de um servidor em execução; sem ela a API roda no processo")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--appointments", type=int, default=10000, help="Tamanho da carga se o banco estiver vazio")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(main_async(args))
+    print(json.dumps(result, indent=2))
+    errors = sum(count for status, count in result["status"].items() if status >= 500)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
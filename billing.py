@@ -0,0 +1,346 @@
+import csv
+import io
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+from xml.sax.saxutils import escape, quoteattr
+from sqlalchemy import case, func, insert, literal_column
+from sqlalchemy.orm import Session
+from database import on_primary, session_scope, use_primary
+from models import Appointment, BillingBatch, BillingItem, CashFlow, Insurance, Patient, Professional
+from partitions import source
+from reports import apply_cash_flow_delta
+from search import normalize
+from utils import format_time
+
+logger = logging.getLogger(__name__)
+
+# Faturamento mensal dos convênios: um lote (arquivo CSV ou XML) por convênio, gerado em paralelo.
+# Cada bloco gravado no arquivo é confirmado no banco junto com as consultas faturadas e o ponto
+# de retomada; um lote interrompido continua do último bloco confirmado na próxima execução
+BILLING_DIR = os.getenv("BILLING_DIR", "faturamento")
+BILLING_WORKERS = int(os.getenv("BILLING_WORKERS", 4))
+BILLING_CHUNK_SIZE = 2000
+BILLING_FORMATS = ("csv", "xml")
+BILLABLE_STATUSES = ("encerrado",)
+
+GENERATING, BILLED, RECEIVED = "gerando", "faturado", "recebido"
+
+BILLING_COLUMNS = ["guia", "data", "hora", "paciente", "profissional", "especialidade", "valor"]
+
+BillingRow = namedtuple("BillingRow", ["id", "date", "time", "patient", "professional", "specialty", "amount"])
+BillingResult = namedtuple("BillingResult", [
+    "insurance_id", "insurance", "batch_id", "sequence", "appointments", "total", "file_path", "resumed", "error"
+])
+InsuranceBilling = namedtuple("InsuranceBilling", [
+    "insurance_id", "insurance", "batches", "billed", "received", "pending_appointments", "pending"
+])
+
+
+def month_start(day: date):
+    return day.replace(day=1)
+
+
+def month_end(month: date):
+    following = date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+    return date.fromordinal(following.toordinal() - 1)
+
+
+def _amount(appointment):
+    # Valor da própria consulta ou, na falta dele, o valor por consulta do convênio
+    return func.coalesce(appointment.amount, Insurance.fee, literal_column("0"))
+
+
+def pending_query(db: Session, month: date, insurance_id: int = None):
+    # Consultas de convênio encerradas no mês que ainda não entraram em nenhum lote
+    start, end = month_start(month), month_end(month)
+    appointment = source(db, Appointment, start, end)
+    query = (
+        db.query(appointment, Insurance)
+        .join(Insurance, appointment.insurance_id == Insurance.id)
+        .outerjoin(BillingItem, BillingItem.appointment_id == appointment.id)
+        .filter(appointment.date >= start, appointment.date <= end)
+        .filter(appointment.status.in_(BILLABLE_STATUSES))
+        .filter(BillingItem.id.is_(None))
+    )
+    if insurance_id is not None:
+        query = query.filter(appointment.insurance_id == insurance_id)
+    return query, appointment
+
+
+def _pending_rows(db: Session, month: date, insurance_id: int, after_id: int, limit: int):
+    # Paginação por id (keyset): memória limitada ao bloco e retomada a partir do último id gravado
+    query, appointment = pending_query(db, month, insurance_id)
+    rows = (
+        query.join(Patient, appointment.patient_id == Patient.id)
+        .join(Professional, appointment.professional_id == Professional.id)
+        .filter(appointment.id > after_id)
+        .with_entities(
+            appointment.id, appointment.date, appointment.time, Patient.name, Professional.name,
+            Professional.specialty, _amount(appointment)
+        )
+        .order_by(appointment.id)
+        .limit(limit)
+        .all()
+    )
+    return [BillingRow._make(row) for row in rows]
+
+
+def batch_filename(insurance_name: str, month: date, sequence: int, fmt: str):
+    slug = re.sub(r"[^a-z0-9]+", "_", normalize(insurance_name)).strip("_") or "convenio"
+    suffix = f"_lote{sequence}" if sequence > 1 else ""
+    return f"{slug}_{month.strftime('%Y-%m')}{suffix}.{fmt}"
+
+
+class CsvBatchWriter:
+    def header(self, insurance: str, month: date, sequence: int):
+        # BOM para o Excel reconhecer UTF-8 (acentos)
+        return "\ufeff" + self._line(BILLING_COLUMNS)
+
+    def rows(self, rows):
+        return "".join(
+            self._line([r.id, r.date.isoformat(), format_time(r.time), r.patient, r.professional, r.specialty,
+                        f"{r.amount:.2f}"])
+            for r in rows
+        )
+
+    def footer(self, appointments: int, total: float):
+        return self._line(["TOTAL", "", "", f"{appointments} consultas", "", "", f"{total:.2f}"])
+
+    @staticmethod
+    def _line(values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(["" if v is None else v for v in values])
+        return buffer.getvalue()
+
+
+class XmlBatchWriter:
+    # XML simples inspirado nas guias TISS: um elemento <guia> por consulta e os totais no fim
+    def header(self, insurance: str, month: date, sequence: int):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f"<loteFaturamento convenio={quoteattr(insurance)} competencia=\"{month.strftime('%Y-%m')}\" "
+            f"lote=\"{sequence}\">\n"
+        )
+
+    def rows(self, rows):
+        return "".join(
+            f'  <guia id="{r.id}"><data>{r.date.isoformat()}</data><hora>{format_time(r.time)}</hora>'
+            f"<paciente>{escape(r.patient or '')}</paciente><profissional>{escape(r.professional or '')}</profissional>"
+            f"<especialidade>{escape(r.specialty or '')}</especialidade><valor>{r.amount:.2f}</valor></guia>\n"
+            for r in rows
+        )
+
+    def footer(self, appointments: int, total: float):
+        return f"  <totais><guias>{appointments}</guias><valorTotal>{total:.2f}</valorTotal></totais>\n</loteFaturamento>\n"
+
+
+WRITERS = {"csv": CsvBatchWriter, "xml": XmlBatchWriter}
+
+
+def _open_batch(db: Session, insurance: Insurance, month: date, fmt: str, output_dir: str):
+    # Lote interrompido do convênio no mês (retomado no formato original) ou um lote novo
+    batch = (
+        db.query(BillingBatch)
+        .filter(BillingBatch.insurance_id == insurance.id, BillingBatch.month == month)
+        .filter(BillingBatch.status == GENERATING)
+        .first()
+    )
+    if batch is not None:
+        return batch, True
+    query, appointment = pending_query(db, month, insurance.id)
+    if not db.query(query.with_entities(appointment.id).exists()).scalar():
+        return None, False
+    sequence = (
+        db.query(func.coalesce(func.max(BillingBatch.sequence), 0))
+        .filter(BillingBatch.insurance_id == insurance.id, BillingBatch.month == month)
+        .scalar() + 1
+    )
+    batch = BillingBatch(
+        insurance_id=insurance.id, month=month, sequence=sequence, format=fmt, status=GENERATING,
+        file_path=os.path.join(output_dir, batch_filename(insurance.name, month, sequence, fmt)),
+        appointments=0, total=0.0, last_appointment_id=0, file_offset=0,
+    )
+    db.add(batch)
+    db.commit()
+    return batch, False
+
+
+def _part_file(batch: BillingBatch):
+    # Arquivo em construção; volta ao último bloco confirmado no banco
+    part = batch.file_path + ".part"
+    if not os.path.exists(part) and os.path.exists(batch.file_path):
+        os.replace(batch.file_path, part)  # interrompido entre renomear e confirmar
+    f = open(part, "r+b" if os.path.exists(part) else "w+b")
+    f.truncate(batch.file_offset)
+    f.seek(batch.file_offset)
+    return f
+
+
+def _write(f, text: str):
+    f.write(text.encode("utf-8"))
+    f.flush()
+    os.fsync(f.fileno())
+    return f.tell()
+
+
+def bill_insurance(month: date, insurance_id: int, fmt: str = "csv", output_dir: str = BILLING_DIR,
+                   chunk_size: int = BILLING_CHUNK_SIZE, progress=None):
+    # Gera (ou retoma) o lote de um convênio com sessão própria: roda em uma thread do pool
+    month = month_start(month)
+    with session_scope() as db, use_primary(db):
+        insurance = db.get(Insurance, insurance_id)
+        batch, resumed = _open_batch(db, insurance, month, fmt, output_dir)
+        if batch is None:
+            return BillingResult(insurance.id, insurance.name, None, None, 0, 0.0, None, False, None)
+        writer = WRITERS[batch.format]()
+        os.makedirs(os.path.dirname(batch.file_path) or ".", exist_ok=True)
+        with _part_file(batch) as f:
+            if batch.file_offset == 0:
+                batch.file_offset = _write(f, writer.header(insurance.name, month, batch.sequence))
+                db.commit()
+            while True:
+                rows = _pending_rows(db, month, insurance.id, batch.last_appointment_id, chunk_size)
+                if not rows:
+                    break
+                offset = _write(f, writer.rows(rows))
+                # Consultas do bloco e ponto de retomada na mesma transação
+                db.execute(insert(BillingItem), [
+                    {"batch_id": batch.id, "appointment_id": r.id, "appointment_date": r.date, "amount": r.amount}
+                    for r in rows
+                ])
+                batch.last_appointment_id = rows[-1].id
+                batch.file_offset = offset
+                batch.appointments += len(rows)
+                batch.total = round(batch.total + sum(r.amount for r in rows), 2)
+                db.commit()
+                if progress:
+                    progress(insurance.name, batch.appointments)
+            _write(f, writer.footer(batch.appointments, batch.total))
+        os.replace(batch.file_path + ".part", batch.file_path)
+        batch.status = BILLED
+        batch.finished_at = datetime.now()
+        db.commit()
+        return BillingResult(
+            insurance.id, insurance.name, batch.id, batch.sequence, batch.appointments, batch.total,
+            batch.file_path, resumed, None
+        )
+
+
+def insurers_to_bill(db: Session, month: date):
+    # Convênios com consultas pendentes no mês ou com lote interrompido
+    month = month_start(month)
+    query, appointment = pending_query(db, month)
+    pending = {row[0] for row in query.with_entities(appointment.insurance_id).distinct()}
+    interrupted = {
+        row[0] for row in db.query(BillingBatch.insurance_id)
+        .filter(BillingBatch.month == month, BillingBatch.status == GENERATING)
+    }
+    return sorted(pending | interrupted)
+
+
+def run_billing(month: date, fmt: str = "csv", workers: int = BILLING_WORKERS, output_dir: str = BILLING_DIR,
+                insurance_ids=None, chunk_size: int = BILLING_CHUNK_SIZE, progress=None):
+    # Um convênio por thread (o trabalho é de banco e disco); a falha de um não interrompe os demais
+    if fmt not in BILLING_FORMATS:
+        raise ValueError(f"formato de faturamento desconhecido: {fmt}")
+    if insurance_ids is None:
+        with session_scope() as db, use_primary(db):
+            insurance_ids = insurers_to_bill(db, month)
+    lock = threading.Lock()
+
+    def report(name, appointments):
+        if progress:
+            with lock:
+                progress(name, appointments)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(bill_insurance, month, insurance_id, fmt, output_dir, chunk_size, report): insurance_id
+            for insurance_id in insurance_ids
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.exception("Falha no faturamento do convênio %s", futures[future])
+                results.append(BillingResult(futures[future], None, None, None, 0, 0.0, None, False, str(e)))
+    return sorted(results, key=lambda r: (r.insurance or "", r.insurance_id))
+
+
+def billing_summary(db: Session, month: date):
+    # Faturado, recebido e pendente por convênio no mês (lotes em geração contam como pendentes)
+    month = month_start(month)
+    done = BillingBatch.status != GENERATING
+    batches = {
+        row[0]: row[1:]
+        for row in db.query(
+            BillingBatch.insurance_id,
+            func.sum(case((done, 1), else_=0)),
+            func.coalesce(func.sum(case((done, BillingBatch.total), else_=0)), 0),
+            func.coalesce(func.sum(BillingBatch.received_amount), 0),
+            func.coalesce(func.sum(case((done, 0), else_=BillingBatch.appointments)), 0),
+            func.coalesce(func.sum(case((done, 0), else_=BillingBatch.total)), 0),
+        )
+        .filter(BillingBatch.month == month)
+        .group_by(BillingBatch.insurance_id)
+    }
+    query, appointment = pending_query(db, month)
+    pending = {
+        row[0]: row[1:]
+        for row in query.with_entities(
+            appointment.insurance_id, func.count(appointment.id), func.coalesce(func.sum(_amount(appointment)), 0)
+        ).group_by(appointment.insurance_id)
+    }
+    names = dict(db.query(Insurance.id, Insurance.name).filter(Insurance.id.in_(set(batches) | set(pending))))
+    summary = []
+    for insurance_id in set(batches) | set(pending):
+        count, billed, received, generating_count, generating_total = batches.get(insurance_id, (0, 0, 0, 0, 0))
+        pending_count, pending_total = pending.get(insurance_id, (0, 0))
+        summary.append(InsuranceBilling(
+            insurance_id, names.get(insurance_id), count, float(billed), float(received),
+            pending_count + generating_count, float(pending_total) + float(generating_total),
+        ))
+    return sorted(summary, key=lambda row: row.insurance or "")
+
+
+def list_batches(db: Session, month: date):
+    return (
+        db.query(BillingBatch, Insurance.name)
+        .join(Insurance, BillingBatch.insurance_id == Insurance.id)
+        .filter(BillingBatch.month == month_start(month))
+        .order_by(Insurance.name, BillingBatch.sequence)
+        .all()
+    )
+
+
+@on_primary
+def mark_batch_received(db: Session, batch_id: int, amount: float = None, received_at: date = None):
+    # Registra o pagamento do convênio (valor pode diferir do faturado: glosas) como entrada no caixa
+    batch = db.query(BillingBatch).filter(BillingBatch.id == batch_id).with_for_update().first()
+    if batch is None:
+        raise ValueError("Lote de faturamento não encontrado")
+    if batch.status != BILLED:
+        raise ValueError(f"Lote {batch.sequence} está com status '{batch.status}' e não pode ser recebido")
+    amount = batch.total if amount is None else amount
+    received_at = received_at or date.today()
+    insurance = db.get(Insurance, batch.insurance_id)
+    db.add(CashFlow(
+        date=received_at,
+        description=f"Convênio {insurance.name} - {batch.month.strftime('%m/%Y')} (lote {batch.sequence})",
+        amount=amount,
+        payment_date=received_at,
+        paid=True,
+        type="entrada",
+    ))
+    apply_cash_flow_delta(db, received_at, "entrada", True, amount)
+    batch.status = RECEIVED
+    batch.received_at = received_at
+    batch.received_amount = amount
+    db.commit()
+    return batch
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from database import use_primary
+# Os modelos de leitura (sem vínculo com a sessão) são os valores guardados no cache
+from queries import (  # noqa: F401
+    InsuranceRef, PatientRef, ProfessionalRef, WorkingHoursRef,
+    get_patients, list_insurances, list_professionals, list_working_hours
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, ttl: float = 300, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._generations = {}  # namespace -> quantas vezes foi invalidado
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        # Remove os menos usados quando passa do limite
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def _generation(self, namespace):
+        return self._generations.get(namespace, 0), self._generations.get(None, 0)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Uma escrita que invalide o namespace durante a carga torna o valor lido antigo: não é guardado
+            with self._lock:
+                generation = self._generation(key[0])
+            value = loader()
+            with self._lock:
+                if self._generation(key[0]) == generation:
+                    self._store(key, value)
+        return value
+
+    def invalidate(self, namespace: str = None):
+        # As chaves são tuplas cujo primeiro item é o namespace
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            if namespace is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k[0] == namespace]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+reference_cache = TTLCache(ttl=300, maxsize=512)
+
+
+# O cache é compartilhado por todas as sessões e limpo no momento da escrita: a carga vem do
+# primário para que uma réplica atrasada não deixe dados antigos guardados até o fim do TTL
+
+def load_professionals(db: Session):
+    def loader():
+        with use_primary(db):
+            return tuple(list_professionals(db))
+    return reference_cache.get_or_load(("professionals",), loader)
+
+
+def load_insurances(db: Session):
+    def loader():
+        with use_primary(db):
+            return tuple(list_insurances(db))
+    return reference_cache.get_or_load(("insurances",), loader)
+
+
+def load_patients(db: Session, search: str = None, limit: int = None, offset: int = 0):
+    def loader():
+        with use_primary(db):
+            return tuple(get_patients(db, search, limit=limit, offset=offset))
+    return reference_cache.get_or_load(("patients", search or "", limit, offset), loader)
+
+
+def load_working_hours(db: Session):
+    def loader():
+        with use_primary(db):
+            return tuple(list_working_hours(db))
+    return reference_cache.get_or_load(("working_hours",), loader)
+
+
+def invalidate_professionals():
+    reference_cache.invalidate("professionals")
+
+
+def invalidate_insurances():
+    reference_cache.invalidate("insurances")
+
+
+def invalidate_working_hours():
+    reference_cache.invalidate("working_hours")
+
+
+def invalidate_patients():
+    reference_cache.invalidate("patients")
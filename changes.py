@@ -0,0 +1,240 @@
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, func, insert, text
+from sqlalchemy.orm import Session
+from database import use_primary
+from models import ScheduleChange
+from queries import get_clinic_schedule, get_day_schedule, get_schedule_entries
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "schedule_changes"
+POLL_INTERVAL = 2.0  # segundos entre leituras do log quando não há LISTEN/NOTIFY
+LISTEN_SAFETY_INTERVAL = 30.0  # com LISTEN, leitura periódica só por garantia
+BUFFER_SIZE = 5000
+# Ids atribuídos por transações ainda abertas podem aparecer depois de ids maiores;
+# a janela relê os últimos ids para não perder essas mudanças
+ID_LOOKBACK = 200
+LIVE_SCHEDULES_PER_SESSION = 20
+
+ChangeRef = namedtuple("ChangeRef", ["id", "professional_id", "date", "appointment_id", "action"])
+
+
+def _notify(db: Session, changes):
+    # O NOTIFY só é entregue quando a transação do comando é confirmada
+    if db.get_bind().dialect.name == "postgresql":
+        payload = ",".join(f"{c['professional_id']}:{c['date'].isoformat()}" for c in changes[:50])
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload[:7000]})
+
+
+def record_change(db: Session, professional_id: int, day: date, appointment_id: int = None, action: str = "update"):
+    # Chamado pelos comandos antes do commit, na mesma transação da alteração
+    record_changes(db, [{
+        "professional_id": professional_id, "date": day, "appointment_id": appointment_id, "action": action
+    }])
+
+
+def record_changes(db: Session, changes):
+    if not changes:
+        return
+    db.execute(insert(ScheduleChange), changes)
+    db.info["schedule_changed"] = True
+    _notify(db, changes)
+
+
+def prune_changes(db: Session, keep_days: int = 7):
+    cutoff = datetime.now() - timedelta(days=keep_days)
+    deleted = db.query(ScheduleChange).filter(ScheduleChange.changed_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class ChangeFeed:
+    # Mudanças recentes da agenda compartilhadas por todas as sessões do processo.
+    # O banco é consultado no máximo uma vez por intervalo, qualquer que seja o número de sessões.
+    def __init__(self, poll_interval: float = POLL_INTERVAL, buffer_size: int = BUFFER_SIZE):
+        self.poll_interval = poll_interval
+        self.seq = 0  # posição local no feed; as sessões guardam a última que leram
+        self.last_id = None
+        self.listening = False
+        self._changes = deque(maxlen=buffer_size)  # (seq, ChangeRef)
+        self._seen = deque(maxlen=buffer_size)
+        self._seen_ids = set()
+        self._checked_at = 0.0
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def _due(self):
+        interval = LISTEN_SAFETY_INTERVAL if self.listening else self.poll_interval
+        return self._dirty or time.monotonic() - self._checked_at >= interval
+
+    def sync(self, db: Session):
+        if not self._due() or not self._lock.acquire(blocking=False):
+            return self.seq
+        try:
+            self._dirty = False
+            with use_primary(db):
+                self._read(db)
+            self._checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.seq
+
+    def _read(self, db: Session):
+        # Sempre do primário: numa réplica atrasada a janela de ids não garante nada
+        first_read = self.last_id is None
+        if first_read:
+            self.last_id = db.query(func.coalesce(func.max(ScheduleChange.id), 0)).scalar()
+        rows = (
+            db.query(
+                ScheduleChange.id, ScheduleChange.professional_id, ScheduleChange.date,
+                ScheduleChange.appointment_id, ScheduleChange.action
+            )
+            .filter(ScheduleChange.id > self.last_id - ID_LOOKBACK)
+            .order_by(ScheduleChange.id)
+            .all()
+        )
+        for row in rows:
+            if row.id in self._seen_ids:
+                continue
+            self._remember(row.id)
+            self.last_id = max(self.last_id, row.id)
+            if not first_read:
+                # Na primeira leitura o histórico só é marcado como visto
+                self.seq += 1
+                self._changes.append((self.seq, ChangeRef._make(row)))
+
+    def _remember(self, change_id):
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(change_id)
+        self._seen_ids.add(change_id)
+
+    def changes_since(self, seq: int):
+        # None quando as mudanças já saíram do buffer: quem chamou deve recarregar tudo
+        changes = list(self._changes)
+        if changes and changes[0][0] > seq + 1:
+            return None
+        return [change for change_seq, change in changes if change_seq > seq]
+
+    def start_listener(self, engine):
+        # LISTEN numa conexão dedicada (psycopg2); sem ele o feed funciona por polling
+        if engine.dialect.name != "postgresql" or engine.dialect.driver != "psycopg2" or self._listener:
+            return False
+        self._listener = threading.Thread(target=self._listen, args=(engine,), name="schedule-listener", daemon=True)
+        self._listener.start()
+        return True
+
+    def _listen(self, engine):
+        while True:
+            try:
+                raw = engine.raw_connection()
+                raw.detach()  # fica fora do pool durante toda a vida do processo
+                conn = getattr(raw, "dbapi_connection", None) or raw.connection
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                self.listening = True
+                self._dirty = True
+                while True:
+                    if select.select([conn], [], [], LISTEN_SAFETY_INTERVAL) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self._dirty = True
+            except Exception as e:
+                self.listening = False
+                logger.warning("LISTEN %s interrompido, usando polling: %s", CHANNEL, e)
+                time.sleep(5)
+
+
+_feed = ChangeFeed()
+
+
+def get_change_feed():
+    return _feed
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    # Alterações feitas neste processo aparecem na próxima leitura, sem esperar o intervalo
+    if session.info.pop("schedule_changed", False):
+        _feed.mark_dirty()
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("schedule_changed", None)
+
+
+def _matches(change_or_entry, day: date, professional_id: int = None):
+    return change_or_entry.date == day and (professional_id is None or change_or_entry.professional_id == professional_id)
+
+
+def _ordered(rows, professional_id):
+    if professional_id is None:
+        return sorted(rows, key=lambda e: (e.professional_name or "", e.time))
+    return sorted(rows, key=lambda e: e.time)
+
+
+def live_schedule(db: Session, state, day: date, professional_id: int = None):
+    # Agenda do dia (de um profissional ou da clínica) guardada em state (session_state)
+    # e atualizada só com as consultas que mudaram desde a última leitura.
+    # Lida do primário: o que fica guardado precisa estar em dia com o feed
+    with use_primary(db):
+        return _live_schedule(db, state, day, professional_id)
+
+
+def _live_schedule(db: Session, state, day: date, professional_id: int = None):
+    feed = get_change_feed()
+    seq = feed.sync(db)
+    schedules = state.setdefault("live_schedules", OrderedDict())
+    key = (professional_id, day)
+    cached = schedules.get(key)
+    changes = feed.changes_since(cached["seq"]) if cached else None
+
+    if changes is not None:
+        relevant = [c for c in changes if _matches(c, day, professional_id)]
+        if any(c.appointment_id is None for c in relevant):
+            changes = None
+        elif relevant:
+            ids = {c.appointment_id for c in relevant}
+            rows = cached["rows"]
+            for appointment_id in ids:
+                rows.pop(appointment_id, None)
+            for entry in get_schedule_entries(db, ids, {c.date for c in relevant}):
+                if _matches(entry, day, professional_id):
+                    rows[entry.id] = entry
+        if changes is not None:
+            cached["seq"] = seq
+            schedules.move_to_end(key)
+            return _ordered(cached["rows"].values(), professional_id)
+
+    # Primeira leitura (ou mudanças fora do buffer): agenda completa
+    if professional_id is None:
+        entries = get_clinic_schedule(db, day)
+    else:
+        entries = get_day_schedule(db, day, professional_id)
+    schedules[key] = {"seq": seq, "rows": {entry.id: entry for entry in entries}}
+    schedules.move_to_end(key)
+    while len(schedules) > LIVE_SCHEDULES_PER_SESSION:
+        schedules.popitem(last=False)
+    return entries
+
+
+def schedule_changed(db: Session, state, day: date, professional_id: int = None):
+    # Verificação barata para atualização automática: usa só o feed em memória
+    cached = state.get("live_schedules", {}).get((professional_id, day))
+    if cached is None:
+        return False
+    get_change_feed().sync(db)
+    changes = get_change_feed().changes_since(cached["seq"])
+    return changes is None or any(_matches(c, day, professional_id) for c in changes)
@@ -0,0 +1,241 @@
+import argparse
+from datetime import date
+from database import configure_engine, get_engine, init_db, session_scope
+from reports import rebuild_cash_flow_rollup
+from analytics import rebuild_appointment_facts
+from importer import IMPORT_CHUNK_SIZE, run_import
+from export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_to_file
+from changes import prune_changes
+from migrations import latest_version, migrate, pending_migrations
+from partitions import FUTURE_MONTHS, KEEP_YEARS, archive_cold_years, create_future_partitions, partition_tables
+from billing import BILLING_DIR, BILLING_FORMATS, BILLING_WORKERS, run_billing
+from reminders import (
+    REMINDER_CHANNELS, REMINDER_CONCURRENCY, REMINDER_RATE, FileTransport, ReminderDispatcher, reminder_window,
+    send_reminders, transport_from_env
+)
+
+
+def rebuild_cash_rollup(args):
+    with session_scope() as db:
+        rebuild_cash_flow_rollup(db, args.start, args.end)
+    print("Consolidação diária do caixa recalculada.")
+
+
+def rebuild_facts(args):
+    with session_scope() as db:
+        rows = rebuild_appointment_facts(db)
+    print(f"Fatos diários das consultas recalculados: {rows} linhas.")
+
+
+def import_csv(args):
+    def progress(report):
+        print(f"  {report.rows} linhas processadas...", flush=True)
+
+    with session_scope() as db, open(args.file, newline="", encoding="utf-8-sig") as stream:
+        report = run_import(db, args.kind, stream, chunk_size=args.chunk_size, progress=progress)
+    print(report.summary())
+    for line, message in report.errors[:args.max_errors]:
+        print(f"  linha {line}: {message}")
+    if len(report.errors) > args.max_errors:
+        print(f"  ... mais {len(report.errors) - args.max_errors} erros")
+
+
+def export_data(args):
+    fmt = args.format or ("parquet" if args.file.endswith(".parquet") else "csv")
+
+    def progress(rows):
+        print(f"  {rows} linhas exportadas...", flush=True)
+
+    with session_scope() as db:
+        rows = export_to_file(db, args.kind, args.start, args.end, args.file, fmt, args.chunk_size, progress)
+    print(f"{rows} linhas gravadas em {args.file}")
+
+
+def prune_schedule_changes(args):
+    with session_scope() as db:
+        deleted = prune_changes(db, args.days)
+    print(f"{deleted} mudanças de agenda removidas.")
+
+
+def partition(args):
+    converted = partition_tables(get_engine(), args.future_months)
+    if get_engine().dialect.name != "postgresql":
+        print("Particionamento disponível apenas no PostgreSQL; use maintain-partitions para arquivar anos antigos.")
+    elif converted:
+        print(f"Tabelas particionadas por mês: {', '.join(converted)}")
+    else:
+        print("As tabelas já estão particionadas.")
+
+
+def maintain_partitions(args):
+    created = create_future_partitions(get_engine(), args.future_months)
+    if created:
+        print(f"Partições criadas: {', '.join(created)}")
+    if args.keep_years:
+        cutoff, moved = archive_cold_years(get_engine(), args.keep_years)
+        for table, count in moved.items():
+            print(f"{table}: {count} partições/linhas anteriores a {cutoff.strftime('%d/%m/%Y')} arquivadas")
+        if not moved:
+            print(f"Nada anterior a {cutoff.strftime('%d/%m/%Y')} para arquivar.")
+
+
+def run_migrations(args):
+    engine = get_engine()
+    if args.status:
+        with engine.connect() as conn:
+            pending = pending_migrations(conn)
+        print(f"Versão esperada pela aplicação: {latest_version()}")
+        for version, name in pending:
+            print(f"  pendente {version}: {name}")
+        if not pending:
+            print("Nenhuma migração pendente.")
+        return
+
+    def progress(version, name):
+        print(f"  {version}: {name}...", flush=True)
+
+    applied = migrate(engine, args.target, progress)
+    print(f"{len(applied)} migrações aplicadas." if applied else "Banco já está atualizado.")
+
+
+def send_patient_reminders(args):
+    # Várias clínicas (um banco cada) na mesma execução noturna: --database-url repetido
+    start, end, kind = reminder_window(args.hours)
+    channels = [channel.strip() for channel in args.channels.split(",") if channel.strip()]
+
+    def progress(report):
+        print(f"  {report.sent + report.failed} de {report.due} processados...", flush=True)
+
+    failed = 0
+    for url in args.database_url or [None]:
+        if url:
+            configure_engine(url)
+            print(get_engine().url.render_as_string(hide_password=True))
+        if args.outbox:
+            outbox = FileTransport(args.outbox)
+            transports = {channel: outbox for channel in channels}
+        else:
+            transports = {channel: transport_from_env(channel) for channel in channels}
+        dispatcher = ReminderDispatcher(transports, concurrency=args.concurrency, rate=args.rate)
+        try:
+            # Uma clínica com problema (banco fora do ar, schema desatualizado) não impede as demais
+            init_db()
+            with session_scope() as db:
+                report = send_reminders(db, transports, start, end, kind, channels, dispatcher, progress=progress)
+        except Exception as e:
+            if not url:
+                raise
+            failed += 1
+            print(f"  Erro: {e}")
+            continue
+        print(report.summary())
+    if failed:
+        raise SystemExit(f"{failed} clínica(s) com erro no envio de lembretes")
+
+
+def bill_insurers(args):
+    def progress(insurance, appointments):
+        print(f"  {insurance}: {appointments} consultas...", flush=True)
+
+    results = run_billing(args.month, args.format, args.workers, args.output_dir, args.insurance_id, progress=progress)
+    for result in results:
+        if result.error:
+            print(f"{result.insurance or result.insurance_id}: erro - {result.error}")
+        elif result.batch_id is None:
+            print(f"{result.insurance}: nada a faturar")
+        else:
+            resumed = " (retomado)" if result.resumed else ""
+            print(f"{result.insurance}: lote {result.sequence}{resumed}, {result.appointments} consultas, "
+                  f"R$ {result.total:,.2f} -> {result.file_path}")
+    if not results:
+        print("Nenhuma consulta de convênio pendente de faturamento no mês.")
+    if any(result.error for result in results):
+        raise SystemExit(1)
+
+
+def month_arg(value: str):
+    return date.fromisoformat(f"{value}-01" if len(value) == 7 else value).replace(day=1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="medicalsync", description="Tarefas administrativas da Agenda Médica")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrations = subparsers.add_parser("migrate", help="Aplica as migrações pendentes do banco")
+    migrations.add_argument("--status", action="store_true", help="Só lista as migrações pendentes")
+    migrations.add_argument("--target", type=int, help="Para na versão informada")
+    migrations.set_defaults(func=run_migrations)
+
+    rollup = subparsers.add_parser("rebuild-cash-rollup", help="Recalcula a consolidação diária do caixa")
+    rollup.add_argument("--start", type=date.fromisoformat, help="Data inicial (AAAA-MM-DD)")
+    rollup.add_argument("--end", type=date.fromisoformat, help="Data final (AAAA-MM-DD)")
+    rollup.set_defaults(func=rebuild_cash_rollup)
+
+    facts = subparsers.add_parser(
+        "rebuild-appointment-facts", help="Recalcula os fatos diários das consultas usados nos indicadores"
+    )
+    facts.set_defaults(func=rebuild_facts)
+
+    importer = subparsers.add_parser("import", help="Importa pacientes, profissionais ou consultas de um CSV")
+    importer.add_argument("kind", choices=["patients", "professionals", "appointments"])
+    importer.add_argument("file", help="Arquivo CSV (separado por ',' ou ';')")
+    importer.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    importer.add_argument("--max-errors", type=int, default=50, help="Quantidade de erros exibidos")
+    importer.set_defaults(func=import_csv)
+
+    exporter = subparsers.add_parser("export", help="Exporta caixa ou consultas de um período em CSV ou Parquet")
+    exporter.add_argument("kind", choices=["cash_flow", "appointments"])
+    exporter.add_argument("file", help="Arquivo de destino")
+    exporter.add_argument("--start", type=date.fromisoformat, required=True, help="Data inicial (AAAA-MM-DD)")
+    exporter.add_argument("--end", type=date.fromisoformat, required=True, help="Data final (AAAA-MM-DD)")
+    exporter.add_argument("--format", choices=EXPORT_FORMATS, help="Padrão: pela extensão do arquivo")
+    exporter.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    exporter.set_defaults(func=export_data)
+
+    prune = subparsers.add_parser("prune-schedule-changes", help="Remove o histórico antigo de mudanças da agenda")
+    prune.add_argument("--days", type=int, default=7, help="Dias mantidos (padrão: 7)")
+    prune.set_defaults(func=prune_schedule_changes)
+
+    partitioner = subparsers.add_parser("partition-tables", help="Particiona consultas e caixa por mês (PostgreSQL)")
+    partitioner.add_argument("--future-months", type=int, default=FUTURE_MONTHS)
+    partitioner.set_defaults(func=partition)
+
+    maintain = subparsers.add_parser(
+        "maintain-partitions", help="Cria as partições dos próximos meses e arquiva os anos antigos"
+    )
+    maintain.add_argument("--future-months", type=int, default=FUTURE_MONTHS)
+    maintain.add_argument("--keep-years", type=int, default=KEEP_YEARS,
+                          help="Anos mantidos na tabela principal, contando o atual (0 = não arquivar)")
+    maintain.set_defaults(func=maintain_partitions)
+
+    reminders = subparsers.add_parser("send-reminders", help="Envia lembretes das próximas consultas aos pacientes")
+    reminders.add_argument("--hours", type=int, help="Consultas das próximas N horas (padrão: as de amanhã)")
+    reminders.add_argument("--channels", default=",".join(REMINDER_CHANNELS),
+                           help="Canais em ordem de preferência (padrão: whatsapp,email)")
+    reminders.add_argument("--outbox", help="Grava as mensagens neste arquivo (JSON por linha) em vez de enviar")
+    reminders.add_argument("--concurrency", type=int, default=REMINDER_CONCURRENCY)
+    reminders.add_argument("--rate", type=float, default=REMINDER_RATE, help="Mensagens por segundo em cada canal")
+    reminders.add_argument("--database-url", action="append",
+                           help="Banco de uma clínica; repita para várias (padrão: o do .env)")
+    reminders.set_defaults(func=send_patient_reminders)
+
+    billing = subparsers.add_parser("bill-insurers", help="Gera os lotes de faturamento dos convênios de um mês")
+    billing.add_argument("--month", type=month_arg, required=True, help="Mês faturado (AAAA-MM)")
+    billing.add_argument("--format", choices=BILLING_FORMATS, default="csv")
+    billing.add_argument("--workers", type=int, default=BILLING_WORKERS, help="Convênios processados em paralelo")
+    billing.add_argument("--output-dir", default=BILLING_DIR)
+    billing.add_argument("--insurance-id", type=int, action="append", help="Só os convênios informados")
+    billing.set_defaults(func=bill_insurers)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command not in ("migrate", "send-reminders"):
+        init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,27 @@
+from collections import defaultdict
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
-from models import Professional, Patient, Insurance, Appointment, CashFlow
-from datetime import date
+from models import APPOINTMENT_STATUSES, PAYMENT_METHODS, Professional, Patient, Insurance, Appointment, CashFlow, WorkingHours
+from datetime import date, timedelta
+from cache import invalidate_professionals, invalidate_patients, invalidate_insurances, invalidate_working_hours
+from search import index_notes, index_patient
+from reports import apply_cash_flow_delta, apply_cash_flow_deltas
+from reservations import SlotConflictError, insert_appointment, reserve_slot
+from changes import record_change, record_changes
+from analytics import apply_cancellation
+from utils import format_time, parse_time
+from database import on_primary
 
+@on_primary
 def create_professional(db: Session, name: str, specialty: str):
     professional = Professional(name=name, specialty=specialty)
     db.add(professional)
     db.commit()
+    invalidate_professionals()
     db.refresh(professional)
     return professional
 
+@on_primary
 def create_patient(db: Session, name: str, phone: str, email: str = None, birth_date: date = None, notes: str = None):
     patient = Patient(
         name=name,
@@ -20,15 +33,90 @@ def create_patient(db: Session, name: str, phone: str, email: str = None, birth_
     db.add(patient)
     db.commit()
     db.refresh(patient)
+    index_patient(db, patient.id, patient.name, patient.phone, patient.notes)
+    invalidate_patients()
     return patient
 
-def create_insurance(db: Session, name: str):
-    insurance = Insurance(name=name)
+@on_primary
+def create_insurance(db: Session, name: str, fee: float = None):
+    insurance = Insurance(name=name, fee=fee)
     db.add(insurance)
     db.commit()
+    invalidate_insurances()
     db.refresh(insurance)
     return insurance
 
+def validate_status(status: str):
+    if status not in APPOINTMENT_STATUSES:
+        raise ValueError(f"Status inválido: {status}")
+    return status
+
+@on_primary
+def set_working_hours(db: Session, professional_id: int, weekdays: list, start_time, end_time,
+                      slot_minutes: int = 30, break_start=None, break_end=None):
+    # Substitui a grade dos dias da semana informados
+    start_time, end_time = parse_time(start_time), parse_time(end_time)
+    if start_time >= end_time:
+        raise ValueError("O início do atendimento deve ser antes do fim")
+    if (break_start is None) != (break_end is None):
+        raise ValueError("Informe início e fim do intervalo")
+    (
+        db.query(WorkingHours)
+        .filter(WorkingHours.professional_id == professional_id)
+        .filter(WorkingHours.weekday.in_(weekdays))
+        .delete(synchronize_session=False)
+    )
+    db.add_all([
+        WorkingHours(
+            professional_id=professional_id,
+            weekday=weekday,
+            start_time=start_time,
+            end_time=end_time,
+            slot_minutes=slot_minutes,
+            break_start=parse_time(break_start) if break_start else None,
+            break_end=parse_time(break_end) if break_end else None
+        )
+        for weekday in weekdays
+    ])
+    db.commit()
+    invalidate_working_hours()
+
+def _add_cash_flow(db: Session, appointment_id: int, values: dict, paid: bool = False):
+    # Se for particular, cria registro no caixa vinculado à consulta já inserida
+    if values.get("insurance_id") is None and values.get("amount"):
+        db.add(CashFlow(
+            date=values["date"],
+            description=f"Consulta {values['patient_id']} - {format_time(values['time'])}",
+            amount=values["amount"],
+            paid=paid,
+            payment_date=date.today() if paid else None,
+            appointment_id=appointment_id,
+            type="entrada"
+        ))
+        apply_cash_flow_delta(db, values["date"], "entrada", paid, values["amount"])
+
+def _sync_cash_flow(db: Session, appointment: Appointment):
+    # Depois da edição: o lançamento acompanha valor, data e particular/convênio da consulta
+    cash_flows = db.query(CashFlow).filter(CashFlow.appointment_id == appointment.id).all()
+    for cash_flow in cash_flows:
+        apply_cash_flow_delta(db, cash_flow.date, cash_flow.type, bool(cash_flow.paid), -(cash_flow.amount or 0), -1)
+    if appointment.insurance_id is not None or not appointment.amount:
+        for cash_flow in cash_flows:
+            db.delete(cash_flow)
+        return
+    if not cash_flows:
+        _add_cash_flow(db, appointment.id, {
+            "date": appointment.date, "time": appointment.time, "patient_id": appointment.patient_id,
+            "insurance_id": None, "amount": appointment.amount
+        }, bool(appointment.paid))
+        return
+    for cash_flow in cash_flows:
+        cash_flow.date = appointment.date
+        cash_flow.amount = appointment.amount
+        cash_flow.description = f"Consulta {appointment.patient_id} - {format_time(appointment.time)}"
+        apply_cash_flow_delta(db, cash_flow.date, cash_flow.type, bool(cash_flow.paid), cash_flow.amount)
+
+@on_primary
 def create_appointment(
     db: Session,
     date: date,
@@ -41,57 +129,226 @@ def create_appointment(
     amount: float = None,
     notes: str = None
 ):
-    appointment = Appointment(
+    values = dict(
         date=date,
-        time=time,
+        time=parse_time(time),
         professional_id=professional_id,
         patient_id=patient_id,
         insurance_id=insurance_id,
-        status=status,
+        status=validate_status(status),
         payment_method=payment_method,
         amount=amount,
         notes=notes
     )
-    db.add(appointment)
+    try:
+        # Inserção atômica: o índice único decide quem fica com o horário
+        appointment_id = reserve_slot(db, values)
+    except SlotConflictError:
+        db.rollback()
+        raise
+    _add_cash_flow(db, appointment_id, values)
+    record_change(db, professional_id, date, appointment_id, "insert")
     
-    # Se for particular, cria registro no caixa
-    if insurance_id is None and amount:
-        cash_flow = CashFlow(
-            date=date,
-            description=f"Consulta {patient_id} - {time}",
+    db.commit()
+    if notes:
+        index_notes(db, "appointment", appointment_id, notes)
+    return db.get(Appointment, appointment_id)
+
+def recurring_slots(start_date: date, time: str, occurrences: int, interval: timedelta = timedelta(weeks=1)):
+    return [(start_date + i * interval, parse_time(time)) for i in range(occurrences)]
+
+def find_conflicts(db: Session, professional_id: int, slots: list):
+    # Uma única consulta para todos os horários pedidos
+    if not slots:
+        return set()
+    dates = {slot_date for slot_date, _ in slots}
+    times = {slot_time for _, slot_time in slots}
+    booked = (
+        db.query(Appointment.date, Appointment.time)
+        .filter(Appointment.professional_id == professional_id)
+        .filter(Appointment.date.in_(dates))
+        .filter(Appointment.time.in_(times))
+        .all()
+    )
+    return {tuple(row) for row in booked} & set(slots)
+
+@on_primary
+def create_appointments(
+    db: Session,
+    slots: list,
+    professional_id: int,
+    patient_id: int,
+    insurance_id: int = None,
+    status: str = "agendado",
+    payment_method: str = None,
+    amount: float = None,
+    notes: str = None
+):
+    # slots: lista de (data, horário); retorna (ids criados, horários ocupados)
+    validate_status(status)
+    slots = list(dict.fromkeys((slot_date, parse_time(slot_time)) for slot_date, slot_time in slots))
+    conflicts = find_conflicts(db, professional_id, slots)
+    created = []
+    for slot_date, slot_time in slots:
+        if (slot_date, slot_time) in conflicts:
+            continue
+        values = dict(
+            date=slot_date,
+            time=slot_time,
+            professional_id=professional_id,
+            patient_id=patient_id,
+            insurance_id=insurance_id,
+            status=status,
+            payment_method=payment_method,
             amount=amount,
-            paid=False,
-            appointment_id=appointment.id,
-            type="entrada"
+            notes=notes
         )
-        db.add(cash_flow)
-    
+        # Outra sessão pode ter reservado o horário depois da verificação
+        appointment_id = insert_appointment(db, values)
+        if appointment_id is None:
+            conflicts.add((slot_date, slot_time))
+            continue
+        _add_cash_flow(db, appointment_id, values)
+        created.append((appointment_id, slot_date))
+    record_changes(db, [
+        {"professional_id": professional_id, "date": slot_date, "appointment_id": appointment_id, "action": "insert"}
+        for appointment_id, slot_date in created
+    ])
     db.commit()
-    db.refresh(appointment)
-    return appointment
+    if notes:
+        for appointment_id, _ in created:
+            index_notes(db, "appointment", appointment_id, notes)
+    return [appointment_id for appointment_id, _ in created], sorted(conflicts)
 
+def _update_appointments(db: Session, condition, values: dict):
+    # UPDATE ... RETURNING: altera e devolve as linhas (todas as colunas) numa única ida ao banco
+    table = Appointment.__table__
+    if db.get_bind().dialect.name in ("postgresql", "sqlite"):
+        return db.execute(update(table).where(condition).values(**values).returning(*table.columns)).all()
+    ids = [row[0] for row in db.execute(select(table.c.id).where(condition).with_for_update())]
+    if not ids:
+        return []
+    db.execute(update(table).where(table.c.id.in_(ids)).values(**values))
+    return db.execute(select(*table.columns).where(table.c.id.in_(ids))).all()
+
+def _settle_cash_flow(db: Session, appointment_ids, paid: bool = True):
+    # Baixa (ou estorna, com paid=False) os lançamentos das consultas e move os valores
+    # entre pendente e recebido no total diário
+    if not appointment_ids:
+        return 0
+    table = CashFlow.__table__
+    condition = table.c.appointment_id.in_(list(appointment_ids))
+    condition &= table.c.paid.isnot(True) if paid else table.c.paid.is_(True)
+    values = {"paid": paid, "payment_date": date.today() if paid else None}
+    if db.get_bind().dialect.name in ("postgresql", "sqlite"):
+        rows = db.execute(
+            update(table).where(condition).values(**values).returning(table.c.date, table.c.type, table.c.amount)
+        ).all()
+    else:
+        rows = db.execute(select(table.c.date, table.c.type, table.c.amount).where(condition).with_for_update()).all()
+        db.execute(update(table).where(condition).values(**values))
+    deltas = defaultdict(lambda: [0, 0.0])
+    for day, type, amount in rows:
+        deltas[(day, type, not paid)][0] -= 1
+        deltas[(day, type, not paid)][1] -= amount or 0
+        deltas[(day, type, paid)][0] += 1
+        deltas[(day, type, paid)][1] += amount or 0
+    apply_cash_flow_deltas(db, deltas)
+    return len(rows)
+
+def _record_updates(db: Session, rows):
+    record_changes(db, [
+        {"professional_id": row.professional_id, "date": row.date, "appointment_id": row.id, "action": "update"}
+        for row in rows
+    ])
+
+@on_primary
 def update_appointment_status(db: Session, appointment_id: int, status: str):
+    # Retorna a linha atualizada (colunas de appointments) ou None
+    validate_status(status)
+    rows = _update_appointments(db, Appointment.__table__.c.id == appointment_id, {"status": status})
+    _record_updates(db, rows)
+    db.commit()
+    return rows[0] if rows else None
+
+@on_primary
+def bulk_update_status(db: Session, status: str, appointment_ids=None, professional_id: int = None,
+                       day: date = None):
+    # Por ids ou por profissional/dia (ex.: encerrar todas as consultas do Dr X hoje), numa transação.
+    # Consultas que já estão no status pedido não são tocadas; retorna as linhas alteradas
+    validate_status(status)
+    if appointment_ids is None and (professional_id is None or day is None):
+        raise ValueError("Informe as consultas ou o profissional e o dia")
+    if appointment_ids is not None and not appointment_ids:
+        return []
+    table = Appointment.__table__
+    condition = table.c.status.is_distinct_from(status)
+    if appointment_ids is not None:
+        condition &= table.c.id.in_(list(appointment_ids))
+    if professional_id is not None:
+        condition &= table.c.professional_id == professional_id
+    if day is not None:
+        condition &= table.c.date == day
+    rows = _update_appointments(db, condition, {"status": status})
+    _record_updates(db, rows)
+    db.commit()
+    return rows
+
+@on_primary
+def update_appointment(db: Session, appointment_id: int, **fields):
+    # Edição pelo formulário; pagamento continua passando por mark_payment
     appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
     if appointment:
-        appointment.status = status
+        if "status" in fields:
+            validate_status(fields["status"])
+        previous = (appointment.professional_id, appointment.date)
+        for name, value in fields.items():
+            setattr(appointment, name, value)
+        if fields.keys() & {"amount", "insurance_id", "date", "time", "patient_id"}:
+            _sync_cash_flow(db, appointment)
+        record_change(db, appointment.professional_id, appointment.date, appointment.id)
+        if previous != (appointment.professional_id, appointment.date):
+            record_change(db, previous[0], previous[1], appointment.id)
         db.commit()
         db.refresh(appointment)
+        if "notes" in fields:
+            index_notes(db, "appointment", appointment.id, appointment.notes)
     return appointment
 
-def mark_payment(db: Session, appointment_id: int, paid: bool):
+@on_primary
+def cancel_appointment(db: Session, appointment_id: int):
     appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
-    if appointment:
-        appointment.paid = paid
-        if paid and not appointment.insurance_id:
-            # Atualiza o caixa
-            cash_flow = (
-                db.query(CashFlow)
-                .filter(CashFlow.appointment_id == appointment_id)
-                .first()
-            )
-            if cash_flow:
-                cash_flow.paid = True
-                cash_flow.payment_date = date.today()
-        db.commit()
-        db.refresh(appointment)
-    return appointment
\ No newline at end of file
+    if appointment is None:
+        return False
+    # Remove os lançamentos vinculados e desconta do total diário
+    for cash_flow in db.query(CashFlow).filter(CashFlow.appointment_id == appointment_id):
+        apply_cash_flow_delta(db, cash_flow.date, cash_flow.type, bool(cash_flow.paid), -(cash_flow.amount or 0), -1)
+        db.delete(cash_flow)
+    # A consulta sai da agenda; o cancelamento fica nos fatos diários dos indicadores
+    apply_cancellation(db, appointment)
+    record_change(db, appointment.professional_id, appointment.date, appointment.id, "delete")
+    db.delete(appointment)
+    db.commit()
+    index_notes(db, "appointment", appointment_id, None)
+    return True
+
+@on_primary
+def mark_payment(db: Session, appointment_id: int, paid: bool, payment_method: str = None):
+    rows = bulk_mark_payment(db, [appointment_id], paid, payment_method)
+    return rows[0] if rows else None
+
+@on_primary
+def bulk_mark_payment(db: Session, appointment_ids, paid: bool = True, payment_method: str = None):
+    # Consultas e caixa na mesma transação; o caixa só é baixado para particulares
+    if payment_method and payment_method not in PAYMENT_METHODS:
+        raise ValueError(f"Forma de pagamento inválida: {payment_method}")
+    if not appointment_ids:
+        return []
+    values = {"paid": paid}
+    if payment_method:
+        values["payment_method"] = payment_method
+    rows = _update_appointments(db, Appointment.__table__.c.id.in_(list(appointment_ids)), values)
+    _settle_cash_flow(db, [row.id for row in rows if not row.insurance_id], paid)
+    _record_updates(db, rows)
+    db.commit()
+    return rows
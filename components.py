@@ -1,26 +1,76 @@
 import streamlit as st
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 import pandas as pd
+from utils import format_time
+from instrumentation import profiled
 
-def date_selector(default_date=None):
-    if default_date is None:
-        default_date = datetime.now().date()
+LIVE_REFRESH_SECONDS = 5
+WAITING_ROOM_REFRESH_SECONDS = 5
+
+def auto_refresh(seconds):
+    # st.fragment(run_every=...) só existe nas versões mais novas do Streamlit;
+    # nas antigas a função roda normalmente a cada interação
+    fragment = getattr(st, "fragment", None)
+    if fragment is None:
+        return lambda fn: fn
+    return fragment(run_every=seconds)
+
+def _fragment_rerun():
+    # Rerun só do fragmento (run_every): o script não passou pela sessão aberta em main
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return bool(ctx and getattr(ctx, "fragment_ids_this_run", None))
+
+@contextmanager
+def fragment_session(db=None):
+    # No rerun completo reaproveita a sessão do script (uma conexão por rerun);
+    # a sessão recebida fica fechada nos reruns isolados do fragmento, que abrem a sua
+    if db is not None and not _fragment_rerun():
+        yield db
+        return
+    from database import session_scope
+    with session_scope() as own:
+        yield own
+
+def _shift_date(key, days=0, months=0):
+    current = st.session_state[key]
+    if months:
+        month = current.month - 1 + months
+        current = current.replace(year=current.year + month // 12, month=month % 12 + 1, day=1)
+    st.session_state[key] = current + timedelta(days=days)
+
+def date_selector(default_date=None, step_days=1, step_months=0, key="selected_date"):
+    # A data fica no session_state para que as setas acumulem entre reruns
+    if key not in st.session_state:
+        st.session_state[key] = default_date or datetime.now().date()
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col1:
-        if st.button("◀️"):
-            default_date -= timedelta(days=1)
+        st.button("◀️", key=f"{key}_prev", on_click=_shift_date,
+                  args=(key, 0 if step_months else -step_days, -step_months))
     with col2:
-        selected_date = st.date_input("Data", value=default_date, label_visibility="collapsed")
+        selected_date = st.date_input("Data", key=key, label_visibility="collapsed")
     with col3:
-        if st.button("▶️"):
-            selected_date += timedelta(days=1)
+        st.button("▶️", key=f"{key}_next", on_click=_shift_date,
+                  args=(key, 0 if step_months else step_days, step_months))
     
     return selected_date
 
+def period_range(selected_date, period):
+    if period == "Semana":
+        start = selected_date - timedelta(days=selected_date.weekday())
+        return start, start + timedelta(days=6)
+    if period == "Mês":
+        start = selected_date.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    return selected_date, selected_date
+
+@profiled
 def professional_selector(db, selected_professional=None):
-    from .queries import get_professionals
-    professionals = get_professionals(db)
+    from cache import load_professionals
+    professionals = load_professionals(db)
     professional_names = [p.name for p in professionals]
     
     if selected_professional and selected_professional in professional_names:
@@ -36,40 +86,38 @@ def professional_selector(db, selected_professional=None):
     )
     return selected
 
-def schedule_grid(db, date, professional_name):
-    from .queries import get_appointments_by_date_and_professional
+def _schedule_cells(app):
+    if app is None:
+        return {"Paciente": "Disponível", "Convênio": "", "Status": "", "Pago": ""}
+    return {
+        "Paciente": app.patient_name,
+        "Convênio": app.insurance_name or "Particular",
+        "Status": app.status,
+        "Pago": "✅" if app.paid else "❌"
+    }
+
+@profiled
+def schedule_grid(db, date, professional_id):
+    from changes import live_schedule
+    from availability import day_slots
     
-    appointments = get_appointments_by_date_and_professional(db, date, professional_name)
-    appointments_dict = {app.time: app for app in appointments}
+    # Agenda guardada na sessão; só as consultas alteradas desde a última leitura são buscadas
+    appointments = live_schedule(db, st.session_state, date, professional_id)
+    appointments_dict = {format_time(app.time): app for app in appointments}
     
-    # Criar grade de horários
-    time_slots = [
-        "08:00", "08:30", "09:00", "09:30", "10:00", "10:30",
-        "11:00", "11:30", "12:00", "13:30", "14:00", "14:30",
-        "15:00", "15:30", "16:00", "16:30", "17:00", "17:30"
-    ]
+    # Grade do profissional para o dia, sem esconder consultas fora dela
+    time_slots = [format_time(slot) for slot in day_slots(db, professional_id, date)]
+    if not time_slots:
+        st.caption("Profissional sem atendimento neste dia da semana.")
+    time_slots = sorted(set(time_slots) | set(appointments_dict))
     
     data = []
     for time in time_slots:
-        if time in appointments_dict:
-            app = appointments_dict[time]
-            data.append({
-                "Horário": time,
-                "Paciente": app.patient.name,
-                "Convênio": app.insurance.name if app.insurance else "Particular",
-                "Status": app.status,
-                "Pago": "✅" if app.paid else "❌"
-            })
-        else:
-            data.append({
-                "Horário": time,
-                "Paciente": "Disponível",
-                "Convênio": "",
-                "Status": "",
-                "Pago": ""
-            })
-    
-    df = pd.DataFrame(data)
+        row = {"Horário": time}
+        row.update(_schedule_cells(appointments_dict.get(time)))
+        data.append(row)
+    
+    df = pd.DataFrame(data, columns=["Horário", "Paciente", "Convênio", "Status", "Pago"])
     st.dataframe(
         df,
         use_container_width=True,
@@ -83,4 +131,125 @@ def schedule_grid(db, date, professional_name):
         }
     )
     
-    return df, appointments_dict
\ No newline at end of file
+    return df, appointments_dict
+
+@profiled
+def clinic_schedule_grid(db, date, professional_ids=None):
+    from queries import get_clinic_schedule
+    from changes import live_schedule
+    
+    if professional_ids:
+        appointments = get_clinic_schedule(db, date, professional_ids)
+    else:
+        appointments = live_schedule(db, st.session_state, date)
+    
+    data = []
+    for app in appointments:
+        row = {"Profissional": app.professional_name, "Horário": format_time(app.time)}
+        row.update(_schedule_cells(app))
+        data.append(row)
+    
+    df = pd.DataFrame(data, columns=["Profissional", "Horário", "Paciente", "Convênio", "Status", "Pago"])
+    if df.empty:
+        st.info("Nenhuma consulta agendada para a clínica nesta data.")
+    else:
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    
+    return df
+
+
+WEEKDAY_LABELS = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+
+def _capacity_by_day(db, days, professional_ids):
+    # Horários disponíveis por dia segundo a grade semanal de cada profissional
+    from availability import weekly_templates
+    templates = weekly_templates(db)
+    per_weekday = pd.Series(0, index=range(7))
+    for professional_id in professional_ids:
+        for weekday, slots in templates.get(professional_id, {}).items():
+            per_weekday[weekday] += len(slots)
+    return pd.Series(days.dayofweek.map(per_weekday).to_numpy(), index=days)
+
+@profiled
+def calendar_view(db, start_date, end_date, professional_id=None):
+    from queries import ScheduleEntry, get_schedule_range
+    from availability import weekly_templates
+    from cache import load_professionals
+    
+    # Uma consulta para o período inteiro; o resto é pivot no pandas
+    rows = get_schedule_range(db, start_date, end_date, [professional_id] if professional_id else None)
+    df = pd.DataFrame.from_records(rows, columns=ScheduleEntry._fields)
+    days = pd.date_range(start_date, end_date, freq="D")
+    df["date"] = pd.to_datetime(df["date"])
+    df["Horário"] = df["time"].map(format_time)
+    
+    if professional_id:
+        slot_labels = sorted({
+            format_time(slot)
+            for slots in weekly_templates(db).get(professional_id, {}).values() for slot in slots
+        } | set(df["Horário"]))
+        grid = df.pivot_table(index="Horário", columns="date", values="patient_name", aggfunc="first")
+        capacity = _capacity_by_day(db, days, [professional_id])
+    else:
+        slot_labels = sorted(set(df["Horário"]))
+        grid = pd.crosstab(df["Horário"], df["date"])
+        professional_ids = [p.id for p in load_professionals(db)]
+        capacity = _capacity_by_day(db, days, professional_ids)
+    
+    grid = grid.reindex(index=slot_labels, columns=days)
+    grid = grid.fillna("") if professional_id else grid.fillna(0).astype(int)
+    booked = df.groupby("date").size().reindex(days, fill_value=0)
+    occupancy = pd.DataFrame({
+        "Consultas": booked,
+        "Capacidade": capacity,
+        "Ocupação (%)": (booked / capacity.where(capacity > 0)).mul(100).fillna(0).round().astype(int)
+    })
+    
+    labels = [f"{WEEKDAY_LABELS[d.dayofweek]} {d.strftime('%d/%m')}" for d in days]
+    grid.columns = labels
+    occupancy.index = labels
+    
+    st.dataframe(occupancy.T, use_container_width=True)
+    st.dataframe(grid, use_container_width=True)
+    return grid, occupancy
+
+@auto_refresh(LIVE_REFRESH_SECONDS)
+def schedule_watcher(db, date, professional_id=None):
+    # Recarrega a tela só quando a agenda exibida foi alterada em outra sessão
+    from changes import schedule_changed
+    with fragment_session(db) as db:
+        changed = schedule_changed(db, st.session_state, date, professional_id)
+    if changed:
+        st.rerun()
+
+WAITING_STATUSES = {"aguardando": "🟡 Aguardando", "em_consulta": "🟢 Em consulta"}
+
+@auto_refresh(WAITING_ROOM_REFRESH_SECONDS)
+def waiting_room_board(db, upcoming=8):
+    from changes import live_schedule
+    
+    today = date.today()
+    with fragment_session(db) as db:
+        entries = live_schedule(db, st.session_state, today)
+    now = datetime.now().time()
+    
+    col1, col2, col3 = st.columns(3)
+    for column, status in zip((col1, col2), WAITING_STATUSES):
+        with column:
+            st.markdown(f"### {WAITING_STATUSES[status]}")
+            rows = sorted((e for e in entries if e.status == status), key=lambda e: e.time)
+            for entry in rows:
+                st.markdown(f"**{format_time(entry.time)}** {entry.patient_name}  \n{entry.professional_name}")
+            if not rows:
+                st.caption("Ninguém")
+    with col3:
+        st.markdown("### ⏰ Próximos")
+        rows = sorted(
+            (e for e in entries if e.status == "agendado" and e.time and e.time >= now),
+            key=lambda e: e.time
+        )[:upcoming]
+        for entry in rows:
+            st.markdown(f"**{format_time(entry.time)}** {entry.patient_name}  \n{entry.professional_name}")
+        if not rows:
+            st.caption("Nenhuma consulta restante hoje")
+    st.caption(f"Atualizado às {datetime.now().strftime('%H:%M:%S')}")
@@ -1,32 +1,461 @@
+import itertools
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select
 from dotenv import load_dotenv
+from instrumentation import install as install_instrumentation
 
 
 load_dotenv()
 
-try:
-    DB_PORT = int(os.getenv("DB_PORT"))  # Converte para inteiro
-except (TypeError, ValueError):
-    raise ValueError("DB_PORT deve ser um número inteiro no arquivo .env")
+logger = logging.getLogger(__name__)
 
-DATABASE_URL = (
-    f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-    f"@{os.getenv('DB_HOST')}:{DB_PORT}/{os.getenv('DB_NAME')}"
-)
+REQUIRED_ENV_VARS = ['DB_USER', 'DB_PASSWORD', 'DB_HOST', 'DB_PORT', 'DB_NAME']
 
-engine = create_engine(DATABASE_URL, connect_args={'sslmode':'disable','client_encoding': 'utf8',
-        'options': '-c client_encoding=utf8'}, pool_size=10, max_overflow=20)
+# Depois de gravar, o mesmo cliente lê do primário por este tempo (atraso de replicação)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", 10))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG", 30))
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def get_database_url():
+    # DATABASE_URL permite apontar para outro banco (ex.: SQLite local)
+    if os.getenv("DATABASE_URL"):
+        return os.getenv("DATABASE_URL")
+
+    try:
+        db_port = int(os.getenv("DB_PORT"))  # Converte para inteiro
+    except (TypeError, ValueError):
+        raise ValueError("DB_PORT deve ser um número inteiro no arquivo .env")
+
+    return (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{db_port}/{os.getenv('DB_NAME')}"
+    )
+
+
+def get_replica_urls():
+    # DB_REPLICA_URLS: réplicas de leitura separadas por vírgula (opcional)
+    return [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def missing_env_vars():
+    if os.getenv("DATABASE_URL"):
+        return []
+    return [var for var in REQUIRED_ENV_VARS if not os.getenv(var)]
+
+
+class MeteredQueuePool(QueuePool):
+    # QueuePool que mede o tempo de espera por uma conexão livre
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self._metrics_lock:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts, pool.total_wait, pool.max_wait = self.checkouts, self.total_wait, self.max_wait
+        return pool
+
+
+def pool_setting(name: str, route: str = None, default: int = None):
+    # Configuração por rota: DB_REPLICA_POOL_SIZE vale para as réplicas, DB_POOL_SIZE para todas
+    for var in ([f"DB_{route.upper()}_{name}"] if route else []) + [f"DB_{name}"]:
+        if os.getenv(var):
+            return int(os.getenv(var))
+    return default
+
+
+def create_db_engine(url: str, pool_size: int = None, max_overflow: int = None, pool_timeout: int = None,
+                     route: str = None):
+    kwargs = {"pool_pre_ping": True}
+    if url.startswith("postgresql"):
+        kwargs["connect_args"] = {
+            'sslmode': os.getenv("DB_SSLMODE", "prefer"),
+            'client_encoding': 'utf8',
+            'options': '-c client_encoding=utf8'
+        }
+        if route:
+            # Réplica fora do ar não pode segurar a tela esperando conexão
+            kwargs["connect_args"]["connect_timeout"] = pool_setting("CONNECT_TIMEOUT", route, 3)
+    elif url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if url.startswith("sqlite") and (url.endswith(":memory:") or url == "sqlite://"):
+        engine = create_engine(url, **kwargs)
+    else:
+        engine = create_engine(
+            url,
+            poolclass=MeteredQueuePool,
+            pool_size=pool_size or pool_setting("POOL_SIZE", route, 10),
+            max_overflow=max_overflow if max_overflow is not None else pool_setting("MAX_OVERFLOW", route, 20),
+            pool_timeout=pool_timeout or pool_setting("POOL_TIMEOUT", route, 30),
+            **kwargs
+        )
+    install_instrumentation(engine)
+    return engine
+
+
+def replica_lag(conn):
+    # Atraso em segundos (0 se a réplica está em dia); None quando o banco não é uma réplica
+    if conn.dialect.name != "postgresql":
+        return None
+    return conn.execute(text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() THEN NULL "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )).scalar()
+
+
+class ReplicaSet:
+    # Réplicas de leitura com verificação periódica de saúde e atraso, numa thread própria:
+    # a escolha da réplica (a cada SELECT) nunca espera por uma verificação.
+    # Sem nenhuma réplica saudável as leituras voltam para o primário.
+    def __init__(self, engines, check_interval: float = REPLICA_CHECK_INTERVAL,
+                 max_lag: float = REPLICA_MAX_LAG_SECONDS):
+        self.engines = list(engines)
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._state = {id(engine): {"healthy": True, "lag": None, "checked_at": 0.0, "error": None}
+                       for engine in self.engines}
+        self._next = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        # Conexão perdida no meio de uma leitura: tira a réplica de uso até a próxima verificação
+        if context.is_disconnect and context.engine is not None:
+            self.mark_down(context.engine, context.original_exception)
+
+    def mark_down(self, engine, error):
+        state = self._state.get(id(engine))
+        if state and state["healthy"]:
+            logger.warning("Réplica %s fora de uso: %s", engine.url.host or engine.url.database, error)
+        if state:
+            state.update(healthy=False, error=str(error).splitlines()[0] if error else None,
+                         checked_at=time.monotonic())
+
+    def record(self, engine, lag=None, error=None):
+        # Resultado de uma verificação: atraso medido (None fora do PostgreSQL) ou erro de conexão
+        state = self._state[id(engine)]
+        healthy = error is None and (lag is None or lag <= self.max_lag)
+        if error is None and not healthy:
+            error = f"atraso de {lag:.0f}s"
+        if healthy != state["healthy"]:
+            log = logger.info if healthy else logger.warning
+            log("Réplica %s %s", engine.url.host or engine.url.database, "de volta" if healthy else f"fora de uso: {error}")
+        state.update(healthy=healthy, lag=lag, error=error, checked_at=time.monotonic())
+        return healthy
+
+    def check(self, engine):
+        try:
+            with engine.connect() as conn:
+                lag = replica_lag(conn)
+        except Exception as e:
+            return self.record(engine, error=str(e).splitlines()[0])
+        return self.record(engine, lag)
+
+    def check_all(self):
+        for engine in self.engines:
+            self.check(engine)
+
+    def start(self):
+        # Engines síncronos; a API assíncrona verifica as suas réplicas num laço do event loop
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check_all()
+            except Exception:
+                logger.exception("Falha na verificação das réplicas")
+            self._stop.wait(self.check_interval)
+
+    def choose(self):
+        # Rodízio entre as réplicas saudáveis segundo a última verificação
+        healthy = [e for e in self.engines if self._state[id(e)]["healthy"]]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def status(self):
+        return [
+            {
+                "replica": engine.url.render_as_string(hide_password=True),
+                "healthy": self._state[id(engine)]["healthy"],
+                "lag_s": self._state[id(engine)]["lag"],
+                "error": self._state[id(engine)]["error"],
+                **_pool_metrics(engine.pool),
+            }
+            for engine in self.engines
+        ]
+
+    def dispose(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval)
+        for engine in self.engines:
+            engine.dispose()
+
+
+_client = ContextVar("db_client", default=None)
+_last_writes = {}
+_last_writes_lock = threading.Lock()
+
+
+@contextmanager
+def client_scope(client_id):
+    # Identifica quem está usando a sessão (sessão do Streamlit, cliente da API) para o read-your-writes
+    token = _client.set(client_id)
+    try:
+        yield
+    finally:
+        _client.reset(token)
+
+
+def current_client():
+    return _client.get()
+
+
+def _record_write():
+    now = time.monotonic()
+    with _last_writes_lock:
+        _last_writes[_client.get()] = now
+        if len(_last_writes) > 1000:
+            for client, written_at in list(_last_writes.items()):
+                if now - written_at > READ_YOUR_WRITES_SECONDS:
+                    del _last_writes[client]
+
+
+def recently_wrote():
+    written_at = _last_writes.get(_client.get())
+    return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_SECONDS
+
+
+class RoutingSession(Session):
+    # SELECTs vão para uma réplica; escritas, SELECT ... FOR UPDATE, sessões em use_primary
+    # e clientes que gravaram há pouco (read-your-writes) ficam no primário
+    def __init__(self, *args, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replicas and self._reads_from_replica(clause):
+            replica = self.replicas.choose()
+            if replica is not None:
+                self.info["replica"] = replica
+                return replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        self.info.pop("replica", None)
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except OperationalError as e:
+            replica = self.info.pop("replica", None)
+            if replica is None or self.new or self.dirty or self.deleted:
+                raise
+            # Réplica caiu (ou cancelou a leitura) entre duas verificações: sai de uso e a mesma
+            # leitura é repetida uma vez no primário. A conexão perdida deixa a transação da sessão
+            # inválida; como a sessão ainda não gravou nada, o rollback só descarta leituras
+            self.replicas.mark_down(replica, e.orig)
+            self.rollback()
+            with use_primary(self):
+                return super().execute(statement, *args, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        return (
+            isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and not self._flushing
+            and not self.info.get("primary")
+            and not self.info.get("wrote")
+            and not recently_wrote()
+        )
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _track_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _track_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _after_commit(session):
+    if session.info.pop("wrote", False):
+        _record_write()
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("wrote", None)
+
+
+@contextmanager
+def use_primary(db: Session):
+    # Tudo o que a sessão executar dentro do bloco vai para o primário
+    previous = db.info.get("primary", False)
+    db.info["primary"] = True
+    try:
+        yield db
+    finally:
+        db.info["primary"] = previous
+
+
+def on_primary(fn):
+    # Para comandos: a leitura que antecede a escrita também precisa ser do primário
+    @wraps(fn)
+    def wrapper(db, *args, **kwargs):
+        with use_primary(db):
+            return fn(db, *args, **kwargs)
+    return wrapper
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
+_engine = None
+_replicas = None
+_engine_lock = threading.Lock()
+_initialized = False
+
+
+def _create_replicas(urls):
+    if not urls:
+        return None
+    return ReplicaSet([create_db_engine(url, route="replica") for url in urls]).start()
+
+
+def get_engine():
+    # Um único engine por processo, compartilhado por todos os reruns do Streamlit
+    global _engine, _replicas
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _replicas = _create_replicas(get_replica_urls())
+                _engine = create_db_engine(get_database_url())
+                SessionLocal.configure(bind=_engine, replicas=_replicas)
+    return _engine
+
+
+def get_replicas():
+    get_engine()
+    return _replicas
+
+
+def configure_engine(url: str, replica_urls=None, **pool_options):
+    # Troca o engine do processo (benchmarks, scripts e bancos locais)
+    global _engine, _replicas, _initialized
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        if _replicas is not None:
+            _replicas.dispose()
+        _engine = create_db_engine(url, **pool_options)
+        _replicas = _create_replicas(replica_urls)
+        _initialized = False
+        SessionLocal.configure(bind=_engine, replicas=_replicas)
+    return _engine
+
+
+def init_db(migrate: bool = False):
+    # Verificação da versão do schema (e da conexão): apenas uma vez por processo.
+    # As migrações são aplicadas por "python cli.py migrate"; migrate=True ou DB_AUTO_MIGRATE=1
+    # aplicam na hora (scripts, benchmarks, bancos locais)
+    global _initialized
+    if _initialized:
+        return
+    engine = get_engine()
+    with _engine_lock:
+        if _initialized:
+            return
+        from migrations import check_schema
+        check_schema(engine, apply=migrate or auto_migrate())
+        _initialized = True
+
+
+def auto_migrate():
+    return os.getenv("DB_AUTO_MIGRATE", "").lower() in ("1", "true", "sim")
+
+
+def _pool_metrics(pool):
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+    }
+    if isinstance(pool, MeteredQueuePool):
+        status.update({
+            "checkouts": pool.checkouts,
+            "wait_total_ms": round(pool.total_wait * 1000, 3),
+            "wait_avg_ms": round(pool.total_wait * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+            "wait_max_ms": round(pool.max_wait * 1000, 3),
+        })
+    return status
+
+
+def pool_status():
+    status = _pool_metrics(get_engine().pool)
+    if _replicas is not None:
+        status["replicas"] = _replicas.status()
+    return status
+
+
 def get_db():
+    get_engine()
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def session_scope():
+    # Sessão de um rerun: sempre fechada, com rollback em caso de erro
+    get_engine()
     db = SessionLocal()
     try:
         yield db
+    except Exception:
+        db.rollback()
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
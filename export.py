@@ -0,0 +1,198 @@
+import csv
+import io
+from datetime import date
+from sqlalchemy.orm import Session
+from models import Appointment, CashFlow, Insurance, Patient, Professional
+from partitions import source
+from utils import format_time
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def _cash_flow_columns(cash_flow=CashFlow):
+    return [
+        ("id", cash_flow.id, "int"),
+        ("date", cash_flow.date, "date"),
+        ("description", cash_flow.description, "str"),
+        ("type", cash_flow.type, "str"),
+        ("amount", cash_flow.amount, "float"),
+        ("paid", cash_flow.paid, "bool"),
+        ("payment_date", cash_flow.payment_date, "date"),
+        ("appointment_id", cash_flow.appointment_id, "int"),
+    ]
+
+
+def _appointment_columns(appointment=Appointment):
+    return [
+        ("id", appointment.id, "int"),
+        ("date", appointment.date, "date"),
+        ("time", appointment.time, "time"),
+        ("professional", Professional.name, "str"),
+        ("patient", Patient.name, "str"),
+        ("insurance", Insurance.name, "str"),
+        ("status", appointment.status, "str"),
+        ("paid", appointment.paid, "bool"),
+        ("payment_method", appointment.payment_method, "str"),
+        ("amount", appointment.amount, "float"),
+        ("notes", appointment.notes, "str"),
+    ]
+
+
+def export_columns(kind: str):
+    # (nome, tipo) de cada coluna exportada
+    if kind == "cash_flow":
+        columns = _cash_flow_columns()
+    elif kind == "appointments":
+        columns = _appointment_columns()
+    else:
+        raise ValueError(f"tipo de exportação desconhecido: {kind}")
+    return [(name, column_type) for name, _, column_type in columns]
+
+
+def export_query(db: Session, kind: str, start_date: date, end_date: date):
+    # Projeção (sem objetos ORM) ordenada, para ser lida em blocos por um cursor no servidor;
+    # períodos antigos incluem a tabela de arquivo
+    if kind == "cash_flow":
+        model = source(db, CashFlow, start_date, end_date)
+        query = db.query(*[c[1] for c in _cash_flow_columns(model)]).order_by(model.date, model.id)
+    elif kind == "appointments":
+        model = source(db, Appointment, start_date, end_date)
+        query = (
+            db.query(*[c[1] for c in _appointment_columns(model)])
+            .join(Professional, model.professional_id == Professional.id)
+            .join(Patient, model.patient_id == Patient.id)
+            .outerjoin(Insurance, model.insurance_id == Insurance.id)
+            .order_by(model.date, model.time, model.id)
+        )
+    else:
+        raise ValueError(f"tipo de exportação desconhecido: {kind}")
+    return query.filter(model.date >= start_date).filter(model.date <= end_date)
+
+
+def iter_export_chunks(db: Session, kind: str, start_date: date, end_date: date,
+                       chunk_size: int = EXPORT_CHUNK_SIZE, progress=None):
+    # stream_results usa cursor no servidor (psycopg2); no máximo chunk_size linhas ficam em memória
+    query = export_query(db, kind, start_date, end_date)
+    statement = query.statement.execution_options(stream_results=True, max_row_buffer=chunk_size)
+    result = db.execute(statement)
+    rows = 0
+    try:
+        for chunk in result.partitions(chunk_size):
+            rows += len(chunk)
+            if progress:
+                progress(rows)
+            yield chunk
+    finally:
+        result.close()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "sim" if value else "não"
+    if hasattr(value, "hour") and not hasattr(value, "year"):
+        return format_time(value)
+    return value
+
+
+def iter_csv(columns, chunks):
+    # Gera o CSV em pedaços de texto: o cabeçalho e depois um pedaço por bloco de linhas
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {
+        "int": pa.int64(), "float": pa.float64(), "str": pa.string(),
+        "bool": pa.bool_(), "date": pa.date32(), "time": pa.time64("us"),
+    }
+    return pa.schema([(name, types[column_type]) for name, column_type in columns])
+
+
+class _ByteSink(io.RawIOBase):
+    # Destino do ParquetWriter que acumula os bytes até serem entregues ao consumidor
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_parquet(columns, chunks):
+    # Um row group por bloco: o arquivo é escrito de forma incremental
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Exportação em Parquet requer o pacote pyarrow (pip install pyarrow)")
+    schema = _arrow_schema(columns)
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for rows in chunks:
+        data = {name: [row[i] for row in rows] for i, (name, _) in enumerate(columns)}
+        writer.write_table(pa.Table.from_pydict(data, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(db: Session, kind: str, start_date: date, end_date: date, fmt: str = "csv",
+                chunk_size: int = EXPORT_CHUNK_SIZE, progress=None):
+    # Bytes do arquivo exportado, prontos para gravar em disco ou enviar como download
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"formato de exportação desconhecido: {fmt}")
+    columns = export_columns(kind)
+    chunks = iter_export_chunks(db, kind, start_date, end_date, chunk_size, progress)
+    if fmt == "csv":
+        # BOM para o Excel reconhecer UTF-8 (acentos)
+        yield "\ufeff".encode("utf-8")
+        for text in iter_csv(columns, chunks):
+            yield text.encode("utf-8")
+    else:
+        yield from iter_parquet(columns, chunks)
+
+
+def export_to_file(db: Session, kind: str, start_date: date, end_date: date, target, fmt: str = "csv",
+                   chunk_size: int = EXPORT_CHUNK_SIZE, progress=None):
+    # target: caminho ou arquivo binário aberto; retorna a quantidade de linhas exportadas
+    if isinstance(target, (str, bytes)) or hasattr(target, "__fspath__"):
+        with open(target, "wb") as f:
+            return export_to_file(db, kind, start_date, end_date, f, fmt, chunk_size, progress)
+    exported = [0]
+
+    def count(rows):
+        exported[0] = rows
+        if progress:
+            progress(rows)
+
+    for data in iter_export(db, kind, start_date, end_date, fmt, chunk_size, count):
+        target.write(data)
+    return exported[0]
+
+
+def export_filename(kind: str, start_date: date, end_date: date, fmt: str):
+    return f"{kind}_{start_date.isoformat()}_{end_date.isoformat()}.{fmt}"
@@ -0,0 +1,323 @@
+import csv
+import io
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+from models import APPOINTMENT_STATUSES, PAYMENT_METHODS, Professional, Patient, Insurance, Appointment, CashFlow
+from cache import invalidate_professionals, invalidate_patients
+from reports import apply_cash_flow_deltas
+from changes import record_changes
+from search import normalize, phone_digits, reset_notes_index, reset_patient_index
+from utils import format_time, parse_time
+from database import on_primary
+
+IMPORT_CHUNK_SIZE = 1000
+TRUE_VALUES = {"1", "s", "sim", "true", "t", "x", "y", "yes", "pago"}
+
+
+class ImportReport:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.rows = 0
+        self.inserted = 0
+        self.errors = []  # (linha, mensagem)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, line: int, message: str):
+        self.errors.append((line, message))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.kind}: {self.rows} linhas lidas, {self.inserted} inseridas, "
+            f"{len(self.errors)} com erro em {self.elapsed:.1f}s ({self.rows_per_second:,.0f} linhas/s)"
+        )
+
+
+def read_csv_chunks(stream, chunk_size: int = IMPORT_CHUNK_SIZE):
+    # Lê o CSV em blocos de (número da linha, dict); aceita ',' ou ';' como separador
+    header = stream.readline()
+    if not header:
+        return
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.DictReader(itertools.chain([header], stream), delimiter=delimiter)
+    reader.fieldnames = [normalize(name).replace(" ", "_") for name in reader.fieldnames]
+    chunk = []
+    for row in reader:
+        chunk.append((reader.line_num, row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _text(row, field, required=False):
+    value = (row.get(field) or "").strip()
+    if required and not value:
+        raise ValueError(f"campo '{field}' é obrigatório")
+    return value or None
+
+
+def _date(value):
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data inválida: {value}")
+
+
+def _amount(value):
+    if not value:
+        return None
+    number = value.replace("R$", "").strip()
+    if "," in number:
+        # Formato brasileiro: 1.250,00
+        number = number.replace(".", "").replace(",", ".")
+    try:
+        return float(number)
+    except ValueError:
+        raise ValueError(f"valor inválido: {value}")
+
+
+def parse_patient(row):
+    return {
+        "name": _text(row, "name", required=True),
+        "phone": _text(row, "phone", required=True),
+        "email": _text(row, "email"),
+        "birth_date": _date(_text(row, "birth_date")),
+        "notes": _text(row, "notes"),
+    }
+
+
+def parse_professional(row):
+    return {
+        "name": _text(row, "name", required=True),
+        "specialty": _text(row, "specialty", required=True),
+        "active": True,
+    }
+
+
+class ReferenceMaps:
+    # Resolve nomes do CSV para ids com um único SELECT por tabela
+    def __init__(self, db: Session):
+        self.db = db
+        self.professionals = {normalize(name): pid for pid, name in db.query(Professional.id, Professional.name)}
+        self.insurances = {normalize(name): iid for iid, name in db.query(Insurance.id, Insurance.name)}
+        self._patients_by_key = None
+        self._patients_by_name = None
+
+    def _load_patients(self):
+        self._patients_by_key = {}
+        self._patients_by_name = defaultdict(list)
+        for pid, name, phone in self.db.query(Patient.id, Patient.name, Patient.phone).yield_per(5000):
+            self._patients_by_key[(normalize(name), phone_digits(phone))] = pid
+            self._patients_by_name[normalize(name)].append(pid)
+
+    def professional(self, name):
+        try:
+            return self.professionals[normalize(name)]
+        except KeyError:
+            raise ValueError(f"profissional não encontrado: {name}")
+
+    def insurance(self, name):
+        if not name or normalize(name) == "particular":
+            return None
+        try:
+            return self.insurances[normalize(name)]
+        except KeyError:
+            raise ValueError(f"convênio não encontrado: {name}")
+
+    def patient(self, row):
+        patient_id = _text(row, "patient_id")
+        if patient_id:
+            return int(patient_id)
+        name = _text(row, "patient", required=True)
+        if self._patients_by_key is None:
+            self._load_patients()
+        phone = phone_digits(_text(row, "patient_phone"))
+        if phone and (normalize(name), phone) in self._patients_by_key:
+            return self._patients_by_key[(normalize(name), phone)]
+        matches = self._patients_by_name.get(normalize(name), [])
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            raise ValueError(f"paciente ambíguo, informe patient_phone ou patient_id: {name}")
+        raise ValueError(f"paciente não encontrado: {name}")
+
+
+def parse_appointment(row, maps: ReferenceMaps):
+    status = _text(row, "status") or "agendado"
+    if status not in APPOINTMENT_STATUSES:
+        raise ValueError(f"status inválido: {status}")
+    payment_method = _text(row, "payment_method")
+    if payment_method and payment_method not in PAYMENT_METHODS:
+        raise ValueError(f"forma de pagamento inválida: {payment_method}")
+    insurance_id = maps.insurance(_text(row, "insurance"))
+    return {
+        "date": _date(_text(row, "date", required=True)),
+        "time": parse_time(_text(row, "time", required=True)),
+        "professional_id": maps.professional(_text(row, "professional", required=True)),
+        "patient_id": maps.patient(row),
+        "insurance_id": insurance_id,
+        "status": status,
+        "payment_method": payment_method,
+        "paid": (_text(row, "paid") or "").lower() in TRUE_VALUES,
+        "amount": _amount(_text(row, "amount")) if insurance_id is None else None,
+        "notes": _text(row, "notes"),
+    }
+
+
+def _uses_copy(db: Session):
+    bind = db.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+def _copy_rows(db: Session, table, rows):
+    # COPY ... FROM STDIN via psycopg2, bem mais rápido que INSERTs no PostgreSQL
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def insert_rows(db: Session, model, rows):
+    if not rows:
+        return
+    if _uses_copy(db):
+        _copy_rows(db, model.__table__, rows)
+    else:
+        db.execute(insert(model.__table__), rows)  # executemany
+
+
+def allocate_ids(db: Session, model, count: int):
+    # Reserva ids antecipadamente para ligar o caixa às consultas sem RETURNING por linha.
+    # Sem sequência (max(id)+1) só é seguro sem outras escritas simultâneas (ex.: gerador de benchmark)
+    table = model.__table__.name
+    if db.get_bind().dialect.name == "postgresql":
+        result = db.execute(
+            text(f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) FROM generate_series(1, :n)"),
+            {"n": count},
+        )
+        return [row[0] for row in result]
+    start = db.query(func.coalesce(func.max(model.id), 0)).scalar() + 1
+    return list(range(start, start + count))
+
+
+def _cash_flow_for(appointment):
+    if appointment["insurance_id"] is not None or not appointment["amount"]:
+        return None
+    return {
+        "date": appointment["date"],
+        "description": f"Consulta {appointment['patient_id']} - {format_time(appointment['time'])}",
+        "amount": appointment["amount"],
+        "payment_date": appointment["date"] if appointment["paid"] else None,
+        "paid": appointment["paid"],
+        "appointment_id": appointment["id"],
+        "type": "entrada",
+    }
+
+
+def _store_appointments(db: Session, rows):
+    if db.get_bind().dialect.name == "postgresql":
+        for row, appointment_id in zip(rows, allocate_ids(db, Appointment, len(rows))):
+            row["id"] = appointment_id
+        insert_rows(db, Appointment, rows)
+    else:
+        # Sem sequência o banco atribui os ids: max(id)+1 colidiria com consultas marcadas durante a importação
+        table = Appointment.__table__
+        for row in rows:
+            row["id"] = db.execute(insert(table).values(**row)).inserted_primary_key[0]
+    cash_flows = [cf for cf in (_cash_flow_for(row) for row in rows) if cf]
+    insert_rows(db, CashFlow, cash_flows)
+    deltas = defaultdict(lambda: [0, 0.0])
+    for cf in cash_flows:
+        delta = deltas[(cf["date"], cf["type"], cf["paid"])]
+        delta[0] += 1
+        delta[1] += cf["amount"]
+    apply_cash_flow_deltas(db, deltas)
+    # Um registro por agenda afetada: as sessões abertas recarregam esses dias inteiros
+    record_changes(db, [
+        {"professional_id": professional_id, "date": day, "appointment_id": None, "action": "import"}
+        for professional_id, day in sorted({(row["professional_id"], row["date"]) for row in rows})
+    ])
+
+
+def _store_chunk(db: Session, store, parsed, report: ImportReport):
+    if not parsed:
+        return
+    try:
+        store(db, [row for _, row in parsed])
+        db.commit()
+        report.inserted += len(parsed)
+        return
+    except Exception:
+        db.rollback()
+    # O lote falhou: insere linha a linha para isolar as linhas com problema
+    for line, row in parsed:
+        # Ids atribuídos ao lote desfeito pelo rollback não valem mais
+        row.pop("id", None)
+        try:
+            with db.begin_nested():
+                store(db, [row])
+            report.inserted += 1
+        except Exception as e:
+            report.error(line, (str(getattr(e, "orig", e)).splitlines() or [type(e).__name__])[0])
+    db.commit()
+
+
+@on_primary
+def run_import(db: Session, kind: str, stream, chunk_size: int = IMPORT_CHUNK_SIZE, progress=None):
+    report = ImportReport(kind)
+    if kind == "patients":
+        parse, store = parse_patient, lambda db, rows: insert_rows(db, Patient, rows)
+    elif kind == "professionals":
+        parse, store = parse_professional, lambda db, rows: insert_rows(db, Professional, rows)
+    elif kind == "appointments":
+        maps = ReferenceMaps(db)
+        parse, store = (lambda row: parse_appointment(row, maps)), _store_appointments
+    else:
+        raise ValueError(f"tipo de importação desconhecido: {kind}")
+
+    for chunk in read_csv_chunks(stream, chunk_size):
+        parsed = []
+        for line, row in chunk:
+            report.rows += 1
+            try:
+                parsed.append((line, parse(row)))
+            except ValueError as e:
+                report.error(line, str(e))
+        _store_chunk(db, store, parsed, report)
+        if progress:
+            progress(report)
+
+    if kind == "patients":
+        reset_patient_index(db)
+        reset_notes_index(db)
+        invalidate_patients()
+    elif kind == "professionals":
+        invalidate_professionals()
+    elif kind == "appointments":
+        reset_notes_index(db)
+    return report.finish()
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Mesma instrução repetida esta quantidade de vezes numa seção indica N+1
+N_PLUS_ONE_THRESHOLD = 5
+DEFAULT_SECTION = "render"
+
+_current = ContextVar("sql_profile", default=None)
+
+
+def log_enabled():
+    return os.getenv("SQL_PROFILE_LOG", "").lower() in ("1", "true", "sim")
+
+
+def _normalize(statement: str):
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class QueryProfile:
+    # Instruções executadas durante um rerun, agrupadas pela função de tela que as disparou
+    def __init__(self, name: str = DEFAULT_SECTION):
+        self.name = name
+        self.sections = [DEFAULT_SECTION]
+        self.statements = []  # (seção, sql, duração em s, linhas ou None)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def section(self):
+        return self.sections[-1]
+
+    def record(self, statement, duration, rows):
+        self.statements.append((self.section, statement, duration, rows))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def _stats(self, statements):
+        durations = [s[2] for s in statements]
+        rows = [s[3] for s in statements if s[3] is not None]
+        return {
+            "statements": len(statements),
+            "total_ms": round(sum(durations) * 1000, 3),
+            "p95_ms": round(_percentile(durations, 0.95) * 1000, 3),
+            "rows": sum(rows) if rows else None,
+        }
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        counts = Counter((section, sql) for section, sql, _, _ in self.statements)
+        return [
+            {"section": section, "count": count, "statement": sql[:300]}
+            for (section, sql), count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def by_section(self):
+        grouped = defaultdict(list)
+        for statement in self.statements:
+            grouped[statement[0]].append(statement)
+        return {section: self._stats(statements) for section, statements in grouped.items()}
+
+    def summary(self):
+        return {
+            "rerun": self.name,
+            "elapsed_ms": round(self.elapsed * 1000, 3),
+            **self._stats(self.statements),
+            "sections": self.by_section(),
+            "n_plus_one": self.repeated(),
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None or not conn.info.get("query_started"):
+        return
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    # rowcount de SELECT só é conhecido em alguns drivers (psycopg2 sim, sqlite3 não)
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    profile.record(_normalize(statement), duration, rows)
+
+
+def install(engine):
+    # Os eventos ficam sempre registrados; sem perfil ativo custam uma leitura de ContextVar.
+    # Verifica no próprio engine: o id() de um engine descartado pode ser reutilizado por um novo
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def profile_rerun(name: str = DEFAULT_SECTION, enabled: bool = True):
+    if not enabled:
+        yield None
+        return
+    profile = QueryProfile(name)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        profile.finish()
+        if log_enabled():
+            summary = profile.summary()
+            logger.info(json.dumps(summary, ensure_ascii=False))
+            for pattern in summary["n_plus_one"]:
+                logger.warning("Possível N+1 em %s: %s execuções de %s",
+                               pattern["section"], pattern["count"], pattern["statement"])
+
+
+@contextmanager
+def section(name: str):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    profile.sections.append(name)
+    try:
+        yield
+    finally:
+        profile.sections.pop()
+
+
+def profiled(fn):
+    # Atribui as instruções executadas dentro da função à seção com o nome dela
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return fn(*args, **kwargs)
+        with section(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
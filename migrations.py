@@ -0,0 +1,155 @@
+import logging
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.orm import Session
+from database import Base
+from models import (
+    AppointmentDaily, AppointmentDailySync, BillingBatch, BillingItem, CashFlow, CashFlowDaily, Insurance, ReminderLog,
+    SchemaVersion
+)
+from reports import rebuild_cash_flow_rollup
+from reservations import ensure_slot_constraint
+from search import ensure_notes_search_index, ensure_patient_search_index
+
+logger = logging.getLogger(__name__)
+
+# Migrações em ordem; cada uma roda na sua própria transação e fica registrada em schema_version.
+# Devem ser idempotentes: bancos antigos (sem schema_version) recebem todas desde a primeira.
+MIGRATIONS = []
+MIGRATION_LOCK_ID = 7310427  # pg_advisory_xact_lock: dois "migrate" simultâneos não se atropelam
+
+
+class SchemaOutdatedError(RuntimeError):
+    def __init__(self, current: int, latest: int):
+        self.current = current
+        self.latest = latest
+        super().__init__(
+            f"Banco na versão {current or 0} do schema e a aplicação espera a versão {latest}. "
+            "Execute: python cli.py migrate"
+        )
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migração {version} fora de ordem")
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def _create_indexes(conn, names):
+    # Índices declarados nos modelos; no PostgreSQL particionado o índice vale para todas as partições
+    indexes = {index.name: index for table in Base.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+@migration(1, "Tabelas iniciais")
+def _initial_schema(conn):
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2, "Horário como TIME e índice único de horário")
+def _slot_constraint(conn):
+    ensure_slot_constraint(conn)
+
+
+@migration(3, "Busca de pacientes por trigramas (PostgreSQL)")
+def _patient_search(conn):
+    ensure_patient_search_index(conn)
+
+
+@migration(4, "Índices das chaves estrangeiras e da agenda por profissional/paciente")
+def _foreign_key_indexes(conn):
+    _create_indexes(conn, [
+        "ix_appointments_professional_date",
+        "ix_appointments_patient_date",
+        "ix_cash_flow_appointment_id",
+    ])
+
+
+@migration(5, "Registro de lembretes de consulta")
+def _reminder_log(conn):
+    ReminderLog.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, "Busca textual nas observações (PostgreSQL)")
+def _notes_search(conn):
+    ensure_notes_search_index(conn)
+
+
+@migration(7, "Valor por consulta dos convênios e lotes de faturamento")
+def _insurance_billing(conn):
+    columns = {column["name"] for column in inspect(conn).get_columns(Insurance.__tablename__)}
+    if "fee" not in columns:
+        conn.execute(text("ALTER TABLE insurances ADD COLUMN fee FLOAT"))
+    BillingBatch.__table__.create(conn, checkfirst=True)
+    BillingItem.__table__.create(conn, checkfirst=True)
+
+
+@migration(8, "Fatos diários das consultas para os indicadores")
+def _appointment_facts(conn):
+    # Os fatos são calculados na primeira abertura dos indicadores (ou: python cli.py rebuild-appointment-facts)
+    AppointmentDaily.__table__.create(conn, checkfirst=True)
+    AppointmentDailySync.__table__.create(conn, checkfirst=True)
+
+
+@migration(9, "Carga da consolidação diária do caixa")
+def _cash_flow_rollup(conn):
+    # Bancos anteriores à consolidação têm cash_flow_daily vazia e o Caixa mostraria R$ 0
+    if conn.execute(select(CashFlowDaily.date).limit(1)).first() is not None:
+        return
+    if conn.execute(select(CashFlow.id).limit(1)).first() is None:
+        return
+    with Session(bind=conn) as db:
+        rebuild_cash_flow_rollup(db)
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    # None quando o banco ainda não tem a tabela de versões
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return None
+    return conn.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+
+def pending_migrations(conn):
+    current = schema_version(conn) or 0
+    return [(version, name) for version, name, _ in MIGRATIONS if version > current]
+
+
+def migrate(engine, target: int = None, progress=None):
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            SchemaVersion.__table__.create(conn, checkfirst=True)
+            if (schema_version(conn) or 0) >= version:
+                continue
+            logger.info("Aplicando migração %s: %s", version, name)
+            if progress:
+                progress(version, name)
+            fn(conn)
+            conn.execute(insert(SchemaVersion).values(version=version, name=name))
+        applied.append((version, name))
+    return applied
+
+
+def check_schema(engine, apply: bool = False):
+    # Uma consulta na inicialização do processo. Banco vazio recebe as migrações na hora;
+    # banco existente desatualizado só com apply=True (senão: python cli.py migrate)
+    with engine.connect() as conn:
+        current = schema_version(conn)
+        empty = current is None and not inspect(conn).get_table_names()
+    if current is not None and current >= latest_version():
+        return current
+    if apply or empty:
+        migrate(engine)
+        return latest_version()
+    raise SchemaOutdatedError(current, latest_version())
@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, Time, Float, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from database import Base
 
+APPOINTMENT_STATUSES = ["agendado", "aguardando", "em_consulta", "encerrado", "faltou"]
+PAYMENT_METHODS = ["Dinheiro", "Cartão Débito", "Cartão Crédito", "PIX", "Transferência"]
+
 class Professional(Base):
     __tablename__ = "professionals"
     id = Column(Integer, primary_key=True, index=True)
@@ -11,6 +15,18 @@ class Professional(Base):
     
     appointments = relationship("Appointment", back_populates="professional")
 
+class WorkingHours(Base):
+    # Grade de atendimento semanal de cada profissional
+    __tablename__ = "working_hours"
+    id = Column(Integer, primary_key=True, index=True)
+    professional_id = Column(Integer, ForeignKey("professionals.id"), index=True)
+    weekday = Column(Integer)  # 0 = segunda ... 6 = domingo
+    start_time = Column(Time)
+    end_time = Column(Time)
+    slot_minutes = Column(Integer, default=30)
+    break_start = Column(Time, nullable=True)
+    break_end = Column(Time, nullable=True)
+
 class Patient(Base):
     __tablename__ = "patients"
     id = Column(Integer, primary_key=True, index=True)
@@ -27,25 +43,34 @@ class Insurance(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     active = Column(Boolean, default=True)
+    fee = Column(Float, nullable=True)  # valor faturado por consulta quando a consulta não tem valor próprio
 
 class Appointment(Base):
     __tablename__ = "appointments"
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, index=True)
-    time = Column(String, index=True)
+    time = Column(Time, index=True)
     professional_id = Column(Integer, ForeignKey("professionals.id"))
     patient_id = Column(Integer, ForeignKey("patients.id"))
     insurance_id = Column(Integer, ForeignKey("insurances.id"), nullable=True)
-    status = Column(String, default="agendado")  # agendado, aguardando, em_consulta, encerrado
+    status = Column(String, default="agendado")  # agendado, aguardando, em_consulta, encerrado, faltou
     payment_method = Column(String, nullable=True)
     paid = Column(Boolean, default=False)
     amount = Column(Float, nullable=True)
     notes = Column(String, nullable=True)
-    created_at = Column(DateTime, server_default='now()')
+    created_at = Column(DateTime, server_default=func.now())
     
     professional = relationship("Professional", back_populates="appointments")
     patient = relationship("Patient", back_populates="appointments")
     insurance = relationship("Insurance")
+    
+    # Um profissional não pode ter duas consultas no mesmo horário
+    __table_args__ = (
+        Index("uq_appointments_slot", "professional_id", "date", "time", unique=True),
+        # Agenda do profissional mesmo em bancos onde o índice único não pôde ser criado (duplicados)
+        Index("ix_appointments_professional_date", "professional_id", "date"),
+        Index("ix_appointments_patient_date", "patient_id", "date"),
+    )
 
 class CashFlow(Base):
     __tablename__ = "cash_flow"
@@ -55,5 +80,106 @@ class CashFlow(Base):
     amount = Column(Float)
     payment_date = Column(Date, nullable=True)
     paid = Column(Boolean, default=False)
-    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=True)
-    type = Column(String)  # entrada, saida
\ No newline at end of file
+    appointment_id = Column(Integer, ForeignKey("appointments.id"), nullable=True, index=True)
+    type = Column(String)  # entrada, saida
+
+class CashFlowDaily(Base):
+    # Totais diários do caixa, mantidos de forma incremental pelos comandos
+    __tablename__ = "cash_flow_daily"
+    date = Column(Date, primary_key=True)
+    type = Column(String, primary_key=True)
+    paid = Column(Boolean, primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0)
+
+class AppointmentDaily(Base):
+    # Fatos diários das consultas para os indicadores (analytics.py), recalculados por dia alterado.
+    # Consultas canceladas são apagadas da agenda: ficam só aqui, como status "cancelado"
+    __tablename__ = "appointment_daily"
+    date = Column(Date, primary_key=True)
+    professional_id = Column(Integer, primary_key=True)
+    insurance_id = Column(Integer, primary_key=True)  # 0 = particular
+    status = Column(String, primary_key=True)
+    appointments = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0)  # valor da consulta ou do convênio
+    received = Column(Float, nullable=False, default=0)  # caixa já pago das consultas particulares
+
+class AppointmentDailySync(Base):
+    # Última mudança da agenda (schedule_changes) já aplicada aos fatos diários
+    __tablename__ = "appointment_daily_sync"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    last_change_id = Column(Integer, nullable=False, default=0)
+    refreshed_at = Column(DateTime, server_default=func.now())
+
+class ScheduleChange(Base):
+    # Log de alterações da agenda: as sessões abertas leem só o que mudou desde a última leitura
+    __tablename__ = "schedule_changes"
+    id = Column(Integer, primary_key=True)
+    professional_id = Column(Integer, index=True)
+    date = Column(Date)
+    appointment_id = Column(Integer, nullable=True)  # None = recarregar a agenda inteira do dia
+    action = Column(String)  # insert, update, delete, import
+    changed_at = Column(DateTime, server_default=func.now(), index=True)
+
+class SchemaVersion(Base):
+    # Migrações já aplicadas (migrations.py)
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String)
+    applied_at = Column(DateTime, server_default=func.now())
+
+class ReminderLog(Base):
+    # Lembretes de consulta (reminders.py): uma linha por consulta, tipo de lembrete e data marcada,
+    # gravada antes do envio, para que ninguém receba o mesmo lembrete duas vezes
+    __tablename__ = "reminder_log"
+    id = Column(Integer, primary_key=True)
+    appointment_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # vespera, 2h, ...
+    appointment_date = Column(Date, nullable=False)  # remarcada para outro dia = novo lembrete
+    channel = Column(String)  # whatsapp, email
+    recipient = Column(String)
+    status = Column(String, nullable=False)  # pendente, enviado, falhou
+    attempts = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("uq_reminder_log_appointment", "appointment_id", "kind", "appointment_date", unique=True),
+    )
+
+class BillingBatch(Base):
+    # Lote de faturamento de um convênio no mês (billing.py); retomado do ponto salvo se interrompido
+    __tablename__ = "billing_batches"
+    id = Column(Integer, primary_key=True)
+    insurance_id = Column(Integer, ForeignKey("insurances.id"), nullable=False)
+    month = Column(Date, nullable=False)  # primeiro dia do mês faturado
+    sequence = Column(Integer, nullable=False, default=1)  # consultas encerradas depois geram novo lote
+    format = Column(String, nullable=False)  # csv, xml
+    status = Column(String, nullable=False)  # gerando, faturado, recebido
+    file_path = Column(String)
+    appointments = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+    last_appointment_id = Column(Integer, nullable=False, default=0)  # ponto de retomada
+    file_offset = Column(Integer, nullable=False, default=0)  # bytes do arquivo já confirmados
+    created_at = Column(DateTime, server_default=func.now())
+    finished_at = Column(DateTime, nullable=True)
+    received_at = Column(Date, nullable=True)
+    received_amount = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("uq_billing_batches_sequence", "insurance_id", "month", "sequence", unique=True),
+    )
+
+class BillingItem(Base):
+    # Consultas já incluídas em um lote: cada consulta é faturada uma única vez
+    __tablename__ = "billing_items"
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(Integer, ForeignKey("billing_batches.id"), nullable=False, index=True)
+    appointment_id = Column(Integer, nullable=False)
+    appointment_date = Column(Date, nullable=False)
+    amount = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("uq_billing_items_appointment", "appointment_id", unique=True),
+    )
@@ -0,0 +1,281 @@
+import logging
+import re
+import threading
+import time
+from datetime import date
+from sqlalchemy import Column, Index, MetaData, Table, inspect, select, text, union_all
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.schema import AddConstraint
+from models import Appointment, CashFlow
+
+logger = logging.getLogger(__name__)
+
+# Tabelas que crescem com o tempo: no PostgreSQL particionadas por mês (coluna date);
+# anos encerrados vão para a tabela <nome>_archive, fora das consultas do dia a dia
+PARTITIONED_MODELS = [Appointment, CashFlow]
+FUTURE_MONTHS = 3
+KEEP_YEARS = 2  # ano atual e o anterior ficam na tabela principal
+ARCHIVE_CHECK_INTERVAL = 300.0  # segundos entre releituras do limite do arquivo
+
+archive_metadata = MetaData()
+
+
+def _archive_table(model):
+    # Mesmas colunas, sem chaves estrangeiras nem índice único de horário
+    table = model.__table__
+    return Table(
+        f"{table.name}_archive", archive_metadata,
+        *[Column(column.name, column.type) for column in table.columns],
+        Index(f"ix_{table.name}_archive_date", "date"),
+    )
+
+
+ARCHIVE_TABLES = {model: _archive_table(model) for model in PARTITIONED_MODELS}
+
+_archived_until = {}
+_archived_lock = threading.Lock()
+
+
+def partition_name(table_name: str, month: date):
+    return f"{table_name}_{month.year}_{month.month:02d}"
+
+
+def _month(day: date):
+    return day.replace(day=1)
+
+
+def _next_month(month: date):
+    return date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def _months(first: date, last: date):
+    month = _month(first)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+
+def _add_months(day: date, months: int):
+    month = _month(day)
+    for _ in range(months):
+        month = _next_month(month)
+    return month
+
+
+def is_partitioned(conn, table_name: str):
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": table_name}).scalar() is not None
+
+
+def list_partitions(conn, table_name: str):
+    # {mês: nome} das partições mensais (as criadas por este módulo)
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name AND pg_table_is_visible(p.oid)"
+    ), {"name": table_name}).scalars()
+    pattern = re.compile(rf"^{re.escape(table_name)}_(\d{{4}})_(\d{{2}})$")
+    partitions = {}
+    for name in rows:
+        match = pattern.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def _create_partition(conn, table_name: str, month: date):
+    name = partition_name(table_name, month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    default = f"{table_name}_default"
+    in_default = conn.execute(text(
+        f"SELECT 1 FROM {default} WHERE date >= :start AND date < :end LIMIT 1"
+    ), {"start": month, "end": _next_month(month)}).scalar()
+    if not in_default:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table_name} FOR VALUES {bounds}"))
+        return name
+    # Linhas do mês caíram na partição padrão: move antes de anexar a nova partição
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE date >= :start AND date < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"start": month, "end": _next_month(month)})
+    conn.execute(text(f"ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    return name
+
+
+def _convert(conn, model, future_months: int):
+    # Recria a tabela como particionada por mês e copia os dados (uma única transação)
+    table = model.__table__
+    name, staging = table.name, f"{table.name}_partitioned"
+    missing = conn.execute(text(f"SELECT count(*) FROM {name} WHERE date IS NULL")).scalar()
+    if missing:
+        raise ValueError(f"{name}: {missing} registros sem data; corrija antes de particionar")
+    first, last = conn.execute(text(f"SELECT min(date), max(date) FROM {name}")).one()
+    today = date.today()
+    first, last = min(first or today, today), max(last or today, _add_months(today, future_months))
+
+    conn.execute(text(f"CREATE TABLE {staging} (LIKE {name} INCLUDING DEFAULTS) PARTITION BY RANGE (date)"))
+    conn.execute(text(f"ALTER TABLE {staging} ALTER COLUMN date SET NOT NULL"))
+    conn.execute(text(f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY (id, date)"))
+    conn.execute(text(f"CREATE TABLE {name}_default PARTITION OF {staging} DEFAULT"))
+    for month in _months(first, last):
+        conn.execute(text(
+            f"CREATE TABLE {partition_name(name, month)} PARTITION OF {staging} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        ))
+    conn.execute(text(f"INSERT INTO {staging} SELECT * FROM {name}"))
+    conn.execute(text(f"ALTER SEQUENCE IF EXISTS {name}_id_seq OWNED BY {staging}.id"))
+    # Chaves estrangeiras que apontam para a tabela antiga (cash_flow.appointment_id) deixam de existir:
+    # uma tabela particionada só pode ser referenciada pela chave completa (id, date)
+    conn.execute(text(f"DROP TABLE {name} CASCADE"))
+    conn.execute(text(f"ALTER TABLE {staging} RENAME TO {name}"))
+    conn.execute(text(f"ALTER INDEX {staging}_pkey RENAME TO {name}_pkey"))
+    for index in table.indexes:
+        index.create(conn)
+    partitioned = {m.__tablename__ for m in PARTITIONED_MODELS}
+    for constraint in table.foreign_key_constraints:
+        if constraint.referred_table.name not in partitioned:
+            conn.execute(AddConstraint(constraint))
+
+
+def partition_tables(engine, future_months: int = FUTURE_MONTHS):
+    # Conversão única (PostgreSQL); no SQLite as tabelas continuam simples e só o arquivo se aplica
+    if engine.dialect.name != "postgresql":
+        return []
+    converted = []
+    for model in PARTITIONED_MODELS:
+        with engine.begin() as conn:
+            if is_partitioned(conn, model.__tablename__):
+                continue
+            logger.info("Particionando %s por mês", model.__tablename__)
+            _convert(conn, model, future_months)
+            converted.append(model.__tablename__)
+    return converted
+
+
+def create_future_partitions(engine, months: int = FUTURE_MONTHS):
+    created = []
+    if engine.dialect.name != "postgresql":
+        return created
+    today = date.today()
+    with engine.begin() as conn:
+        for model in PARTITIONED_MODELS:
+            name = model.__tablename__
+            if not is_partitioned(conn, name):
+                continue
+            existing = list_partitions(conn, name)
+            for month in _months(today, _add_months(today, months)):
+                if month not in existing:
+                    created.append(_create_partition(conn, name, month))
+    return created
+
+
+def _ensure_archive(conn, model):
+    archive = ARCHIVE_TABLES[model]
+    if inspect(conn).has_table(archive.name):
+        return archive
+    if is_partitioned(conn, model.__tablename__):
+        # Arquivo também particionado: as partições frias mudam de tabela sem copiar dados
+        conn.execute(text(
+            f"CREATE TABLE {archive.name} (LIKE {model.__tablename__} INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+        ))
+        conn.execute(text(f"CREATE TABLE {archive.name}_default PARTITION OF {archive.name} DEFAULT"))
+    else:
+        archive.create(conn)
+    return archive
+
+
+def _move_rows(conn, model, archive, cutoff: date):
+    # Cópia + remoção na mesma transação; consultas ainda referenciadas por lançamentos
+    # do caixa que continuam na tabela principal ficam onde estão (chave estrangeira)
+    table = model.__table__
+    condition = table.c.date < cutoff
+    if model is Appointment and not is_partitioned(conn, CashFlow.__tablename__):
+        cash_flow = CashFlow.__table__
+        referenced = select(cash_flow.c.id).where(cash_flow.c.appointment_id == table.c.id).exists()
+        condition = condition & ~referenced
+    conn.execute(archive.insert().from_select([c.name for c in table.columns], select(*table.columns).where(condition)))
+    return conn.execute(table.delete().where(condition)).rowcount
+
+
+def _move_partitions(conn, name: str, archive_name: str, cutoff: date):
+    moved = 0
+    for month, partition in sorted(list_partitions(conn, name).items()):
+        if _next_month(month) > cutoff:
+            continue
+        conn.execute(text(f"ALTER TABLE {name} DETACH PARTITION {partition}"))
+        conn.execute(text(
+            f"ALTER TABLE {archive_name} ATTACH PARTITION {partition} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        ))
+        moved += 1
+    # Datas antigas que ficaram fora das partições mensais (partição padrão)
+    moved += conn.execute(text(
+        f"WITH moved AS (DELETE FROM {name}_default WHERE date < :cutoff RETURNING *) "
+        f"INSERT INTO {archive_name} SELECT * FROM moved"
+    ), {"cutoff": cutoff}).rowcount
+    return moved
+
+
+def archive_before(engine, cutoff: date):
+    # Move para o arquivo tudo que for anterior a cutoff; retorna {tabela: partições + linhas movidas}
+    moved = {}
+    # cash_flow antes de appointments por causa da chave estrangeira nas tabelas simples
+    for model in reversed(PARTITIONED_MODELS):
+        name = model.__tablename__
+        with engine.begin() as conn:
+            archive = _ensure_archive(conn, model)
+            if is_partitioned(conn, name) and is_partitioned(conn, archive.name):
+                count = _move_partitions(conn, name, archive.name, cutoff)
+            else:
+                count = _move_rows(conn, model, archive, cutoff)
+        if count:
+            moved[name] = count
+    invalidate_archive_boundary()
+    return moved
+
+
+def archive_cold_years(engine, keep_years: int = KEEP_YEARS):
+    cutoff = date(date.today().year - keep_years + 1, 1, 1)
+    return cutoff, archive_before(engine, cutoff)
+
+
+def invalidate_archive_boundary():
+    with _archived_lock:
+        _archived_until.clear()
+
+
+def archived_until(db: Session, model):
+    # Data mais recente já arquivada (None se não houver arquivo); lida no máximo a cada intervalo
+    archive = ARCHIVE_TABLES[model]
+    cached = _archived_until.get(archive.name)
+    if cached and time.monotonic() - cached[1] < ARCHIVE_CHECK_INTERVAL:
+        return cached[0]
+    boundary = None
+    if inspect(db.connection()).has_table(archive.name):
+        boundary = db.execute(select(archive.c.date).order_by(archive.c.date.desc()).limit(1)).scalar()
+    with _archived_lock:
+        _archived_until[archive.name] = (boundary, time.monotonic())
+    return boundary
+
+
+def source(db: Session, model, start_date: date = None, end_date: date = None):
+    # Entidade para consultas por período: a própria tabela quando o período não chega ao arquivo,
+    # senão a união das duas (já filtrada por data em cada lado, para podar partições e índices)
+    boundary = archived_until(db, model)
+    if boundary is None or (start_date is not None and start_date > boundary):
+        return model
+    archive = ARCHIVE_TABLES[model]
+    parts = []
+    for table in (model.__table__, archive):
+        part = select(*[table.c[column.name] for column in model.__table__.columns])
+        if start_date is not None:
+            part = part.where(table.c.date >= start_date)
+        if end_date is not None:
+            part = part.where(table.c.date <= end_date)
+        parts.append(part)
+    return aliased(model, union_all(*parts).subquery(f"{model.__tablename__}_all"), adapt_on_names=True)
@@ -1,19 +1,73 @@
+from collections import namedtuple
 from sqlalchemy.orm import Session
-from models import Professional, Patient, Insurance, Appointment, CashFlow
+from models import Professional, Patient, Insurance, Appointment, CashFlow, WorkingHours
 from datetime import date
+from search import search_patients, patient_columns
+from partitions import source
+
+# Modelos de leitura: tuplas imutáveis só com as colunas que as telas usam.
+# Não passam pelo identity map da sessão; objetos ORM ficam para edição.
+ProfessionalRef = namedtuple("ProfessionalRef", ["id", "name", "specialty"])
+InsuranceRef = namedtuple("InsuranceRef", ["id", "name"])
+WorkingHoursRef = namedtuple(
+    "WorkingHoursRef",
+    ["professional_id", "weekday", "start_time", "end_time", "slot_minutes", "break_start", "break_end"]
+)
+PatientRef = namedtuple("PatientRef", ["id", "name", "phone", "email", "birth_date", "notes"])
+ScheduleEntry = namedtuple("ScheduleEntry", [
+    "id", "date", "time", "professional_id", "professional_name", "patient_id", "patient_name",
+    "insurance_id", "insurance_name", "status", "paid", "payment_method", "amount"
+])
+CashFlowEntry = namedtuple("CashFlowEntry", ["id", "date", "description", "type", "amount", "paid", "payment_date"])
+
+def _read(db: Session, query, model):
+    # Executa a projeção e monta as tuplas direto do resultado
+    return [model._make(row) for row in db.execute(query.statement)]
 
 def get_professionals(db: Session):
+    # Objetos ORM: apenas para edição
     return db.query(Professional).filter(Professional.active == True).order_by(Professional.name).all()
 
-def get_patients(db: Session, search: str = None):
-    query = db.query(Patient)
+def list_professionals(db: Session):
+    query = (
+        db.query(Professional.id, Professional.name, Professional.specialty)
+        .filter(Professional.active == True)
+        .order_by(Professional.name)
+    )
+    return _read(db, query, ProfessionalRef)
+
+def get_patients(db: Session, search: str = None, limit: int = None, offset: int = 0):
+    # Com termo de busca usa o índice (trigram ou em memória) e ordena por relevância
     if search:
-        query = query.filter(Patient.name.ilike(f"%{search}%"))
-    return query.order_by(Patient.name).all()
+        return [PatientRef._make(row) for row in search_patients(db, search, limit=limit, offset=offset)]
+    query = db.query(*patient_columns()).order_by(Patient.name, Patient.id).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return _read(db, query, PatientRef)
+
+def get_patient_ref(db: Session, patient_id: int):
+    rows = _read(db, db.query(*patient_columns()).filter(Patient.id == patient_id), PatientRef)
+    return rows[0] if rows else None
 
 def get_insurances(db: Session):
+    # Objetos ORM: apenas para edição
     return db.query(Insurance).filter(Insurance.active == True).order_by(Insurance.name).all()
 
+def list_insurances(db: Session):
+    query = db.query(Insurance.id, Insurance.name).filter(Insurance.active == True).order_by(Insurance.name)
+    return _read(db, query, InsuranceRef)
+
+def list_working_hours(db: Session):
+    query = db.query(
+        WorkingHours.professional_id, WorkingHours.weekday, WorkingHours.start_time,
+        WorkingHours.end_time, WorkingHours.slot_minutes, WorkingHours.break_start,
+        WorkingHours.break_end
+    ).order_by(WorkingHours.professional_id, WorkingHours.weekday, WorkingHours.start_time)
+    return _read(db, query, WorkingHoursRef)
+
+def get_appointment(db: Session, appointment_id: int):
+    return db.query(Appointment).filter(Appointment.id == appointment_id).first()
+
 def get_appointments_by_date_and_professional(db: Session, date: date, professional_name: str):
     return (
         db.query(Appointment)
@@ -24,11 +78,81 @@ def get_appointments_by_date_and_professional(db: Session, date: date, professio
         .all()
     )
 
-def get_cash_flow(db: Session, start_date: date, end_date: date):
+def _schedule_query(db: Session, appointment=Appointment):
+    # Projeção única (consulta + nomes) sem carregar objetos ORM nem disparar lazy loads.
+    # appointment: a tabela ou a união com o arquivo (partitions.source)
     return (
-        db.query(CashFlow)
-        .filter(CashFlow.date >= start_date)
-        .filter(CashFlow.date <= end_date)
-        .order_by(CashFlow.date)
-        .all()
-    )
\ No newline at end of file
+        db.query(
+            appointment.id,
+            appointment.date,
+            appointment.time,
+            appointment.professional_id,
+            Professional.name.label("professional_name"),
+            appointment.patient_id,
+            Patient.name.label("patient_name"),
+            appointment.insurance_id,
+            Insurance.name.label("insurance_name"),
+            appointment.status,
+            appointment.paid,
+            appointment.payment_method,
+            appointment.amount,
+        )
+        .join(Professional, Professional.id == appointment.professional_id)
+        .outerjoin(Patient, Patient.id == appointment.patient_id)
+        .outerjoin(Insurance, Insurance.id == appointment.insurance_id)
+    )
+
+# Todas as leituras da agenda filtram por data: no PostgreSQL só as partições do período são lidas
+
+def get_day_schedule(db: Session, date: date, professional_id: int):
+    appointment = source(db, Appointment, date, date)
+    query = (
+        _schedule_query(db, appointment)
+        .filter(appointment.date == date)
+        .filter(appointment.professional_id == professional_id)
+        .order_by(appointment.time)
+    )
+    return _read(db, query, ScheduleEntry)
+
+def get_schedule_entries(db: Session, appointment_ids, dates=None):
+    # dates: dias em que as consultas estão (quando conhecidos), para podar as partições
+    if not appointment_ids:
+        return []
+    query = _schedule_query(db).filter(Appointment.id.in_(list(appointment_ids)))
+    if dates:
+        query = query.filter(Appointment.date.in_(list(dates)))
+    return _read(db, query, ScheduleEntry)
+
+def get_clinic_schedule(db: Session, date: date, professional_ids: list = None):
+    appointment = source(db, Appointment, date, date)
+    query = _schedule_query(db, appointment).filter(appointment.date == date)
+    if professional_ids:
+        query = query.filter(appointment.professional_id.in_(professional_ids))
+    return _read(db, query.order_by(Professional.name, appointment.time), ScheduleEntry)
+
+def get_schedule_range(db: Session, start_date: date, end_date: date, professional_ids: list = None):
+    appointment = source(db, Appointment, start_date, end_date)
+    query = (
+        _schedule_query(db, appointment)
+        .filter(appointment.date >= start_date)
+        .filter(appointment.date <= end_date)
+    )
+    if professional_ids:
+        query = query.filter(appointment.professional_id.in_(professional_ids))
+    return _read(db, query.order_by(appointment.date, appointment.time), ScheduleEntry)
+
+def get_cash_flow(db: Session, start_date: date, end_date: date, limit: int = None, offset: int = 0):
+    cash_flow = source(db, CashFlow, start_date, end_date)
+    query = (
+        db.query(
+            cash_flow.id, cash_flow.date, cash_flow.description, cash_flow.type,
+            cash_flow.amount, cash_flow.paid, cash_flow.payment_date
+        )
+        .filter(cash_flow.date >= start_date)
+        .filter(cash_flow.date <= end_date)
+        .order_by(cash_flow.date, cash_flow.id)
+        .offset(offset)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return _read(db, query, CashFlowEntry)
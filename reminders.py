@@ -0,0 +1,535 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import smtplib
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from sqlalchemy import and_, bindparam, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import on_primary
+from models import Appointment, Patient, Professional, ReminderLog
+from utils import format_time
+
+logger = logging.getLogger(__name__)
+
+# Envio em lotes: cada lote é reservado no reminder_log (commit), enviado em paralelo e registrado
+REMINDER_CHUNK_SIZE = 2000
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", 50))
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", 100))  # mensagens por segundo, por canal
+REMINDER_RETRIES = int(os.getenv("REMINDER_RETRIES", 3))
+REMINDER_BACKOFF = 1.0  # segundos; dobra a cada nova tentativa
+REMINDER_CHANNELS = ("whatsapp", "email")
+
+PENDING, SENT, FAILED = "pendente", "enviado", "falhou"
+
+CLINIC_NAME = os.getenv("CLINIC_NAME", "Clínica")
+SUBJECT_TEMPLATE = "Lembrete de consulta - {date} às {time}"
+MESSAGE_TEMPLATE = (
+    "Olá, {patient}! Lembramos da sua consulta com {professional} ({specialty}) "
+    "em {weekday}, {date}, às {time}. Em caso de imprevisto, avise a {clinic} com antecedência."
+)
+WEEKDAYS = ["segunda-feira", "terça-feira", "quarta-feira", "quinta-feira", "sexta-feira", "sábado", "domingo"]
+
+Reminder = namedtuple("Reminder", [
+    "appointment_id", "date", "time", "patient_name", "phone", "email", "professional_name", "specialty"
+])
+Message = namedtuple("Message", ["appointment_id", "date", "channel", "recipient", "subject", "body", "params"])
+
+
+class DeliveryError(Exception):
+    # Falha informada pelo transporte; retry=False para erros definitivos (número ou e-mail inválido)
+    def __init__(self, message: str, retry: bool = True, retry_after: float = None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+def reminder_window(hours: int = None, now: datetime = None):
+    # (início, fim, tipo): o dia seguinte inteiro ou as próximas N horas
+    now = now or datetime.now()
+    if hours is None:
+        start = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return start, start + timedelta(days=1), "vespera"
+    return now, now + timedelta(hours=hours), f"{hours}h"
+
+
+def due_reminders(db: Session, start: datetime, end: datetime, kind: str):
+    # Uma consulta: consultas agendadas na janela que ainda não receberam este lembrete
+    # (ou cujo envio anterior falhou), já com os contatos do paciente e o nome do profissional
+    sent = and_(
+        ReminderLog.appointment_id == Appointment.id,
+        ReminderLog.kind == kind,
+        ReminderLog.appointment_date == Appointment.date,
+    )
+    after_start = or_(
+        Appointment.date > start.date(), and_(Appointment.date == start.date(), Appointment.time >= start.time())
+    )
+    before_end = or_(Appointment.date < end.date(), and_(Appointment.date == end.date(), Appointment.time < end.time()))
+    rows = (
+        db.query(
+            Appointment.id, Appointment.date, Appointment.time, Patient.name, Patient.phone, Patient.email,
+            Professional.name, Professional.specialty
+        )
+        .join(Patient, Appointment.patient_id == Patient.id)
+        .join(Professional, Appointment.professional_id == Professional.id)
+        .outerjoin(ReminderLog, sent)
+        .filter(Appointment.date >= start.date(), Appointment.date <= end.date(), after_start, before_end)
+        .filter(Appointment.status == "agendado")
+        .filter(or_(ReminderLog.id.is_(None), ReminderLog.status == FAILED))
+        .order_by(Appointment.date, Appointment.time, Appointment.id)
+        .all()
+    )
+    return [Reminder._make(row) for row in rows]
+
+
+def whatsapp_number(phone: str):
+    # Só dígitos, com DDI 55 quando o número foi cadastrado com DDD apenas
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) in (10, 11):
+        digits = "55" + digits
+    return digits if len(digits) >= 12 else None
+
+
+def _recipient(reminder: Reminder, channel: str):
+    if channel == "whatsapp":
+        return whatsapp_number(reminder.phone)
+    if channel == "email":
+        email = (reminder.email or "").strip()
+        return email if "@" in email else None
+    return None
+
+
+def render_message(reminder: Reminder, channel: str, recipient: str,
+                   template: str = MESSAGE_TEMPLATE, subject: str = SUBJECT_TEMPLATE):
+    params = {
+        "patient": reminder.patient_name.split()[0] if reminder.patient_name else "",
+        "professional": reminder.professional_name or "",
+        "specialty": reminder.specialty or "",
+        "weekday": WEEKDAYS[reminder.date.weekday()],
+        "date": reminder.date.strftime("%d/%m/%Y"),
+        "time": format_time(reminder.time),
+        "clinic": CLINIC_NAME,
+    }
+    return Message(
+        reminder.appointment_id, reminder.date, channel, recipient,
+        subject.format(**params), template.format(**params), params
+    )
+
+
+def build_messages(reminders, channels=REMINDER_CHANNELS):
+    # Primeiro canal da lista para o qual o paciente tem contato; sem contato vai para skipped
+    messages, skipped = [], []
+    for reminder in reminders:
+        for channel in channels:
+            recipient = _recipient(reminder, channel)
+            if recipient:
+                messages.append(render_message(reminder, channel, recipient))
+                break
+        else:
+            skipped.append(reminder)
+    return messages, skipped
+
+
+class Transport:
+    # Interface dos transportes: send() levanta DeliveryError (ou erro de rede) quando não entrega
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send(self, message: Message):
+        raise NotImplementedError
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class FileTransport(Transport):
+    # Transporte local para testes: grava cada mensagem como uma linha JSON (path=None descarta).
+    # latency e failure_rate simulam um provedor real em testes de carga
+    def __init__(self, path: str = None, latency: float = 0.0, failure_rate: float = 0.0):
+        self.path = path
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._file = None
+
+    async def open(self):
+        if self.path:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    async def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    async def send(self, message: Message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise DeliveryError("falha simulada")
+        if self._file:
+            record = message._asdict()
+            record["date"] = message.date.isoformat()
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class SMTPTransport(Transport):
+    # smtplib em threads, com até `connections` conexões reaproveitadas entre as mensagens
+    def __init__(self, host: str, port: int = 587, user: str = None, password: str = None,
+                 sender: str = None, starttls: bool = True, connections: int = 4, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.starttls = starttls
+        self.connections = connections
+        self.timeout = timeout
+        self._idle = None
+        self._slots = None
+
+    @classmethod
+    def from_env(cls):
+        if not os.getenv("SMTP_HOST"):
+            raise ValueError("Configure SMTP_HOST (e SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_SENDER) no .env")
+        return cls(
+            os.getenv("SMTP_HOST"),
+            int(os.getenv("SMTP_PORT", 587)),
+            os.getenv("SMTP_USER"),
+            os.getenv("SMTP_PASSWORD"),
+            os.getenv("SMTP_SENDER"),
+            os.getenv("SMTP_STARTTLS", "1") != "0",
+        )
+
+    async def open(self):
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.connections)
+
+    async def close(self):
+        idle, self._idle = self._idle or [], []
+        for conn in idle:
+            await asyncio.to_thread(self._quit, conn)
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            conn.starttls()
+        if self.user:
+            conn.login(self.user, self.password)
+        return conn
+
+    @staticmethod
+    def _quit(conn):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    def _deliver(self, conn, message: Message):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message.recipient
+        email["Subject"] = message.subject
+        email.set_content(message.body)
+        if conn is None:
+            conn = self._connect()
+        try:
+            conn.send_message(email)
+        except smtplib.SMTPRecipientsRefused as e:
+            self._idle.append(conn)
+            raise DeliveryError(f"destinatário recusado: {e.recipients}", retry=False)
+        except smtplib.SMTPResponseException as e:
+            self._idle.append(conn)
+            raise DeliveryError(f"SMTP {e.smtp_code}: {e.smtp_error!r}", retry=e.smtp_code < 500)
+        except (smtplib.SMTPException, OSError):
+            conn.close()  # conexão perdida: a próxima tentativa abre outra
+            raise
+        self._idle.append(conn)
+
+    async def send(self, message: Message):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            await asyncio.to_thread(self._deliver, conn, message)
+
+
+class WhatsAppTransport(Transport):
+    # WhatsApp Business (Cloud API) via httpx. Fora da janela de 24h a Meta só aceita templates
+    # aprovados: com template, os parâmetros vão na ordem paciente, profissional, data, hora
+    def __init__(self, token: str, phone_number_id: str, api_url: str = "https://graph.facebook.com/v19.0",
+                 template: str = None, language: str = "pt_BR", timeout: float = 15):
+        self.token = token
+        self.phone_number_id = phone_number_id
+        self.api_url = api_url.rstrip("/")
+        self.template = template
+        self.language = language
+        self.timeout = timeout
+        self._client = None
+
+    @classmethod
+    def from_env(cls):
+        if not os.getenv("WHATSAPP_TOKEN") or not os.getenv("WHATSAPP_PHONE_NUMBER_ID"):
+            raise ValueError("Configure WHATSAPP_TOKEN e WHATSAPP_PHONE_NUMBER_ID no .env")
+        return cls(
+            os.getenv("WHATSAPP_TOKEN"),
+            os.getenv("WHATSAPP_PHONE_NUMBER_ID"),
+            os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v19.0"),
+            os.getenv("WHATSAPP_TEMPLATE") or None,
+            os.getenv("WHATSAPP_LANGUAGE", "pt_BR"),
+        )
+
+    async def open(self):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("Lembretes por WhatsApp requerem o pacote httpx (pip install httpx)")
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url, timeout=self.timeout, headers={"Authorization": f"Bearer {self.token}"},
+            limits=httpx.Limits(max_connections=REMINDER_CONCURRENCY),
+        )
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def _payload(self, message: Message):
+        payload = {"messaging_product": "whatsapp", "to": message.recipient}
+        if not self.template:
+            payload.update(type="text", text={"body": message.body})
+            return payload
+        values = [message.params[name] for name in ("patient", "professional", "date", "time")]
+        payload.update(type="template", template={
+            "name": self.template,
+            "language": {"code": self.language},
+            "components": [{"type": "body", "parameters": [{"type": "text", "text": v} for v in values]}],
+        })
+        return payload
+
+    async def send(self, message: Message):
+        response = await self._client.post(f"/{self.phone_number_id}/messages", json=self._payload(message))
+        if response.status_code < 300:
+            return
+        retry_after = response.headers.get("retry-after")
+        raise DeliveryError(
+            f"WhatsApp {response.status_code}: {response.text[:200]}",
+            retry=response.status_code == 429 or response.status_code >= 500,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+        )
+
+
+def transport_from_env(channel: str):
+    if channel == "email":
+        return SMTPTransport.from_env()
+    if channel == "whatsapp":
+        return WhatsAppTransport.from_env()
+    raise ValueError(f"Canal de lembrete desconhecido: {channel}")
+
+
+class RateLimiter:
+    # Balde de fichas: no máximo `rate` envios por segundo, com rajadas de até `burst`
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ReminderDispatcher:
+    # Envia mensagens em paralelo pelos transportes de cada canal, com limite de taxa e novas tentativas
+    def __init__(self, transports: dict, concurrency: int = REMINDER_CONCURRENCY, rate: float = REMINDER_RATE,
+                 retries: int = REMINDER_RETRIES, backoff: float = REMINDER_BACKOFF):
+        self.transports = transports
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self._limiters = {channel: RateLimiter(rate) for channel in transports}
+
+    async def deliver(self, message: Message):
+        # (status, tentativas, erro)
+        transport, limiter = self.transports[message.channel], self._limiters[message.channel]
+        attempt = 0
+        while True:
+            attempt += 1
+            await limiter.acquire()
+            try:
+                await transport.send(message)
+                return SENT, attempt, None
+            except DeliveryError as e:
+                error, retry, delay = str(e), e.retry, e.retry_after
+            except Exception as e:
+                # Rede, timeout, conexão derrubada: transitórios
+                error, retry, delay = f"{type(e).__name__}: {e}", True, None
+            if not retry or attempt > self.retries:
+                return FAILED, attempt, error[:500]
+            await asyncio.sleep(delay or self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+
+    async def send_all(self, messages):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(message):
+            async with semaphore:
+                return await self.deliver(message)
+
+        return await asyncio.gather(*[one(message) for message in messages])
+
+
+def _claim(db: Session, kind: str, messages):
+    # Reserva as mensagens no log antes do envio; devolve {appointment_id: id do log} só das que
+    # este processo pode enviar (outra execução pode ter reservado ou enviado antes).
+    # Reservas "pendente" de uma execução interrompida não são reenviadas: o envio pode ter ocorrido
+    rows = [{
+        "appointment_id": m.appointment_id, "kind": kind, "appointment_date": m.date,
+        "channel": m.channel, "recipient": m.recipient, "status": PENDING, "attempts": 0,
+    } for m in messages]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(ReminderLog).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ReminderLog.appointment_id, ReminderLog.kind, ReminderLog.appointment_date],
+            set_={"status": PENDING, "channel": stmt.excluded.channel, "recipient": stmt.excluded.recipient},
+            where=ReminderLog.status == FAILED,
+        ).returning(ReminderLog.appointment_id, ReminderLog.id)
+        claimed = dict(db.execute(stmt).all())
+    else:
+        claimed = {}
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    result = db.execute(ReminderLog.__table__.insert().values(**row))
+                claimed[row["appointment_id"]] = result.inserted_primary_key[0]
+            except IntegrityError:
+                log = (
+                    db.query(ReminderLog)
+                    .filter_by(appointment_id=row["appointment_id"], kind=kind, appointment_date=row["appointment_date"])
+                    .filter(ReminderLog.status == FAILED)
+                    .with_for_update()
+                    .first()
+                )
+                if log is not None:
+                    log.status, log.channel, log.recipient = PENDING, row["channel"], row["recipient"]
+                    claimed[row["appointment_id"]] = log.id
+    db.commit()
+    return claimed
+
+
+def _record(db: Session, log_ids, results):
+    if not log_ids:
+        return
+    table = ReminderLog.__table__
+    stmt = table.update().where(table.c.id == bindparam("log_id")).values(
+        status=bindparam("new_status"),
+        attempts=table.c.attempts + bindparam("new_attempts"),
+        error=bindparam("new_error"),
+        sent_at=bindparam("new_sent_at"),
+    )
+    now = datetime.now()
+    db.execute(stmt, [
+        {"log_id": log_id, "new_status": status, "new_attempts": attempts, "new_error": error,
+         "new_sent_at": now if status == SENT else None}
+        for log_id, (status, attempts, error) in zip(log_ids, results)
+    ])
+    db.commit()
+
+
+class ReminderReport:
+    def __init__(self, kind: str, start: datetime, end: datetime):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.due = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0  # paciente sem telefone/e-mail válido para os canais configurados
+        self.claimed_elsewhere = 0
+        self.channels = {}
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def per_second(self):
+        return (self.sent + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        channels = ", ".join(f"{channel}: {count}" for channel, count in sorted(self.channels.items()))
+        return (
+            f"Lembretes '{self.kind}' de {self.start:%d/%m/%Y %H:%M} a {self.end:%d/%m/%Y %H:%M}: "
+            f"{self.due} pendentes, {self.sent} enviados ({channels or '-'}), {self.failed} com falha, "
+            f"{self.skipped} sem contato, {self.claimed_elsewhere} já reservados por outra execução "
+            f"em {self.elapsed:.1f}s ({self.per_second:,.0f}/s)"
+        )
+
+
+@on_primary
+def send_reminders(db: Session, transports: dict, start: datetime, end: datetime, kind: str,
+                   channels=None, dispatcher: ReminderDispatcher = None,
+                   chunk_size: int = REMINDER_CHUNK_SIZE, progress=None):
+    # transports: {canal: Transport}; channels: ordem de preferência (padrão: a ordem de transports)
+    report = ReminderReport(kind, start, end)
+    reminders = due_reminders(db, start, end, kind)
+    db.commit()
+    report.due = len(reminders)
+    messages, skipped = build_messages(reminders, channels or list(transports))
+    report.skipped = len(skipped)
+    dispatcher = dispatcher or ReminderDispatcher(transports)
+
+    # O mesmo transporte pode atender mais de um canal (ex.: FileTransport em testes)
+    unique = list({id(t): t for t in transports.values()}.values())
+
+    async def run():
+        for transport in unique:
+            await transport.open()
+        try:
+            for i in range(0, len(messages), chunk_size):
+                chunk = messages[i:i + chunk_size]
+                claimed = _claim(db, kind, chunk)
+                report.claimed_elsewhere += len(chunk) - len(claimed)
+                chunk = [m for m in chunk if m.appointment_id in claimed]
+                results = await dispatcher.send_all(chunk)
+                _record(db, [claimed[m.appointment_id] for m in chunk], results)
+                failures = []
+                for message, (status, _, error) in zip(chunk, results):
+                    if status == SENT:
+                        report.sent += 1
+                        report.channels[message.channel] = report.channels.get(message.channel, 0) + 1
+                    else:
+                        failures.append((message.appointment_id, error))
+                report.failed += len(failures)
+                if failures:
+                    logger.warning("%s lembretes não enviados no lote (consulta %s: %s)", len(failures), *failures[0])
+                if progress:
+                    progress(report)
+        finally:
+            for transport in unique:
+                await transport.close()
+
+    asyncio.run(run())
+    return report.finish()
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import func, insert, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import CashFlow, CashFlowDaily
+from partitions import source as with_archive
+from database import on_primary
+
+
+def _upsert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(CashFlowDaily)
+    if dialect == "sqlite":
+        return sqlite.insert(CashFlowDaily)
+    return None
+
+
+def apply_cash_flow_delta(db: Session, day: date, type: str, paid: bool, amount: float, entries: int = 1):
+    # Atualiza o total diário dentro da transação do comando (sem commit)
+    stmt = _upsert(db)
+    if stmt is None:
+        row = db.get(CashFlowDaily, (day, type, paid))
+        if row is None:
+            db.add(CashFlowDaily(date=day, type=type, paid=paid, entries=entries, amount=amount))
+        else:
+            row.entries += entries
+            row.amount += amount
+        return
+    stmt = stmt.values(date=day, type=type, paid=paid, entries=entries, amount=amount)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[CashFlowDaily.date, CashFlowDaily.type, CashFlowDaily.paid],
+        set_={
+            "entries": CashFlowDaily.entries + stmt.excluded.entries,
+            "amount": CashFlowDaily.amount + stmt.excluded.amount,
+        },
+    ))
+
+
+def apply_cash_flow_deltas(db: Session, deltas):
+    # deltas: {(data, tipo, pago): [entradas, valor]} acumulados por lote
+    for (day, type, paid), (entries, amount) in deltas.items():
+        if entries or amount:
+            apply_cash_flow_delta(db, day, type, paid, amount, entries)
+
+
+@on_primary
+def rebuild_cash_flow_rollup(db: Session, start_date: date = None, end_date: date = None):
+    # Recalcula os totais diários a partir de cash_flow (carga inicial ou correção), incluindo o arquivo
+    cash_flow = with_archive(db, CashFlow, start_date, end_date)
+    delete = db.query(CashFlowDaily)
+    source = db.query(
+        cash_flow.date,
+        func.coalesce(cash_flow.type, literal_column("'entrada'")),
+        func.coalesce(cash_flow.paid, False),
+        func.count(cash_flow.id),
+        func.coalesce(func.sum(cash_flow.amount), 0.0),
+    ).filter(cash_flow.date.isnot(None))
+    if start_date:
+        delete = delete.filter(CashFlowDaily.date >= start_date)
+        source = source.filter(cash_flow.date >= start_date)
+    if end_date:
+        delete = delete.filter(CashFlowDaily.date <= end_date)
+        source = source.filter(cash_flow.date <= end_date)
+    delete.delete(synchronize_session=False)
+    source = source.group_by(
+        cash_flow.date,
+        func.coalesce(cash_flow.type, literal_column("'entrada'")),
+        func.coalesce(cash_flow.paid, False),
+    )
+    db.execute(insert(CashFlowDaily).from_select(
+        ["date", "type", "paid", "entries", "amount"], source
+    ))
+    db.commit()
+
+
+def cash_flow_totals(db: Session, start_date: date, end_date: date):
+    paid_amount = func.sum(CashFlowDaily.amount).filter(CashFlowDaily.paid == True)
+    row = (
+        db.query(
+            func.coalesce(func.sum(CashFlowDaily.amount), 0.0),
+            func.coalesce(paid_amount, 0.0),
+            func.coalesce(func.sum(CashFlowDaily.entries), 0),
+        )
+        .filter(CashFlowDaily.date >= start_date)
+        .filter(CashFlowDaily.date <= end_date)
+        .one()
+    )
+    total, paid, entries = row
+    return {"total": total, "paid": paid, "pending": total - paid, "entries": entries}
+
+
+def _period_bucket(db: Session, period: str):
+    if period == "day":
+        return CashFlowDaily.date
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("month", CashFlowDaily.date)
+    return func.strftime("%Y-%m-01", CashFlowDaily.date)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def cash_flow_breakdown(db: Session, start_date: date, end_date: date, period: str = "day"):
+    bucket = _period_bucket(db, period).label("period")
+    rows = (
+        db.query(
+            bucket,
+            CashFlowDaily.type,
+            CashFlowDaily.paid,
+            func.sum(CashFlowDaily.entries),
+            func.sum(CashFlowDaily.amount),
+        )
+        .filter(CashFlowDaily.date >= start_date)
+        .filter(CashFlowDaily.date <= end_date)
+        .group_by(bucket, CashFlowDaily.type, CashFlowDaily.paid)
+        .order_by(bucket)
+        .all()
+    )
+
+    # Junta pago/pendente na mesma linha de (período, tipo)
+    merged = defaultdict(lambda: {"entries": 0, "paid": 0.0, "pending": 0.0})
+    for bucket_value, type, paid, entries, amount in rows:
+        item = merged[(_as_date(bucket_value), type)]
+        item["entries"] += entries
+        item["paid" if paid else "pending"] += amount
+    return [
+        {"period": key[0], "type": key[1], "entries": item["entries"],
+         "paid": item["paid"], "pending": item["pending"], "total": item["paid"] + item["pending"]}
+        for key, item in sorted(merged.items())
+    ]
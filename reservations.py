@@ -0,0 +1,71 @@
+import logging
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import Appointment
+from utils import format_time
+
+logger = logging.getLogger(__name__)
+
+SLOT_COLUMNS = [Appointment.professional_id, Appointment.date, Appointment.time]
+
+
+class SlotConflictError(ValueError):
+    def __init__(self, professional_id: int, date, time):
+        self.professional_id = professional_id
+        self.date = date
+        self.time = time
+        super().__init__(
+            f"Horário {date.strftime('%d/%m/%Y')} {format_time(time)} já está reservado para este profissional"
+        )
+
+
+def ensure_slot_constraint(conn):
+    # Bancos criados antes da restrição: converte o horário para TIME e cria o índice único
+    # (executado pela migração, dentro da transação dela)
+    if conn.dialect.name == "postgresql":
+        column_type = conn.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'appointments' AND column_name = 'time'"
+        )).scalar()
+        if column_type and column_type != "time without time zone":
+            conn.execute(text(
+                'ALTER TABLE appointments ALTER COLUMN "time" TYPE time USING "time"::time'
+            ))
+    try:
+        with conn.begin_nested():
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_slot "
+                'ON appointments (professional_id, date, "time")'
+            ))
+    except IntegrityError as e:
+        logger.error("Existem consultas duplicadas no mesmo horário; índice único não criado: %s", e.orig)
+
+
+def insert_appointment(db: Session, values: dict):
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING id: None quando o horário já está ocupado
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (
+            insert(Appointment)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=SLOT_COLUMNS)
+            .returning(Appointment.id)
+        )
+        return db.execute(stmt).scalar()
+
+    try:
+        with db.begin_nested():
+            result = db.execute(Appointment.__table__.insert().values(**values))
+        return result.inserted_primary_key[0]
+    except IntegrityError:
+        return None
+
+
+def reserve_slot(db: Session, values: dict):
+    appointment_id = insert_appointment(db, values)
+    if appointment_id is None:
+        raise SlotConflictError(values["professional_id"], values["date"], values["time"])
+    return appointment_id
@@ -0,0 +1,576 @@
+import logging
+import re
+import threading
+import time
+import math
+import unicodedata
+from collections import defaultdict, namedtuple
+from sqlalchemy import case, func, literal_column, text
+from sqlalchemy.orm import Session
+from models import Appointment, Patient, Professional
+from partitions import source
+
+logger = logging.getLogger(__name__)
+
+# Índices trigram para busca de pacientes no PostgreSQL
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() não é IMMUTABLE, então não pode ser usado direto em um índice
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+    $$ SELECT public.unaccent('public.unaccent', $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_patients_name_trgm
+    ON patients USING gin (f_unaccent(lower(name)) gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_patients_phone_trgm
+    ON patients USING gin (regexp_replace(phone, '\\D', '', 'g') gin_trgm_ops)
+    """,
+]
+
+INDEX_MAX_AGE = 600  # segundos até reconstruir o índice em memória
+
+# Busca textual nas observações (e nomes de pacientes): tsvector com índice GIN e stemming em
+# português no PostgreSQL; índice invertido em memória nos demais bancos
+NOTES_CONFIG = "portuguese"
+NOTES_UNACCENT_CONFIG = "pt_unaccent"  # português sem acentos, quando a extensão unaccent existe
+NOTES_PAGE_SIZE = 20
+NOTE_KINDS = ("patient", "appointment")
+HIGHLIGHT_START, HIGHLIGHT_END = "**", "**"  # negrito no Markdown do Streamlit
+SNIPPET_WORDS = 25
+
+NoteMatch = namedtuple("NoteMatch", [
+    "kind", "id", "patient_id", "patient_name", "date", "professional_name", "snippet", "rank"
+])
+NotesPage = namedtuple("NotesPage", ["total", "matches"])
+
+_trigram_support = {}
+_notes_configs = {}
+_fallback_indexes = {}
+_notes_indexes = {}
+_fallback_lock = threading.Lock()
+
+
+def normalize(value: str):
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(value.lower().split())
+
+
+def phone_digits(value: str):
+    return re.sub(r"\D", "", value or "")
+
+
+def phone_term(value: str):
+    # Só trata como telefone termos sem letras ("(11) 9876", "98765-4321")
+    if re.search(r"[^\d\s()+\-.]", value or ""):
+        return ""
+    return phone_digits(value)
+
+
+def _trigrams(value: str):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _escape_like(value: str):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def ensure_patient_search_index(conn):
+    # Executado pela migração, dentro da transação dela
+    if conn.dialect.name != "postgresql":
+        return False
+    key = str(conn.engine.url)
+    try:
+        with conn.begin_nested():
+            for statement in POSTGRES_SEARCH_DDL:
+                conn.execute(text(statement))
+        _trigram_support[key] = True
+    except Exception as e:
+        # Sem permissão para criar extensões: usa o índice em memória
+        logger.warning("Índice trigram indisponível, usando busca em memória: %s", e)
+        _trigram_support[key] = False
+    return _trigram_support[key]
+
+
+def _has_trigram_index(db: Session):
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = str(bind.url)
+    if key not in _trigram_support:
+        found = db.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_patients_name_trgm'"
+        )).first()
+        _trigram_support[key] = found is not None
+    return _trigram_support[key]
+
+
+class PatientSearchIndex:
+    # Índice invertido de trigramas em memória (fallback para SQLite)
+    def __init__(self):
+        self._entries = {}
+        self._name_grams = defaultdict(set)
+        self._phone_grams = defaultdict(set)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.built_at = None
+
+    def build(self, rows):
+        # Monta um índice novo fora do lock (a leitura do banco pode demorar) e troca no final
+        fresh = PatientSearchIndex()
+        for patient_id, name, phone in rows:
+            fresh._add(patient_id, name, phone)
+        with self._lock:
+            self._entries, self._name_grams, self._phone_grams = (
+                fresh._entries, fresh._name_grams, fresh._phone_grams
+            )
+            self.built_at = time.monotonic()
+
+    def add(self, patient_id: int, name: str, phone: str):
+        with self._lock:
+            self._remove(patient_id)
+            self._add(patient_id, name, phone)
+
+    def _add(self, patient_id, name, phone):
+        key = normalize(name)
+        digits = phone_digits(phone)
+        self._entries[patient_id] = (key, digits, name or "")
+        for gram in _trigrams(key):
+            self._name_grams[gram].add(patient_id)
+        for gram in _trigrams(digits):
+            self._phone_grams[gram].add(patient_id)
+
+    def _remove(self, patient_id):
+        entry = self._entries.pop(patient_id, None)
+        if entry:
+            for gram in _trigrams(entry[0]):
+                self._name_grams[gram].discard(patient_id)
+            for gram in _trigrams(entry[1]):
+                self._phone_grams[gram].discard(patient_id)
+
+    def _candidates(self, term, postings, position):
+        grams = _trigrams(term)
+        if not grams:
+            # Termos curtos demais para trigramas: varredura linear
+            return [pid for pid, entry in self._entries.items() if term in entry[position]]
+        sets = sorted((postings.get(g, set()) for g in grams), key=len)
+        ids = set.intersection(*sets) if sets else set()
+        return [pid for pid in ids if term in self._entries[pid][position]]
+
+    def search(self, term: str):
+        key = normalize(term)
+        digits = phone_term(term)
+        with self._lock:
+            matches = {}
+            if key:
+                term_grams = _trigrams(key)
+                for pid in self._candidates(key, self._name_grams, 0):
+                    name_key = self._entries[pid][0]
+                    if name_key.startswith(key):
+                        rank = 0
+                    elif f" {key}" in name_key:
+                        rank = 1
+                    else:
+                        rank = 2
+                    grams = _trigrams(name_key)
+                    similarity = len(grams & term_grams) / len(grams | term_grams) if grams else 0.0
+                    matches[pid] = (rank, -similarity, name_key, pid)
+            if digits:
+                for pid in self._candidates(digits, self._phone_grams, 1):
+                    name_key, phone, _ = self._entries[pid]
+                    rank = (0 if phone.startswith(digits) else 2, 0.0, name_key, pid)
+                    matches[pid] = min(matches.get(pid, rank), rank)
+        return [pid for pid, _ in sorted(matches.items(), key=lambda item: item[1])]
+
+
+def _stale(index):
+    return index.built_at is None or time.monotonic() - index.built_at > INDEX_MAX_AGE
+
+
+def _refresh(index, rows):
+    # Uma reconstrução por vez: enquanto uma sessão reconstrói, as demais continuam usando o índice
+    # anterior; sem índice anterior, esperam a carga em andamento em vez de montar outra
+    if not _stale(index) or not index._build_lock.acquire(blocking=index.built_at is None):
+        return
+    try:
+        if _stale(index):
+            index.build(rows())
+    finally:
+        index._build_lock.release()
+
+
+def _fallback_index(db: Session):
+    key = str(db.get_bind().url)
+    with _fallback_lock:
+        index = _fallback_indexes.setdefault(key, PatientSearchIndex())
+    _refresh(index, lambda: db.query(Patient.id, Patient.name, Patient.phone).yield_per(5000))
+    return index
+
+
+def warm_patient_index(db: Session):
+    # Monta o índice em memória antes das primeiras buscas (ex.: ao iniciar a API)
+    if not _has_trigram_index(db):
+        _fallback_index(db)
+
+
+def index_patient(db: Session, patient_id: int, name: str, phone: str, notes: str = None):
+    # Mantém os índices em memória atualizados após um cadastro
+    index = _fallback_indexes.get(str(db.get_bind().url))
+    if index is not None and index.built_at is not None:
+        index.add(patient_id, name, phone)
+    index_notes(db, "patient", patient_id, f"{name or ''} {notes or ''}")
+
+
+def reset_patient_index(db: Session):
+    # Após cargas em massa o índice em memória é reconstruído na próxima busca
+    index = _fallback_indexes.get(str(db.get_bind().url))
+    if index is not None:
+        index.built_at = None
+
+
+def patient_columns():
+    return (Patient.id, Patient.name, Patient.phone, Patient.email, Patient.birth_date, Patient.notes)
+
+
+def search_patients(db: Session, term: str, limit: int = None, offset: int = 0):
+    key = normalize(term)
+    digits = phone_term(term)
+    if not key and not digits:
+        return []
+
+    if _has_trigram_index(db):
+        name_key = func.f_unaccent(func.lower(Patient.name))
+        conditions = name_key.like(f"%{_escape_like(key)}%", escape="\\")
+        rank = case(
+            (name_key.like(f"{_escape_like(key)}%", escape="\\"), 0),
+            (name_key.like(f"% {_escape_like(key)}%", escape="\\"), 1),
+            else_=2,
+        )
+        if digits:
+            phone_key = func.regexp_replace(Patient.phone, r"\D", "", "g")
+            conditions = conditions | phone_key.like(f"%{digits}%")
+            rank = case((phone_key.like(f"{digits}%"), 0), else_=rank)
+        query = (
+            db.query(*patient_columns())
+            .filter(conditions)
+            .order_by(rank, func.similarity(name_key, key).desc(), Patient.name, Patient.id)
+            .offset(offset)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    ids = _fallback_index(db).search(term)
+    page = ids[offset:offset + limit] if limit is not None else ids[offset:]
+    if not page:
+        return []
+    rows = {row.id: row for row in db.query(*patient_columns()).filter(Patient.id.in_(page))}
+    return [rows[pid] for pid in page if pid in rows]
+
+
+def _regconfig(config: str):
+    # Literal (e não parâmetro) para a expressão da consulta coincidir com a do índice
+    return literal_column(f"'{config}'::regconfig")
+
+
+def _patient_document(config: str):
+    name = func.coalesce(Patient.name, literal_column("''"))
+    notes = func.coalesce(Patient.notes, literal_column("''"))
+    return func.to_tsvector(_regconfig(config), name.op("||")(literal_column("' '")).op("||")(notes))
+
+
+def _appointment_document(config: str, appointment=Appointment):
+    return func.to_tsvector(_regconfig(config), func.coalesce(appointment.notes, literal_column("''")))
+
+
+def ensure_notes_search_index(conn):
+    # Executado pela migração: configuração sem acentos (se possível) e os índices GIN
+    if conn.dialect.name != "postgresql":
+        return None
+    config = NOTES_CONFIG
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+            exists = conn.execute(text(
+                "SELECT 1 FROM pg_ts_config WHERE cfgname = :name"
+            ), {"name": NOTES_UNACCENT_CONFIG}).scalar()
+            if not exists:
+                conn.execute(text(f"CREATE TEXT SEARCH CONFIGURATION {NOTES_UNACCENT_CONFIG} (COPY = portuguese)"))
+                conn.execute(text(
+                    f"ALTER TEXT SEARCH CONFIGURATION {NOTES_UNACCENT_CONFIG} "
+                    "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem"
+                ))
+        config = NOTES_UNACCENT_CONFIG
+    except Exception as e:
+        logger.warning("Extensão unaccent indisponível, busca nas observações diferencia acentos: %s", e)
+    # Mesma expressão das consultas; no PostgreSQL particionado o índice vale para todas as partições
+    for name, table, document in (
+        ("ix_patients_notes_fts", "patients", _patient_document(config)),
+        ("ix_appointments_notes_fts", "appointments", _appointment_document(config)),
+    ):
+        expression = document.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({expression})"))
+    _notes_configs[str(conn.engine.url)] = config
+    return config
+
+
+def _notes_config(db: Session):
+    # Configuração usada pelo índice (a consulta precisa usar a mesma); None fora do PostgreSQL
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return None
+    key = str(bind.url)
+    if key not in _notes_configs:
+        definition = db.execute(text(
+            "SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_patients_notes_fts'"
+        )).scalar()
+        unaccent = definition is not None and f"'{NOTES_UNACCENT_CONFIG}'" in definition
+        _notes_configs[key] = NOTES_UNACCENT_CONFIG if unaccent else NOTES_CONFIG
+    return _notes_configs[key]
+
+
+STOPWORDS = set(normalize(
+    "a à ao aos as às com como da das de dela dele do dos e é em entre era essa esse está foi há isso já "
+    "mais mas me muito na nas não nem no nos o os ou para pela pelas pelo pelos por qual que se sem ser "
+    "seu sua são também te tem um uma umas uns"
+).split())
+# Sufixos removidos pelo stemming simplificado do índice em memória (do mais longo ao mais curto)
+SUFFIXES = (
+    "amente", "mente", "acoes", "acao", "ismo", "ista", "icos", "icas", "ico", "ica", "ivo", "iva",
+    "oso", "osa", "ado", "ada", "ido", "ida", "ao", "ia", "ar", "er", "ir", "o", "a", "e",
+)
+
+
+def stem(word: str):
+    # Aproximação do stemmer português do PostgreSQL: plural e terminações mais comuns
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for plural, singular in (("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ns", "m")):
+        if word.endswith(plural):
+            word = word[:-len(plural)] + singular
+            break
+    else:
+        if word.endswith("s"):
+            word = word[:-1]
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _words(value: str):
+    # (início, fim, termo) de cada palavra do texto original
+    for match in re.finditer(r"\w+", value or ""):
+        key = normalize(match.group())
+        if key and key not in STOPWORDS:
+            yield match.start(), match.end(), stem(key)
+
+
+def query_terms(term: str):
+    return list(dict.fromkeys(word for _, _, word in _words(term)))
+
+
+def highlight(value: str, terms, max_words: int = SNIPPET_WORDS):
+    # Trecho em volta da primeira ocorrência, com os termos encontrados em negrito
+    value = value or ""
+    terms = set(terms)
+    words = list(re.finditer(r"\S+", value))
+    if not words:
+        return ""
+    hits = [(start, end) for start, end, word in _words(value) if word in terms]
+    first = next((i for i, w in enumerate(words) if hits and w.end() > hits[0][0]), 0)
+    begin = max(0, min(first - max_words // 3, len(words) - max_words))
+    window = words[begin:begin + max_words]
+    start, end = window[0].start(), window[-1].end()
+    parts, position = [], start
+    for hit_start, hit_end in hits:
+        if hit_start < start or hit_end > end:
+            continue
+        parts.append(value[position:hit_start])
+        parts.append(f"{HIGHLIGHT_START}{value[hit_start:hit_end]}{HIGHLIGHT_END}")
+        position = hit_end
+    parts.append(value[position:end])
+    return ("… " if begin else "") + "".join(parts) + (" …" if begin + max_words < len(words) else "")
+
+
+class NotesSearchIndex:
+    # Índice invertido das observações em memória (fallback sem PostgreSQL), com ranking BM25
+    def __init__(self):
+        self._postings = defaultdict(dict)  # termo -> {(tipo, id): frequência}
+        self._lengths = {}  # (tipo, id) -> quantidade de termos
+        self._terms = {}  # (tipo, id) -> termos distintos, para remover o documento
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.built_at = None
+
+    def build(self, documents):
+        fresh = NotesSearchIndex()
+        for kind, doc_id, value in documents:
+            fresh._add((kind, doc_id), value)
+        with self._lock:
+            self._postings, self._lengths, self._terms = fresh._postings, fresh._lengths, fresh._terms
+            self.built_at = time.monotonic()
+
+    def update(self, kind: str, doc_id: int, value: str):
+        with self._lock:
+            self._remove((kind, doc_id))
+            if value:
+                self._add((kind, doc_id), value)
+
+    def _add(self, key, value):
+        terms = [word for _, _, word in _words(value)]
+        if not terms:
+            return
+        self._lengths[key] = len(terms)
+        self._terms[key] = set(terms)
+        for word in terms:
+            postings = self._postings[word]
+            postings[key] = postings.get(key, 0) + 1
+
+    def _remove(self, key):
+        self._lengths.pop(key, None)
+        for word in self._terms.pop(key, ()):
+            del self._postings[word][key]
+            if not self._postings[word]:
+                del self._postings[word]
+
+    def search(self, terms, kinds=NOTE_KINDS):
+        # [(pontuação, tipo, id)] dos documentos com todos os termos, do mais relevante ao menos
+        with self._lock:
+            postings = [self._postings.get(word, {}) for word in terms]
+            if not postings or not all(postings):
+                return []
+            count = len(self._lengths)
+            average = sum(self._lengths.values()) / count
+            keys = set.intersection(*[set(p) for p in sorted(postings, key=len)])
+            scores = []
+            for key in keys:
+                if key[0] not in kinds:
+                    continue
+                length = self._lengths[key]
+                score = 0.0
+                for p in postings:
+                    idf = math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5))
+                    tf = p[key]
+                    score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / average))
+                scores.append((score, key[0], key[1]))
+        scores.sort(key=lambda item: (-item[0], item[1], -item[2]))
+        return scores
+
+
+def _notes_documents(db: Session):
+    for patient_id, name, notes in db.query(Patient.id, Patient.name, Patient.notes).yield_per(5000):
+        yield "patient", patient_id, f"{name or ''} {notes or ''}"
+    appointments = db.query(Appointment.id, Appointment.notes).filter(Appointment.notes.isnot(None))
+    for appointment_id, notes in appointments.yield_per(5000):
+        yield "appointment", appointment_id, notes
+
+
+def _notes_index(db: Session):
+    key = str(db.get_bind().url)
+    with _fallback_lock:
+        index = _notes_indexes.setdefault(key, NotesSearchIndex())
+    _refresh(index, lambda: _notes_documents(db))
+    return index
+
+
+def index_notes(db: Session, kind: str, doc_id: int, value: str):
+    # Mantém o índice em memória atualizado após cadastro/edição (value=None remove o documento)
+    index = _notes_indexes.get(str(db.get_bind().url))
+    if index is not None and index.built_at is not None:
+        index.update(kind, doc_id, value)
+
+
+def reset_notes_index(db: Session):
+    index = _notes_indexes.get(str(db.get_bind().url))
+    if index is not None:
+        index.built_at = None
+
+
+def _fetch_matches(db: Session, keys, snippet):
+    # Dados de exibição das linhas da página: (tipo, id) -> NoteMatch sem trecho e pontuação
+    found = {}
+    patient_ids = [doc_id for kind, doc_id in keys if kind == "patient"]
+    appointment_ids = [doc_id for kind, doc_id in keys if kind == "appointment"]
+    if patient_ids:
+        rows = db.query(Patient.id, Patient.name, Patient.notes).filter(Patient.id.in_(patient_ids))
+        for row in rows:
+            found[("patient", row.id)] = NoteMatch(
+                "patient", row.id, row.id, row.name, None, None, snippet(row.notes or row.name), 0.0
+            )
+    if appointment_ids:
+        rows = (
+            db.query(Appointment.id, Appointment.patient_id, Patient.name, Appointment.date, Professional.name,
+                     Appointment.notes)
+            .join(Patient, Appointment.patient_id == Patient.id)
+            .join(Professional, Appointment.professional_id == Professional.id)
+            .filter(Appointment.id.in_(appointment_ids))
+        )
+        for row in rows:
+            found[("appointment", row[0])] = NoteMatch(
+                "appointment", row[0], row[1], row[2], row[3], row[4], snippet(row[5]), 0.0
+            )
+    return found
+
+
+def _headline(config: str, value, query):
+    options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords={SNIPPET_WORDS}, MinWords=10"
+    return func.ts_headline(_regconfig(config), func.coalesce(value, literal_column("''")), query, options)
+
+
+def _search_notes_postgres(db: Session, config: str, term: str, limit: int, offset: int, kinds, include_archive):
+    query = func.websearch_to_tsquery(_regconfig(config), term)
+    window = offset + limit
+    total, matches = 0, []
+    if "patient" in kinds:
+        document = _patient_document(config)
+        total += db.query(func.count(Patient.id)).filter(document.op("@@")(query)).scalar()
+        rank = func.ts_rank_cd(document, query)
+        rows = (
+            db.query(Patient.id, Patient.name, rank, _headline(config, Patient.notes, query))
+            .filter(document.op("@@")(query))
+            .order_by(rank.desc(), Patient.id)
+            .limit(window)
+        )
+        matches += [NoteMatch("patient", r[0], r[0], r[1], None, None, r[3] or r[1], r[2]) for r in rows]
+    if "appointment" in kinds:
+        # Por padrão só a tabela principal; anos arquivados com include_archive (sem índice, mais lento)
+        appointment = source(db, Appointment) if include_archive else Appointment
+        document = _appointment_document(config, appointment)
+        total += db.query(func.count(appointment.id)).filter(document.op("@@")(query)).scalar()
+        rank = func.ts_rank_cd(document, query)
+        rows = (
+            db.query(appointment.id, appointment.patient_id, Patient.name, appointment.date, Professional.name, rank,
+                     _headline(config, appointment.notes, query))
+            .join(Patient, appointment.patient_id == Patient.id)
+            .join(Professional, appointment.professional_id == Professional.id)
+            .filter(document.op("@@")(query))
+            .order_by(rank.desc(), appointment.date.desc(), appointment.id)
+            .limit(window)
+        )
+        matches += [NoteMatch("appointment", r[0], r[1], r[2], r[3], r[4], r[6], r[5]) for r in rows]
+    matches.sort(key=lambda m: -m.rank)
+    return NotesPage(total, matches[offset:window])
+
+
+def search_notes(db: Session, term: str, limit: int = NOTES_PAGE_SIZE, offset: int = 0, kinds=NOTE_KINDS,
+                 include_archive: bool = False):
+    # Observações de pacientes (com o nome) e de consultas, ordenadas por relevância.
+    # Retorna o total de resultados e a página pedida, com os termos destacados no trecho
+    terms = query_terms(term)
+    if not terms:
+        return NotesPage(0, [])
+    config = _notes_config(db)
+    if config is not None:
+        return _search_notes_postgres(db, config, term, limit, offset, kinds, include_archive)
+
+    scores = _notes_index(db).search(terms, kinds)
+    page = scores[offset:offset + limit]
+    found = _fetch_matches(db, [(kind, doc_id) for _, kind, doc_id in page], lambda value: highlight(value, terms))
+    matches = [found[(kind, doc_id)]._replace(rank=score) for score, kind, doc_id in page if (kind, doc_id) in found]
+    return NotesPage(len(scores), matches)
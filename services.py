@@ -0,0 +1,340 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from database import (
+    ReplicaSet, RoutingSession, auto_migrate, client_scope, create_db_engine, get_database_url, get_replica_urls,
+    SessionLocal, get_engine, init_db, pool_setting, replica_lag
+)
+from migrations import check_schema
+from instrumentation import install as install_instrumentation
+from models import Appointment
+from queries import get_appointment, get_clinic_schedule, get_day_schedule, get_patients
+from availability import next_free_slots
+from commands import create_appointment, mark_payment, update_appointment_status
+from reservations import SlotConflictError
+from search import warm_patient_index
+from export import EXPORT_FORMATS, export_columns, export_filename, iter_export
+
+# API HTTP assíncrona (kiosks, check-in, integrações) sobre as mesmas consultas e comandos da interface.
+# Execução: uvicorn services:app --host 0.0.0.0 --port 8000
+
+MAX_PAGE_SIZE = 100
+
+
+def async_database_url(url: str):
+    # Troca o driver síncrono pelo assíncrono equivalente
+    if url.startswith("postgresql+asyncpg") or url.startswith("sqlite+aiosqlite"):
+        return url
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg" + url[url.index(":"):]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite" + url[url.index(":"):]
+    raise ValueError(f"Banco sem driver assíncrono configurado: {url.split(':')[0]}")
+
+
+def create_async_db_engine(url: str, route: str = None):
+    url = async_database_url(url)
+    kwargs = {"pool_pre_ping": True}
+    if url.startswith("postgresql"):
+        kwargs["connect_args"] = {"ssl": os.getenv("DB_SSLMODE", "prefer")}
+        if route:
+            kwargs["connect_args"]["timeout"] = pool_setting("CONNECT_TIMEOUT", route, 3)
+    elif url.startswith("sqlite"):
+        kwargs["connect_args"] = {"timeout": 30}
+    if not (url.startswith("sqlite") and (url.endswith(":memory:") or url.endswith("://"))):
+        kwargs.update(
+            pool_size=pool_setting("POOL_SIZE", route, 10),
+            max_overflow=pool_setting("MAX_OVERFLOW", route, 20),
+            pool_timeout=pool_setting("POOL_TIMEOUT", route, 30),
+        )
+    engine = create_async_engine(url, **kwargs)
+    install_instrumentation(engine.sync_engine)
+    return engine
+
+
+def _encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, time):
+        return value.strftime("%H:%M")
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+class APIResponse(JSONResponse):
+    def render(self, content):
+        return json.dumps(content, default=_encode, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _rows(rows):
+    return [row._asdict() for row in rows]
+
+
+def _appointment(appointment: Appointment):
+    return {
+        column.name: getattr(appointment, column.name)
+        for column in Appointment.__table__.columns
+        if column.name != "created_at"
+    }
+
+
+def _error(message: str, status_code: int):
+    return APIResponse({"error": message}, status_code=status_code)
+
+
+def _date_param(request, name, default=None):
+    value = request.query_params.get(name)
+    if not value:
+        if default is None:
+            raise ValueError(f"parâmetro '{name}' é obrigatório")
+        return default
+    return date.fromisoformat(value)
+
+
+def _int_param(request, name, default=None, maximum=None):
+    value = request.query_params.get(name)
+    if value is None or value == "":
+        return default
+    number = int(value)
+    return min(number, maximum) if maximum else number
+
+
+def _client_id(request):
+    # Read-your-writes por cliente: X-Client-Id (kiosk, integração) ou o endereço de origem
+    return request.headers.get("x-client-id") or (request.client.host if request.client else None)
+
+
+async def run(request, fn, *args, **kwargs):
+    # As funções de queries.py/commands.py rodam sem alteração sobre a sessão assíncrona;
+    # leituras vão para as réplicas (DB_REPLICA_URLS) e comandos para o primário
+    client = _client_id(request)
+
+    def call(db):
+        with client_scope(client):
+            return fn(db, *args, **kwargs)
+
+    async with request.app.state.sessionmaker() as session:
+        return await session.run_sync(call)
+
+
+async def health(request):
+    return APIResponse({"status": "ok"})
+
+
+async def schedule(request):
+    day = _date_param(request, "date", date.today())
+    professional_id = _int_param(request, "professional_id")
+    if professional_id:
+        rows = await run(request, get_day_schedule, day, professional_id)
+    else:
+        rows = await run(request, get_clinic_schedule, day)
+    return APIResponse({"date": day, "appointments": _rows(rows)})
+
+
+# Disponibilidade e pacientes leem direto do banco, sem o reference_cache do processo: ele só é limpo
+# pelas escritas deste processo e não distingue o banco de cada app
+
+async def availability(request):
+    after = request.query_params.get("after")
+    professional_id = _int_param(request, "professional_id")
+    slots = await run(
+        request,
+        next_free_slots,
+        count=_int_param(request, "count", 10, MAX_PAGE_SIZE),
+        specialty=request.query_params.get("specialty") or None,
+        professional_ids=[professional_id] if professional_id else None,
+        after=datetime.fromisoformat(after) if after else None,
+        cached=False,
+    )
+    return APIResponse({"slots": _rows(slots)})
+
+
+async def patients(request):
+    rows = await run(
+        request,
+        get_patients,
+        request.query_params.get("q") or None,
+        limit=_int_param(request, "limit", 20, MAX_PAGE_SIZE),
+        offset=_int_param(request, "offset", 0),
+    )
+    return APIResponse({"patients": _rows(rows)})
+
+
+async def appointment_detail(request):
+    appointment = await run(request, get_appointment, request.path_params["appointment_id"])
+    if appointment is None:
+        return _error("Consulta não encontrada", 404)
+    return APIResponse(_appointment(appointment))
+
+
+async def appointment_create(request):
+    body = await request.json()
+    try:
+        professional_id, patient_id = int(body["professional_id"]), int(body["patient_id"])
+        day = date.fromisoformat(body["date"])
+        slot = body["time"]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"campo obrigatório ausente ou inválido: {e}")
+    appointment = await run(
+        request,
+        create_appointment,
+        day,
+        slot,
+        professional_id,
+        patient_id,
+        insurance_id=body.get("insurance_id"),
+        status=body.get("status", "agendado"),
+        payment_method=body.get("payment_method"),
+        amount=body.get("amount"),
+        notes=body.get("notes"),
+    )
+    return APIResponse(_appointment(appointment), status_code=201)
+
+
+async def appointment_update(request):
+    body = await request.json()
+    if "status" not in body:
+        raise ValueError("campo 'status' é obrigatório")
+    appointment = await run(request, update_appointment_status, request.path_params["appointment_id"], body["status"])
+    if appointment is None:
+        return _error("Consulta não encontrada", 404)
+    return APIResponse(_appointment(appointment))
+
+
+async def appointment_payment(request):
+    body = await request.json()
+    paid = body.get("paid", True)
+    if not isinstance(paid, bool):
+        # bool("false") seria True: só aceita o booleano do JSON
+        raise ValueError("campo 'paid' deve ser true ou false")
+    appointment = await run(
+        request, mark_payment, request.path_params["appointment_id"], paid, body.get("payment_method")
+    )
+    if appointment is None:
+        return _error("Consulta não encontrada", 404)
+    return APIResponse(_appointment(appointment))
+
+
+def _export_stream(sessions, kind, start_date, end_date, fmt):
+    # Gerador síncrono: o Starlette o consome numa thread, com cursor no servidor e sessão própria
+    with sessions() as db:
+        yield from iter_export(db, kind, start_date, end_date, fmt)
+
+
+async def export(request):
+    kind = request.path_params["kind"]
+    export_columns(kind)  # valida o tipo antes de começar a resposta
+    fmt = request.query_params.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"formato de exportação desconhecido: {fmt}")
+    start_date, end_date = _date_param(request, "start"), _date_param(request, "end")
+    return StreamingResponse(
+        _export_stream(request.app.state.export_sessions, kind, start_date, end_date, fmt),
+        media_type="text/csv; charset=utf-8" if fmt == "csv" else "application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(kind, start_date, end_date, fmt)}"'},
+    )
+
+
+async def slot_conflict(request, exc):
+    return _error(str(exc), 409)
+
+
+async def invalid_request(request, exc):
+    return _error(str(exc), 422)
+
+
+async def integrity_error(request, exc):
+    # Ex.: paciente, profissional ou convênio inexistente
+    return _error(str(exc.orig).splitlines()[0], 422)
+
+
+def verify_schema(database_url: str = None):
+    # Sem URL própria a API usa o banco do .env, o mesmo engine do processo (init_db);
+    # com URL, o schema verificado é o desse banco, numa conexão síncrona descartada em seguida
+    if database_url is None:
+        init_db()
+        return
+    engine = create_db_engine(database_url, pool_size=1, max_overflow=0)
+    try:
+        check_schema(engine, apply=auto_migrate())
+    finally:
+        engine.dispose()
+
+
+async def watch_replicas(replicas: ReplicaSet, engines):
+    # Verificação das réplicas no event loop (a thread do ReplicaSet não usa engines assíncronos)
+    while True:
+        for engine in engines:
+            try:
+                async with engine.connect() as conn:
+                    lag = await conn.run_sync(replica_lag)
+            except Exception as e:
+                replicas.record(engine.sync_engine, error=str(e).splitlines()[0])
+            else:
+                replicas.record(engine.sync_engine, lag)
+        await asyncio.sleep(replicas.check_interval)
+
+
+def create_app(database_url: str = None, replica_urls=None):
+    @asynccontextmanager
+    async def lifespan(app):
+        await asyncio.to_thread(verify_schema, database_url)
+        engine = create_async_db_engine(database_url or get_database_url())
+        urls = get_replica_urls() if replica_urls is None else replica_urls
+        replica_engines = [create_async_db_engine(url, route="replica") for url in urls]
+        # A sessão síncrona por trás da AsyncSession recebe os engines síncronos das réplicas
+        replicas = ReplicaSet([e.sync_engine for e in replica_engines]) if replica_engines else None
+        app.state.engine = engine
+        app.state.sessionmaker = async_sessionmaker(
+            engine, expire_on_commit=False, autoflush=False, sync_session_class=RoutingSession, replicas=replicas
+        )
+        # Exportação usa cursor no servidor de uma sessão síncrona: engine síncrono do mesmo banco da API
+        export_engine = None if database_url is None else create_db_engine(database_url)
+        if export_engine is None:
+            get_engine()
+            app.state.export_sessions = SessionLocal
+        else:
+            app.state.export_sessions = sessionmaker(bind=export_engine, autoflush=False)
+        watcher = asyncio.create_task(watch_replicas(replicas, replica_engines)) if replicas else None
+        async with app.state.sessionmaker() as session:
+            await session.run_sync(warm_patient_index)
+        try:
+            yield
+        finally:
+            if watcher:
+                watcher.cancel()
+            await engine.dispose()
+            if export_engine is not None:
+                export_engine.dispose()
+            for replica in replica_engines:
+                await replica.dispose()
+
+    return Starlette(
+        routes=[
+            Route("/health", health),
+            Route("/schedule", schedule),
+            Route("/availability", availability),
+            Route("/patients", patients),
+            Route("/appointments", appointment_create, methods=["POST"]),
+            Route("/appointments/{appointment_id:int}", appointment_detail),
+            Route("/appointments/{appointment_id:int}", appointment_update, methods=["PATCH"]),
+            Route("/appointments/{appointment_id:int}/payment", appointment_payment, methods=["POST"]),
+            Route("/exports/{kind}", export),
+        ],
+        exception_handlers={
+            SlotConflictError: slot_conflict,
+            ValueError: invalid_request,
+            IntegrityError: integrity_error,
+        },
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
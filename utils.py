@@ -0,0 +1,21 @@
+from datetime import datetime, time
+
+
+def parse_time(value):
+    # Aceita "08:00", "08:00:00" ou datetime.time
+    if isinstance(value, time):
+        return value.replace(second=0, microsecond=0)
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.strptime(value.strip(), fmt).time()
+        except (AttributeError, ValueError):
+            pass
+    raise ValueError(f"horário inválido: {value}")
+
+
+def format_time(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        value = parse_time(value)
+    return value.strftime("%H:%M")